@@ -0,0 +1,180 @@
+import { NextRequest, NextResponse } from "next/server"
+import { supabase } from "@/lib/db"
+import type { Event } from "@/lib/types"
+
+// Máximo de eventos aceptados por lote
+const MAX_BATCH_SIZE = 1000
+
+type BulkEvent = {
+  event_type: string
+  stream_id: string
+  user_data?: Record<string, any> | null
+  event_data?: Record<string, any> | null
+}
+
+// Errores de PostgreSQL causados por los datos del evento (clase 22: uuid inválido, etc.;
+// clase 23: FK, NOT NULL): se rechaza ese evento y el resto del lote sigue
+function isDataError(error: any): boolean {
+  return typeof error?.code === "string" && /^2[23]/.test(error.code)
+}
+
+/**
+ * Obtiene o crea el usuario igual que POST /api/events. Dentro de un lote cada
+ * username se resuelve una sola vez (el primer perfil completo actualiza la fila)
+ */
+async function resolveUserId(
+  userData: Record<string, any>,
+  cache: Map<string, string | null>
+): Promise<string | null> {
+  const username = userData.username
+  if (cache.has(username)) {
+    return cache.get(username)!
+  }
+
+  let userId: string | null = null
+  const { data: existingUser } = await supabase
+    .from("users")
+    .select("id")
+    .eq("username", username)
+    .single()
+
+  if (existingUser && userData.profile_unchanged) {
+    // El bot marca perfiles ya enviados sin cambios: no hay nada que actualizar
+    userId = existingUser.id
+  } else if (existingUser) {
+    userId = existingUser.id
+    await supabase
+      .from("users")
+      .update({
+        display_name: userData.display_name,
+        profile_image_url: userData.profile_image_url,
+        follower_count: userData.follower_count,
+        following_count: userData.following_count,
+        is_following_streamer: userData.is_following_streamer,
+        updated_at: new Date().toISOString(),
+      })
+      .eq("id", userId)
+  } else {
+    const { data: newUser, error: userError } = await supabase
+      .from("users")
+      .insert({
+        username,
+        display_name: userData.display_name,
+        profile_image_url: userData.profile_image_url,
+        follower_count: userData.follower_count,
+        following_count: userData.following_count,
+        is_following_streamer: userData.is_following_streamer,
+      })
+      .select("id")
+      .single()
+
+    if (userError) {
+      console.error("Error creating user:", userError)
+    } else {
+      userId = newUser.id
+    }
+  }
+
+  cache.set(username, userId)
+  return userId
+}
+
+/**
+ * Inserta un lote de eventos, en orden, con la misma lógica que POST /api/events.
+ * Formato: { "events": [{ event_type, stream_id, user_data, event_data }, ...] }
+ * (cada elemento tiene el mismo formato que el body de POST /api/events).
+ * Los eventos inválidos o que la base rechaza por sus datos se reportan por índice
+ * en `rejected` y el resto se inserta; si la base no responde, 503
+ */
+export async function POST(request: NextRequest) {
+  try {
+    const body = await request.json()
+    const events: BulkEvent[] = Array.isArray(body?.events) ? body.events : []
+
+    if (events.length === 0) {
+      return NextResponse.json(
+        { error: "Missing required field: events (non-empty array)" },
+        { status: 400 }
+      )
+    }
+
+    if (events.length > MAX_BATCH_SIZE) {
+      return NextResponse.json(
+        { error: `Too many events in batch (max ${MAX_BATCH_SIZE})` },
+        { status: 413 }
+      )
+    }
+
+    const rejected: number[] = []
+    const eventIds: string[] = []
+    const userIds = new Map<string, string | null>()
+
+    for (const [index, event] of events.entries()) {
+      if (!event?.event_type || !event?.stream_id) {
+        rejected.push(index)
+        continue
+      }
+
+      const userId = event.user_data?.username ? await resolveUserId(event.user_data, userIds) : null
+
+      const eventPayload: Partial<Event> = {
+        stream_id: event.stream_id,
+        user_id: userId,
+        event_type: event.event_type as Event["event_type"],
+        content: event.event_data?.content || null,
+        metadata: event.event_data?.metadata || null,
+      }
+
+      const { data: created, error: eventError } = await supabase
+        .from("events")
+        .insert(eventPayload)
+        .select("id")
+        .single()
+
+      if (eventError) {
+        if (!isDataError(eventError)) {
+          throw eventError
+        }
+        console.error(`Error creating event ${index} of batch:`, eventError)
+        rejected.push(index)
+        continue
+      }
+      eventIds.push(created.id)
+
+      // Igual que POST /api/events: la donación se intenta aunque falte el usuario
+      if (event.event_type === "donation" && event.event_data?.donation) {
+        const donationData = event.event_data.donation
+        const { error: donationError } = await supabase.from("donations").insert({
+          event_id: created.id,
+          stream_id: event.stream_id,
+          user_id: userId!,
+          gift_type: donationData.gift_type,
+          gift_name: donationData.gift_name,
+          gift_count: donationData.gift_count || 1,
+          gift_value: donationData.gift_value || null,
+          tiktok_coins: donationData.tiktok_coins || null,
+          gift_image_url: donationData.gift_image_url || null,
+          message: donationData.message || null,
+        })
+
+        if (donationError) {
+          console.error("Error creating donation:", donationError)
+        }
+      }
+    }
+
+    return NextResponse.json({
+      success: true,
+      inserted: eventIds.length,
+      event_ids: eventIds,
+      rejected,
+    })
+  } catch (error) {
+    // Base de datos no disponible: el bot reintenta el lote entero más tarde
+    console.error("Error processing bulk events:", error)
+    return NextResponse.json(
+      { error: "Service unavailable" },
+      { status: 503 }
+    )
+  }
+}
@@ -23,7 +23,10 @@ export async function POST(request: NextRequest) {
         .eq("username", user_data.username)
         .single()
 
-      if (existingUser) {
+      if (existingUser && user_data.profile_unchanged) {
+        // El bot marca perfiles ya enviados sin cambios: no hay nada que actualizar
+        userId = existingUser.id
+      } else if (existingUser) {
         userId = existingUser.id
         // Update user data if changed
         await supabase
@@ -0,0 +1,107 @@
+"""
+Cliente HTTP asíncrono compartido para la API del dashboard
+Mantiene una única sesión aiohttp (keep-alive) reutilizada por el bot y la cola
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from metrics import API_LATENCY, API_REQUESTS
+
+# Timeout (segundos) por endpoint: los eventos son frecuentes y baratos,
+# crear streams/streamers puede tardar más
+ENDPOINT_TIMEOUTS = {
+    "events": 5,
+    "viewer-history": 5,
+    "streams": 10,
+    "streamers": 10,
+}
+DEFAULT_TIMEOUT = 5
+
+
+class ApiClient:
+    def __init__(self, api_url: str, limit: int = 32, dns_cache_ttl: int = 300, keepalive_timeout: float = 30):
+        self.api_url = api_url.rstrip("/")
+        self.limit = limit  # Conexiones simultáneas máximas del pool
+        self.dns_cache_ttl = dns_cache_ttl  # Segundos que se cachea la resolución DNS
+        self.keepalive_timeout = keepalive_timeout  # Segundos que se mantiene viva una conexión ociosa
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Crea la sesión en el primer uso (debe hacerse dentro del event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @staticmethod
+    def endpoint_for(path: str) -> str:
+        """Primer segmento de la ruta (/streams/123 -> streams), salvo /events/bulk"""
+        parts = path.split("?")[0].strip("/").split("/")
+        if parts[:2] == ["events", "bulk"]:
+            return "events/bulk"
+        return parts[0]
+
+    def timeout_for(self, path: str) -> float:
+        """Timeout del endpoint según el primer segmento de la ruta (/streams/123 -> streams)"""
+        endpoint = path.lstrip("/").split("/")[0].split("?")[0]
+        return self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, Any]:
+        """
+        Envía una petición a la API
+
+        Args:
+            timeout: segundos; por defecto el timeout del endpoint (ENDPOINT_TIMEOUTS)
+
+        Returns:
+            (status, body): body es el JSON decodificado o el texto de la respuesta
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: si la API no está disponible
+        """
+        session = self._get_session()
+        endpoint = self.endpoint_for(path)
+        status = "error"
+        started = time.perf_counter()
+        try:
+            async with session.request(
+                method,
+                f"{self.api_url}{path}",
+                json=json,
+                timeout=aiohttp.ClientTimeout(total=timeout or self.timeout_for(path)),
+            ) as response:
+                status = response.status
+                if response.content_type == "application/json":
+                    body = await response.json()
+                else:
+                    body = await response.text()
+                return response.status, body
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, endpoint, method)
+            API_REQUESTS.inc(endpoint, method, status)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Errores que indican que la API no está disponible (equivalen a ConnectionError/Timeout de requests)
+UNAVAILABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
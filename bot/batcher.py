@@ -0,0 +1,190 @@
+"""
+Micro-batching de eventos hacia la API
+Agrupa eventos y los envía en un solo POST /events/bulk cuando el lote se llena
+o cuando el primer evento del lote cumple `max_age` segundos
+"""
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Set, Union
+
+from api_client import ApiClient, UNAVAILABLE_ERRORS
+from records import EventRecord
+from logs import get_logger
+from metrics import EVENTS_DELIVERED
+from tracing import tracer
+
+BULK_PATH = "/events/bulk"
+SINGLE_PATH = "/events"
+
+log = get_logger("batcher")
+
+
+class EventBatcher:
+    """
+    Formato del lote (POST /events/bulk):
+
+        {"events": [{"event_type": ..., "stream_id": ..., "user_data": {...}, "event_data": {...}}, ...]}
+
+    Cada elemento es exactamente el body de POST /events. El lote guarda EventRecord
+    (o dicts ya serializados) y los convierte con to_wire() solo al enviar; al recibir el ACK se
+    registran las latencias por etapa de los EventRecord (tracing.py). Si el endpoint bulk no existe
+    (404/405) se envía evento por evento, en orden dentro de cada stream, y se vuelve a probar bulk
+    cada `bulk_recheck` segundos.
+    """
+
+    def __init__(
+        self,
+        api: ApiClient,
+        on_failure: Callable[[List[Union[EventRecord, Dict]]], None],
+        max_batch: int = 200,
+        max_age: float = 0.25,
+        bulk_recheck: float = 300,
+        single_concurrency: int = 4,
+    ):
+        self.api = api
+        self.on_failure = on_failure  # Recibe los eventos (EventRecord o dict) que no se pudieron enviar
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.bulk_recheck = bulk_recheck
+        self.single_concurrency = single_concurrency  # Streams enviados a la vez sin endpoint bulk
+        self.bulk_supported = True
+        self._bulk_disabled_at = 0.0
+        self._buffer: List[Union[EventRecord, Dict]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self.sent = 0
+        self.batches = 0
+        self.failed = 0
+
+    async def add(self, event: Union[EventRecord, Dict]):
+        """Agrega un evento al lote actual; envía si el lote se llenó"""
+        self._buffer.append(event)
+        if len(self._buffer) >= self.max_batch:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_age, self._flush_by_age)
+
+    def _flush_by_age(self):
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        """Envía el lote actual (si hay eventos)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._buffer = self._buffer, []
+        if batch:
+            await self._send(batch)
+
+    async def close(self):
+        """Envía lo pendiente y espera los envíos en curso"""
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _use_bulk(self) -> bool:
+        if not self.bulk_supported and time.monotonic() - self._bulk_disabled_at >= self.bulk_recheck:
+            self.bulk_supported = True
+        return self.bulk_supported
+
+    async def _send(self, events: List[Union[EventRecord, Dict]]):
+        send_started = time.monotonic()
+        batch = [event if isinstance(event, dict) else event.to_wire() for event in events]
+        if self._use_bulk():
+            try:
+                status, data = await self.api.request("POST", BULK_PATH, json={"events": batch})
+            except UNAVAILABLE_ERRORS:
+                self._fail(events)
+                return
+            except Exception as e:
+                log.error(f"❌ Error enviando lote: {e}")
+                self._fail(events)
+                return
+
+            if status == 200:
+                # La API inserta el resto del lote y reporta por índice los eventos que rechazó
+                rejected = set(self._rejected_positions(data, len(batch)))
+                delivered = [event for position, event in enumerate(events) if position not in rejected]
+                self.sent += len(delivered)
+                self.batches += 1
+                EVENTS_DELIVERED.inc(BULK_PATH, amount=len(delivered))
+                self._trace(delivered, send_started)
+                log.info("✅ Lote de %d eventos enviado correctamente", len(delivered), extra={"kind": "batch.sent"})
+                if rejected:
+                    log.warning(
+                        "⚠️ La API rechazó %d eventos del lote, pasan a la cola",
+                        len(rejected),
+                        extra={"kind": "batch.rejected"},
+                    )
+                    self._fail([events[position] for position in sorted(rejected)])
+                return
+            if status not in (404, 405):
+                log.warning(f"⚠️ Error enviando lote ({status}): {data}")
+                self._fail(events)
+                return
+
+            log.warning(f"⚠️ Endpoint {BULK_PATH} no disponible ({status}), enviando eventos uno por uno")
+            self.bulk_supported = False
+            self._bulk_disabled_at = time.monotonic()
+
+        send_started = time.monotonic()
+        # Uno por uno: en orden dentro de cada stream, con pocos streams en paralelo
+        streams: Dict[Optional[str], List[int]] = {}
+        for position, payload in enumerate(batch):
+            streams.setdefault(payload.get("stream_id"), []).append(position)
+        results = [False] * len(batch)
+        semaphore = asyncio.Semaphore(self.single_concurrency)
+
+        async def send_stream(positions: List[int]):
+            async with semaphore:
+                for position in positions:
+                    results[position] = await self._send_single(batch[position])
+                    if not results[position]:
+                        # El resto del stream va a la cola detrás del fallido, sin adelantarse
+                        return
+
+        await asyncio.gather(*[send_stream(positions) for positions in streams.values()])
+        failed = [event for event, ok in zip(events, results) if not ok]
+        self.sent += len(batch) - len(failed)
+        EVENTS_DELIVERED.inc(SINGLE_PATH, amount=len(batch) - len(failed))
+        self._trace([event for event, ok in zip(events, results) if ok], send_started)
+        if failed:
+            self._fail(failed)
+
+    @staticmethod
+    def _rejected_positions(data, size: int) -> List[int]:
+        rejected = data.get("rejected") if isinstance(data, dict) else None
+        return [position for position in rejected or [] if isinstance(position, int) and 0 <= position < size]
+
+    async def _send_single(self, payload: Dict) -> bool:
+        try:
+            status, data = await self.api.request("POST", SINGLE_PATH, json=payload)
+            if status != 200:
+                log.warning("⚠️ Error enviando evento (%s): %s", status, data, extra={"kind": "batch.event_error"})
+            return status == 200
+        except UNAVAILABLE_ERRORS:
+            return False
+        except Exception as e:
+            log.error("❌ Error enviando evento: %s", e, extra={"kind": "batch.event_error"})
+            return False
+
+    def _trace(self, events: List[Union[EventRecord, Dict]], send_started: float):
+        records = [event for event in events if not isinstance(event, dict)]
+        if records:
+            tracer.delivered(records, send_started, time.monotonic())
+
+    def _fail(self, events: List[Union[EventRecord, Dict]]):
+        self.failed += len(events)
+        self.on_failure(events)
+
+    def get_stats(self) -> Dict:
+        return {
+            "buffered": len(self._buffer),
+            "sent": self.sent,
+            "batches": self.batches,
+            "failed": self.failed,
+            "bulk_supported": self.bulk_supported,
+        }
@@ -0,0 +1,198 @@
+"""
+Micro-benchmark de la normalización por evento (usuario + imagen/coins del regalo)
+Compara las cadenas hasattr/getattr anteriores (_extract_user_info y la búsqueda de
+imagen/coins del regalo en on_gift, sin los print de depuración) con los accessors
+compilados y reutilizados por clase
+
+Uso:
+    python bench_extractors.py [--events 20000]
+"""
+import argparse
+import time
+import typing
+
+from TikTokLive.events import CommentEvent, GiftEvent
+from TikTokLive.proto.custom_proto import ExtendedGift, ExtendedUser
+from TikTokLiveProto.v3.webcast.model.base import ImageModel
+
+from extractors import ExtractorRegistry
+
+
+def sample_events():
+    follow_info_cls = typing.get_args(typing.get_type_hints(ExtendedUser)["follow_info"])[0]
+    user = ExtendedUser(
+        nickname="Ana",
+        display_id="ana_1",
+        avatar_thumb=ImageModel(url_list=["https://example.com/a.jpg"], uri="avatar/a"),
+        follow_info=follow_info_cls(follower_count=120, following_count=30),
+        is_follower=True,
+    )
+    gift = ExtendedGift(
+        id=5655,
+        name="Rose",
+        type=1,
+        diamond_count=1,
+        image=ImageModel(url_list=["https://example.com/rose.png"], uri="gift/rose"),
+    )
+    return [
+        CommentEvent(user=user, comment="hola"),
+        GiftEvent(user=user, gift=gift, repeat_count=3, repeat_end=1),
+    ]
+
+
+def legacy_user_info(event):
+    """_extract_user_info antes de los extractores compilados"""
+    user_info = {}
+    if hasattr(event, 'user_info') and event.user_info:
+        ui = event.user_info
+        if hasattr(ui, 'id'):
+            user_info['user_id'] = ui.id
+        if hasattr(ui, 'nick_name'):
+            user_info['nickname'] = ui.nick_name
+        if hasattr(ui, 'username'):
+            user_info['username'] = ui.username
+        if hasattr(ui, 'sec_uid'):
+            user_info['sec_uid'] = ui.sec_uid
+        if hasattr(ui, 'avatar_thumb') and ui.avatar_thumb:
+            if hasattr(ui.avatar_thumb, 'm_urls') and ui.avatar_thumb.m_urls:
+                user_info['profile_image_url'] = ui.avatar_thumb.m_urls[0]
+            elif hasattr(ui.avatar_thumb, 'uri'):
+                user_info['profile_image_url'] = ui.avatar_thumb.uri
+        if hasattr(ui, 'follow_info') and ui.follow_info:
+            if hasattr(ui.follow_info, 'follower_count'):
+                user_info['follower_count'] = ui.follow_info.follower_count
+            if hasattr(ui.follow_info, 'following_count'):
+                user_info['following_count'] = ui.follow_info.following_count
+        if hasattr(event, 'user_identity') and event.user_identity:
+            if hasattr(event.user_identity, 'is_follower_of_anchor'):
+                user_info['is_following_streamer'] = event.user_identity.is_follower_of_anchor
+    elif hasattr(event, 'user') and event.user:
+        user = event.user
+        if hasattr(user, 'unique_id'):
+            user_info['username'] = user.unique_id
+        if hasattr(user, 'nickname') or hasattr(user, 'nick_name'):
+            user_info['nickname'] = getattr(user, 'nickname', None) or getattr(user, 'nick_name', None)
+        if hasattr(user, 'username'):
+            user_info['username'] = user.username
+        if hasattr(user, 'avatar_thumb') and user.avatar_thumb:
+            if hasattr(user.avatar_thumb, 'm_urls') and user.avatar_thumb.m_urls:
+                user_info['profile_image_url'] = user.avatar_thumb.m_urls[0]
+            elif hasattr(user.avatar_thumb, 'uri'):
+                user_info['profile_image_url'] = user.avatar_thumb.uri
+        elif hasattr(user, 'avatar_large') and user.avatar_large:
+            if hasattr(user.avatar_large, 'm_urls') and user.avatar_large.m_urls:
+                user_info['profile_image_url'] = user.avatar_large.m_urls[0]
+        elif hasattr(user, 'avatar_url') and user.avatar_url:
+            if hasattr(user.avatar_url, 'url'):
+                user_info['profile_image_url'] = user.avatar_url.url
+            elif isinstance(user.avatar_url, str):
+                user_info['profile_image_url'] = user.avatar_url
+        elif hasattr(user, 'profile_picture_url'):
+            user_info['profile_image_url'] = user.profile_picture_url
+        if hasattr(user, 'follow_info') and user.follow_info:
+            if hasattr(user.follow_info, 'follower_count'):
+                user_info['follower_count'] = user.follow_info.follower_count
+            if hasattr(user.follow_info, 'following_count'):
+                user_info['following_count'] = user.follow_info.following_count
+        if 'follower_count' not in user_info and hasattr(user, 'follower_count'):
+            user_info['follower_count'] = user.follower_count
+        if 'following_count' not in user_info and hasattr(user, 'following_count'):
+            user_info['following_count'] = user.following_count
+        if hasattr(user, 'is_following'):
+            user_info['is_following_streamer'] = user.is_following
+        if hasattr(user, 'is_follower'):
+            user_info['is_following_streamer'] = user.is_follower
+    return user_info
+
+
+def legacy_gift_image_url(gift):
+    """Búsqueda de la imagen del regalo en on_gift antes de los extractores compilados"""
+    gift_image_url = None
+    if hasattr(gift, 'image') and gift.image:
+        if hasattr(gift.image, 'm_urls') and gift.image.m_urls:
+            gift_image_url = gift.image.m_urls[0]
+        elif hasattr(gift.image, 'uri'):
+            gift_image_url = gift.image.uri
+        elif hasattr(gift.image, 'url'):
+            gift_image_url = gift.image.url
+        elif isinstance(gift.image, str):
+            gift_image_url = gift.image
+    if not gift_image_url:
+        if hasattr(gift, 'image_url'):
+            gift_image_url = gift.image_url
+        elif hasattr(gift, 'gift_picture_url'):
+            gift_image_url = gift.gift_picture_url
+        elif hasattr(gift, 'picture_url'):
+            gift_image_url = gift.picture_url
+        elif hasattr(gift, 'icon_url'):
+            gift_image_url = gift.icon_url
+    if not gift_image_url and hasattr(gift, 'gift_info'):
+        gift_info = gift.gift_info
+        if hasattr(gift_info, 'image') and gift_info.image:
+            if hasattr(gift_info.image, 'm_urls') and gift_info.image.m_urls:
+                gift_image_url = gift_info.image.m_urls[0]
+            elif hasattr(gift_info.image, 'uri'):
+                gift_image_url = gift_info.image.uri
+        elif hasattr(gift_info, 'image_url'):
+            gift_image_url = gift_info.image_url
+    return gift_image_url
+
+
+def legacy_gift_coins(gift):
+    """Búsqueda de los coins del regalo en on_gift antes de los extractores compilados"""
+    if hasattr(gift, 'diamond_count') and gift.diamond_count is not None:
+        return int(gift.diamond_count)
+    if hasattr(gift, 'coins') and gift.coins is not None:
+        return int(gift.coins)
+    if hasattr(gift, 'diamonds') and gift.diamonds is not None:
+        return int(gift.diamonds)
+    if hasattr(gift, 'amount') and gift.amount is not None:
+        return int(gift.amount)
+    if hasattr(gift, 'gift_info'):
+        gift_info = gift.gift_info
+        for name in ('diamond_count', 'coins', 'diamonds', 'amount'):
+            if hasattr(gift_info, name) and getattr(gift_info, name) is not None:
+                return int(getattr(gift_info, name))
+    return None
+
+
+def legacy_normalize(event):
+    info = legacy_user_info(event)
+    if isinstance(event, GiftEvent):
+        legacy_gift_image_url(event.gift)
+        legacy_gift_coins(event.gift)
+    return info
+
+
+def normalize(registry: ExtractorRegistry, event):
+    info = registry.user_info(event)
+    if isinstance(event, GiftEvent):
+        registry.gift_image_url(event.gift)
+        registry.gift_coins(event.gift)
+    return info
+
+
+def run(events: int):
+    samples = sample_events()
+
+    start = time.perf_counter()
+    for i in range(events):
+        legacy_normalize(samples[i % len(samples)])
+    legacy = (time.perf_counter() - start) / events
+
+    registry = ExtractorRegistry()
+    start = time.perf_counter()
+    for i in range(events):
+        normalize(registry, samples[i % len(samples)])
+    warm = (time.perf_counter() - start) / events
+
+    print(f"📊 {events} eventos (comentarios y regalos alternados)")
+    print(f"   Cadenas hasattr:  {legacy * 1e6:.2f} µs/evento")
+    print(f"   Compilado:        {warm * 1e6:.2f} µs/evento ({legacy / warm:.1f}x)")
+    print(f"   Accessors compilados: {registry.get_stats()['compiled']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de extractores de atributos")
+    parser.add_argument("--events", type=int, default=20000)
+    run(parser.parse_args().events)
@@ -0,0 +1,104 @@
+"""
+Pipeline productor/consumidor entre los handlers de TikTokLive y la API
+Los handlers solo normalizan el evento y lo encolan en memoria; un pool de
+workers lo entrega a la API, así la latencia de la API no frena la captura
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from logs import get_logger
+
+log = get_logger("delivery")
+
+
+class DeliveryPipeline:
+    def __init__(self, workers: int = 4, max_depth: int = 10000, name: str = "entrega"):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.delivered = 0
+        self.errors = 0
+        self.overflows = 0  # Veces que el buffer estaba lleno y el handler tuvo que esperar
+        self.max_depth_seen = 0
+        self._next_depth_warning = max(1, max_depth // 4)
+
+    @property
+    def depth(self) -> int:
+        """Eventos en el buffer esperando a un worker"""
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Inicia los workers (debe llamarse dentro del event loop)"""
+        if self._tasks:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        log.info(f"🚚 Pipeline de {self.name} iniciado ({self.workers} workers, buffer de {self.max_depth})")
+
+    async def submit(self, func: Callable[..., Awaitable[None]], *args):
+        """Encola una entrega. Solo espera si el buffer está lleno"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_depth)
+        try:
+            self._queue.put_nowait((func, args))
+        except asyncio.QueueFull:
+            self.overflows += 1
+            await self._queue.put((func, args))
+
+        depth = self._queue.qsize()
+        if depth > self.max_depth_seen:
+            self.max_depth_seen = depth
+        if depth >= self._next_depth_warning:
+            log.warning(f"⚠️ Buffer de {self.name} en {depth}/{self.max_depth} eventos")
+            self._next_depth_warning += max(1, self.max_depth // 4)
+        elif depth == 0:
+            self._next_depth_warning = max(1, self.max_depth // 4)
+
+    async def _worker(self, index: int):
+        while True:
+            func, args = await self._queue.get()
+            try:
+                await func(*args)
+                self.delivered += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                log.error(f"❌ Error en worker {index} de {self.name}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = 10):
+        """Espera a que los workers entreguen lo que hay en el buffer (siguen corriendo)"""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                log.warning(f"⚠️ Quedaron {self.depth} eventos sin entregar en el buffer de {self.name}")
+
+    async def stop(self, drain: bool = True, timeout: float = 10):
+        """Detiene los workers, entregando antes lo que quede en el buffer"""
+        if drain:
+            await self.drain(timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def get_stats(self) -> Dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "max_depth_seen": self.max_depth_seen,
+            "workers": self.workers,
+            "delivered": self.delivered,
+            "errors": self.errors,
+            "overflows": self.overflows,
+        }
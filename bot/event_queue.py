@@ -5,44 +5,184 @@ Guarda eventos cuando la API está caída y los reenvía cuando está disponible
 import json
 import os
 import asyncio
-import requests
+import time
+import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
+from queue_log import SegmentedLogStore
+from queue_sqlite import SQLiteQueueStore
+from api_client import ApiClient, UNAVAILABLE_ERRORS
+from batcher import BULK_PATH
+from logs import get_logger
+from metrics import EVENTS_FAILED, EVENTS_QUEUED, QUEUE_SENT
+from tracing import tracer, wall_clock
+
+log = get_logger("queue")
+
+# Tipos "último valor gana": solo se conserva el estado más reciente por clave del payload
+COALESCE_KEYS = {
+    "viewer_count": "stream_id",
+    "stream_update": "id",
+}
+
+# Envíos simultáneos máximos por endpoint durante el drenado
+ENDPOINT_LIMITS = {
+    "events": 16,
+    "viewer-history": 4,
+    "streams": 4,
+    "streamers": 1,
+}
+
+# Resultado de enviar un item: los rechazos de la API consumen reintentos; con la API caída
+# (conexión, timeout, 429, 502-504 o un 5xx sin cuerpo JSON) se espera con backoff sin gastarlos
+SENT = "sent"
+UNAVAILABLE = "unavailable"
+REJECTED = "rejected"
+GATEWAY_ERRORS = (502, 503, 504)
+
+# Ids de stream generados localmente mientras la API no responde (se reemplazan al drenar)
+PROVISIONAL_PREFIX = "local-"
+# Días que se conserva la correspondencia id provisional -> id del servidor
+PROVISIONAL_ID_TTL_DAYS = 7
+
+
+def new_provisional_id() -> str:
+    return f"{PROVISIONAL_PREFIX}{uuid.uuid4().hex}"
+
+
+def is_provisional(stream_id: Optional[str]) -> bool:
+    return isinstance(stream_id, str) and stream_id.startswith(PROVISIONAL_PREFIX)
+
+
+def classify_response(status: int, data) -> str:
+    """
+    SENT, UNAVAILABLE o REJECTED según la respuesta. La API responde 500 con
+    {"error": ...} también a errores de datos (FK, uuid inválido): eso es un rechazo
+    del item, no una caída, y consume reintentos
+    """
+    if status in (200, 201):
+        return SENT
+    if status == 429 or status in GATEWAY_ERRORS:
+        return UNAVAILABLE
+    if status >= 500 and not (isinstance(data, dict) and data.get("error")):
+        return UNAVAILABLE
+    return REJECTED
+
+
+class DrainRateLimiter:
+    """
+    Token bucket asíncrono: como máximo `rate` envíos por segundo (ráfagas de hasta
+    `rate`). Limita el drenado para que no acapare la API ni el pool HTTP de la entrega en vivo
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = max(1.0, rate)
+        self._last = time.monotonic()
+        self.waited = 0.0  # Segundos acumulados de espera por el límite
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            wait = (1 - self._tokens) / self.rate
+            self.waited += wait
+            await asyncio.sleep(wait)
+
 
 class EventQueue:
-    def __init__(self, queue_file: str = "event_queue.json", api_url: str = "http://localhost:3000/api"):
+    def __init__(
+        self,
+        queue_file: str = "event_queue.json",
+        api_url: str = "http://localhost:3000/api",
+        backend: Optional[str] = None,
+        api_client: Optional[ApiClient] = None,
+        concurrency: Optional[int] = None,
+        drain_rate: Optional[float] = None,
+        on_resolved: Optional[Callable[[str, str, str], None]] = None,
+    ):
         self.queue_file = Path(queue_file)
         self.api_url = api_url
-        self.max_retries = 3
-        self.retry_delay = 5  # Segundos entre reintentos
+        self.api_client = api_client or ApiClient(api_url)
+        self.max_retries = 3  # Rechazos de la API (4xx) antes de marcar el item como fallido
+        self.retry_delay = 5  # Backoff inicial con la API caída (se duplica hasta max_backoff)
+        self.max_backoff = 120
+        self._unavailable_streak = 0
+        self._retry_after = 0.0  # Instante monotónico antes del cual no se intenta drenar
+        self.batch_size = 500  # Eventos pendientes leídos por lote
+        # `event` consecutivos de un stream se envían juntos por POST /events/bulk
+        self.bulk_size = 200
+        self.bulk_recheck = 300  # Segundos hasta volver a probar bulk tras un 404/405
+        self.bulk_supported = True
+        self._bulk_disabled_at = 0.0
         self.processing = False
-        
-        # Asegurar que el archivo existe
+
+        # Envíos simultáneos durante el drenado (global y por endpoint)
+        self.concurrency = concurrency or int(os.getenv("QUEUE_CONCURRENCY", "16"))
+        self.endpoint_limits = dict(ENDPOINT_LIMITS)
+        # Envíos por segundo al drenar (<= 0: sin límite); el drenado corre junto a la captura en vivo
+        rate = drain_rate if drain_rate is not None else float(os.getenv("QUEUE_DRAIN_RATE", "100"))
+        self.rate_limiter = DrainRateLimiter(rate) if rate > 0 else None
+        self.progress_interval = 2  # Segundos entre reportes de throughput
+        self.last_drain: Dict = {}
+
+        # Backend de almacenamiento: "log" (segmentos de solo-anexar) o "sqlite" (outbox WAL)
+        self.backend = (backend or os.getenv("QUEUE_BACKEND", "log")).lower()
+        if self.backend == "sqlite":
+            self.store = SQLiteQueueStore(self.queue_file.with_suffix(".db"))
+        else:
+            self.store = SegmentedLogStore(self.queue_file.parent / f"{self.queue_file.stem}_segments")
+
+        # Migrar la cola JSON antigua si existe
+        self._migrate_json_queue()
+
+        # (tipo, clave) -> item pendiente que se combina con los nuevos del mismo tipo
+        self._coalesced: Dict[Tuple[str, str], Dict] = {}
+        self._coalesced_ids: Dict[str, Tuple[str, str]] = {}
+        superseded = []
+        for item in self.store.pending_by_type(list(COALESCE_KEYS)):
+            key = self._coalesce_key(item["event_type"], item.get("payload") or {})
+            previous = self._coalesced.get(key)
+            if previous is not None:
+                # Reemplazo que no alcanzó a persistirse antes de una caída
+                superseded.append(previous["id"])
+            self._remember_coalesced(item)
+        self._forget_coalesced(superseded)
+        self.store.ack(superseded)
+
+        # Ids resueltos al drenar: stream provisional -> id del servidor y username -> streamer_id.
+        # Se persisten porque los eventos del stream pueden quedar pendientes tras un reinicio
+        self.on_resolved = on_resolved  # (tipo "stream"/"streamer", clave, id del servidor)
+        self.ids_file = self.queue_file.with_name(f"{self.queue_file.stem}_ids.json")
+        self._resolved_ids = self._load_ids()
+
+    def _migrate_json_queue(self):
+        """Importa una cola JSON antigua (formato previo) al almacenamiento actual"""
         if not self.queue_file.exists():
-            self._save_queue([])
-    
-    def _load_queue(self) -> List[Dict]:
-        """Carga la cola desde el archivo"""
+            return
         try:
-            if not self.queue_file.exists():
-                return []
             with open(self.queue_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                return data if isinstance(data, list) else []
-        except Exception as e:
-            print(f"⚠️ Error cargando cola: {e}")
-            return []
-    
-    def _save_queue(self, queue: List[Dict]):
-        """Guarda la cola en el archivo"""
-        try:
-            with open(self.queue_file, 'w', encoding='utf-8') as f:
-                json.dump(queue, f, indent=2, ensure_ascii=False)
+            queue = data if isinstance(data, list) else []
+            migrated = 0
+            for item in queue:
+                if item.get("status") == "sent":
+                    continue
+                item.pop("id", None)
+                self.store.append(item)
+                migrated += 1
+            self.queue_file.rename(self.queue_file.with_suffix(self.queue_file.suffix + ".migrated"))
+            if migrated:
+                log.info(f"📦 Cola JSON migrada: {migrated} eventos importados desde {self.queue_file.name}")
         except Exception as e:
-            print(f"⚠️ Error guardando cola: {e}")
-    
-    def add_event(self, event_type: str, payload: Dict, priority: int = 0):
+            log.warning(f"⚠️ Error migrando cola JSON: {e}")
+
+    def add_event(self, event_type: str, payload: Dict, priority: int = 0, received_at: Optional[float] = None):
         """
         Agrega un evento a la cola
         
@@ -50,9 +190,10 @@ class EventQueue:
             event_type: Tipo de evento ('event', 'viewer_count', 'viewer_history', 'stream_update')
             payload: Datos del evento
             priority: Prioridad (0 = normal, 1 = alta, 2 = crítica)
+            received_at: Instante monotónico de recepción del evento (se persiste como epoch
+                para medir la latencia hasta el ACK aunque se reintente tras reiniciar)
         """
         queue_item = {
-            "id": f"{datetime.utcnow().isoformat()}_{event_type}_{len(self._load_queue())}",
             "event_type": event_type,
             "payload": payload,
             "priority": priority,
@@ -60,149 +201,514 @@ class EventQueue:
             "retry_count": 0,
             "status": "pending"
         }
+        if received_at is not None:
+            queue_item["received_at"] = wall_clock(received_at)
         
-        queue = self._load_queue()
-        # Insertar según prioridad (mayor prioridad primero)
-        inserted = False
-        for i, item in enumerate(queue):
-            if item.get("priority", 0) < priority:
-                queue.insert(i, queue_item)
-                inserted = True
-                break
+        key = self._coalesce_key(event_type, payload)
+        previous = self._coalesced.get(key) if key else None
+        if previous is not None:
+            # Combinar con el pendiente anterior: se conservan sus campos y ganan los nuevos
+            queue_item["payload"] = {**previous["payload"], **payload}
+            queue_item["priority"] = max(priority, previous.get("priority", 0))
+            self._forget_coalesced([previous["id"]])
+            self.store.supersede(previous["id"], queue_item)
+            self._remember_coalesced(queue_item)
+            return
         
-        if not inserted:
-            queue.append(queue_item)
+        self.store.append(queue_item)
+        if key:
+            self._remember_coalesced(queue_item)
+        EVENTS_QUEUED.inc(event_type)
+        log.debug("📦 Evento agregado a la cola: %s", event_type, extra={"kind": "queue.add"})
+    
+    def _coalesce_key(self, event_type: str, payload: Dict) -> Optional[Tuple[str, str]]:
+        field = COALESCE_KEYS.get(event_type)
+        if not field or not payload.get(field):
+            return None
+        return event_type, str(payload[field])
+    
+    def _remember_coalesced(self, item: Dict):
+        key = self._coalesce_key(item["event_type"], item.get("payload") or {})
+        if key:
+            self._coalesced[key] = item
+            self._coalesced_ids[item["id"]] = key
+    
+    def _forget_coalesced(self, ids: List[str]):
+        """Olvida items combinables que ya se enviaron, fallaron o fueron reemplazados"""
+        for item_id in ids:
+            key = self._coalesced_ids.pop(item_id, None)
+            if key and self._coalesced.get(key, {}).get("id") == item_id:
+                del self._coalesced[key]
+    
+    def _load_ids(self) -> Dict[str, Dict]:
+        ids = {"streams": {}, "streamers": {}}
+        if self.ids_file.exists():
+            try:
+                with open(self.ids_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for kind in ids:
+                    ids[kind].update(data.get(kind) or {})
+            except (OSError, ValueError) as e:
+                log.warning(f"⚠️ Ids resueltos ilegibles ({self.ids_file}), se ignoran: {e}")
+        # Las correspondencias viejas ya no tienen eventos pendientes
+        cutoff = time.time() - PROVISIONAL_ID_TTL_DAYS * 86400
+        for entries in ids.values():
+            for key in [key for key, entry in entries.items() if entry.get("at", 0) < cutoff]:
+                del entries[key]
+        return ids
+
+    def _save_ids(self):
+        tmp = self.ids_file.with_suffix(self.ids_file.suffix + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._resolved_ids, f)
+            os.replace(tmp, self.ids_file)
+        except OSError as e:
+            log.warning(f"⚠️ No se pudieron guardar los ids resueltos: {e}")
+
+    def server_stream_id(self, stream_id: Optional[str]) -> Optional[str]:
+        """Id del servidor de un stream provisional ya creado (o el mismo id si no es provisional)"""
+        if is_provisional(stream_id):
+            entry = self._resolved_ids["streams"].get(stream_id)
+            if entry and entry.get("id"):
+                return entry["id"]
+        return stream_id
+
+    def _orphaned(self, item: Dict) -> bool:
+        """El item apunta a un stream provisional cuyo stream_create falló: nunca se podrá enviar"""
+        stream_id = self._stream_ref(item)
+        if item["event_type"] == "stream_create" or not is_provisional(stream_id):
+            return False
+        entry = self._resolved_ids["streams"].get(stream_id)
+        return bool(entry and entry.get("failed"))
+
+    def _record_failed_stream(self, item: Dict):
+        """Marca el stream provisional de un stream_create fallido (sus eventos fallan sin enviarse)"""
+        provisional_id = (item.get("payload") or {}).get("provisional_id")
+        if item["event_type"] != "stream_create" or not provisional_id:
+            return
+        self._resolved_ids["streams"][provisional_id] = {"id": None, "failed": True, "at": time.time()}
+        self._save_ids()
+        log.error(f"❌ Stream provisional {provisional_id} no se pudo crear; sus eventos se marcan como fallidos")
+
+    def _streamer_id(self, payload: Dict) -> Optional[str]:
+        """
+        streamer_id para un stream_create: el resuelto por la cola tiene precedencia sobre el
+        del payload (None mientras se registra de nuevo un streamer_id que la API rechazó)
+        """
+        entry = self._resolved_ids["streamers"].get(payload.get("streamer_username"))
+        if entry:
+            return entry.get("id")
+        return payload.get("streamer_id")
+
+    def _invalidate_streamer(self, item: Dict):
+        """
+        La API rechazó un stream_create: su streamer_id puede ser de una BD reiniciada. Se
+        olvida y se encola el registro del streamer; el stream_create espera detrás de él
+        """
+        payload = item.get("payload") or {}
+        username = payload.get("streamer_username")
+        if item["event_type"] != "stream_create" or not username:
+            return
+        entry = self._resolved_ids["streamers"].get(username)
+        if entry and not entry.get("id"):
+            return  # Ya se está registrando de nuevo
+        self._resolved_ids["streamers"][username] = {"id": None, "at": time.time()}
+        self._save_ids()
+        log.warning(f"⚠️ stream_create rechazado, se registra de nuevo el streamer @{username}")
+        self.add_event("streamer", {"username": username, "display_name": username}, priority=2)
+
+    def _record_resolved(self, item: Dict, data):
+        """Registra el id que asignó la API a un streamer o stream creado desde la cola"""
+        payload = item["payload"]
+        server_id = data.get("id") if isinstance(data, dict) else None
+        if item["event_type"] == "streamer":
+            kind, key = "streamers", payload.get("username")
+        elif item["event_type"] == "stream_create" and payload.get("provisional_id"):
+            kind, key = "streams", payload["provisional_id"]
+        else:
+            return
+        if not key or not server_id:
+            log.warning(f"⚠️ La API no devolvió id para {item['event_type']} {key}")
+            return
+        self._resolved_ids[kind][key] = {"id": server_id, "at": time.time()}
+        self._save_ids()
+        if kind == "streams":
+            log.info(f"🔗 Stream provisional {key} creado en la API como {server_id}")
+        if self.on_resolved:
+            try:
+                self.on_resolved(kind[:-1], key, server_id)
+            except Exception as e:
+                log.warning(f"⚠️ Error notificando id resuelto: {e}")
+
+    def _with_server_ids(self, event_type: str, payload: Dict) -> Dict:
+        """Reemplaza ids provisionales por los del servidor (y quita los campos locales)"""
+        if event_type == "stream_create":
+            body = {k: v for k, v in payload.items() if k not in ("provisional_id", "streamer_username")}
+            body["streamer_id"] = self._streamer_id(payload)
+            if is_provisional(body.get("parent_stream_id")):
+                body["parent_stream_id"] = self.server_stream_id(body["parent_stream_id"])
+            return body
+        field = "id" if event_type == "stream_update" else "stream_id"
+        if is_provisional(payload.get(field)):
+            return {**payload, field: self.server_stream_id(payload[field])}
+        return payload
+
+    def _route(self, item: Dict) -> Optional[Tuple[str, str, Dict]]:
+        """Retorna (método, ruta, cuerpo) para un item de la cola"""
+        event_type = item["event_type"]
+        payload = self._with_server_ids(event_type, item["payload"])
         
-        self._save_queue(queue)
-        print(f"📦 Evento agregado a la cola: {event_type} (Total en cola: {len(queue)})")
+        if event_type == "event":
+            return "POST", "/events", payload
+        if event_type == "viewer_count":
+            return "PATCH", f"/streams/{payload.get('stream_id')}", {"viewer_count": payload.get("viewer_count")}
+        if event_type == "viewer_history":
+            return "POST", "/viewer-history", payload
+        if event_type == "stream_update":
+            # Para updates de stream (ended_at, title, etc)
+            return "PATCH", f"/streams/{payload.get('id')}", {k: v for k, v in payload.items() if k != 'id'}
+        if event_type == "streamer":
+            return "POST", "/streamers", payload
+        if event_type == "stream_create":
+            return "POST", "/streams", payload
+        return None
+    
+    def _stream_ref(self, item: Dict) -> Optional[str]:
+        """Stream del que depende el item (el provisional que crea, en el caso de stream_create)"""
+        payload = item.get("payload") or {}
+        event_type = item["event_type"]
+        if event_type == "stream_create":
+            return payload.get("provisional_id")
+        if event_type == "stream_update":
+            return payload.get("id")
+        return payload.get("stream_id")
+
+    def _dependency_roots(self, items: List[Dict]) -> Dict[str, str]:
+        """
+        Stream provisional -> grupo de su stream_create. Si el streamer tampoco está
+        registrado, el stream_create (y con él sus eventos) va detrás del registro
+        """
+        roots = {}
+        for item in items:
+            payload = item.get("payload") or {}
+            if item["event_type"] == "stream_create" and payload.get("provisional_id"):
+                if self._streamer_id(payload):
+                    roots[payload["provisional_id"]] = f"stream:{payload['provisional_id']}"
+                else:
+                    roots[payload["provisional_id"]] = f"streamer:{payload.get('streamer_username')}"
+        return roots
+
+    def _ordering_key(self, item: Dict, roots: Optional[Dict[str, str]] = None) -> str:
+        """Items con la misma clave se envían en orden, uno tras otro"""
+        if item["event_type"] == "streamer":
+            return f"streamer:{(item.get('payload') or {}).get('username')}"
+        stream_id = self.server_stream_id(self._stream_ref(item))
+        if not stream_id:
+            return f"type:{item['event_type']}"
+        if roots and stream_id in roots:
+            return roots[stream_id]
+        return f"stream:{stream_id}"
     
     async def process_queue(self):
-        """Procesa la cola intentando enviar eventos pendientes"""
-        if self.processing:
+        """
+        Drena la cola enviando eventos pendientes en paralelo.
+        
+        Los items se agrupan por stream_id: cada grupo se envía en orden y se detiene
+        en el primer fallo, mientras que grupos distintos avanzan en paralelo limitados
+        por `concurrency` y por `endpoint_limits`. Dentro de un grupo los `event`
+        consecutivos van en lotes por POST /events/bulk, así que el backlog de un solo
+        stream tampoco se envía de a un evento por petición.
+        """
+        if self.processing or time.monotonic() < self._retry_after:
             return
         
         self.processing = True
+        reporter = None
         try:
-            queue = self._load_queue()
-            if not queue:
+            total_pending = self.store.count_pending()
+            if not total_pending:
                 return
             
-            pending_events = [e for e in queue if e.get("status") == "pending"]
-            if not pending_events:
-                return
+            log.info(f"🔄 Procesando cola: {total_pending} eventos pendientes")
             
-            print(f"🔄 Procesando cola: {len(pending_events)} eventos pendientes")
+            global_semaphore = asyncio.Semaphore(self.concurrency)
+            endpoint_semaphores = {
+                endpoint: asyncio.Semaphore(limit) for endpoint, limit in self.endpoint_limits.items()
+            }
+            progress = {"sent": 0, "failed": 0, "unavailable": False, "started": time.monotonic()}
+            reporter = asyncio.create_task(self._report_progress(progress, total_pending))
             
-            processed = []
-            for item in pending_events:
-                if item.get("retry_count", 0) >= self.max_retries:
-                    item["status"] = "failed"
-                    item["error"] = "Max retries exceeded"
-                    print(f"❌ Evento {item['id']} excedió máximo de reintentos")
-                    continue
+            while True:
+                # Leer solo el siguiente lote en orden de prioridad
+                pending_events = self.store.pending(limit=self.batch_size)
+                if not pending_events:
+                    break
                 
-                success = await self._send_event(item)
-                if success:
-                    item["status"] = "sent"
-                    item["sent_at"] = datetime.utcnow().isoformat()
-                    processed.append(item["id"])
-                    print(f"✅ Evento {item['id']} enviado correctamente")
-                else:
-                    item["retry_count"] = item.get("retry_count", 0) + 1
-                    item["last_retry"] = datetime.utcnow().isoformat()
-                    print(f"⚠️ Evento {item['id']} falló, reintento {item['retry_count']}/{self.max_retries}")
-            
-            # Actualizar cola removiendo eventos enviados
-            queue = [e for e in queue if e["id"] not in processed]
-            self._save_queue(queue)
+                # Los items de un stream provisional van en el grupo de su stream_create
+                # (que llega primero por prioridad): nada se envía antes de que el stream exista
+                roots = self._dependency_roots(pending_events)
+                groups: Dict[str, List[Dict]] = {}
+                for item in pending_events:
+                    groups.setdefault(self._ordering_key(item, roots), []).append(item)
+                for items in groups.values():
+                    # El registro del streamer va antes que los stream_create que esperan su id
+                    items.sort(key=lambda item: item["event_type"] != "streamer")
+                
+                processed: List[str] = []
+                updated: List[Dict] = []
+                results = await asyncio.gather(*[
+                    self._drain_group(items, global_semaphore, endpoint_semaphores, processed, updated, progress)
+                    for items in groups.values()
+                ])
+                
+                # Confirmar enviados y persistir reintentos
+                self.store.update(updated)
+                self.store.ack(processed)
+                self._forget_coalesced(processed)
+                self._forget_coalesced([item["id"] for item in updated if item.get("status") == "failed"])
+                
+                # Si hubo fallos la API probablemente sigue caída: esperar al siguiente ciclo
+                if not all(results) or len(pending_events) < self.batch_size:
+                    break
             
-            if processed:
-                print(f"✅ {len(processed)} eventos procesados exitosamente")
+            self.last_drain = self._drain_stats(progress)
+            if progress["unavailable"]:
+                # API caída: los items conservan sus reintentos y el drenado espera cada vez más
+                self._unavailable_streak += 1
+                delay = min(self.retry_delay * 2 ** (self._unavailable_streak - 1), self.max_backoff)
+                self._retry_after = time.monotonic() + delay
+                log.warning(
+                    f"⚠️ API no disponible al drenar la cola, próximo intento en {delay:.0f}s",
+                    extra={"kind": "queue.unavailable"},
+                )
+            else:
+                self._unavailable_streak = 0
+            if progress["sent"]:
+                log.info(
+                    f"✅ {progress['sent']} eventos procesados exitosamente "
+                    f"en {self.last_drain['seconds']:.1f}s ({self.last_drain['rate']:.1f} ev/s)"
+                )
         
         except Exception as e:
-            print(f"❌ Error procesando cola: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error procesando cola: {e}")
         finally:
+            if reporter:
+                reporter.cancel()
             self.processing = False
     
-    async def _send_event(self, item: Dict) -> bool:
-        """Intenta enviar un evento a la API"""
-        event_type = item["event_type"]
-        payload = item["payload"]
-        
-        try:
-            if event_type == "event":
-                response = requests.post(
-                    f"{self.api_url}/events",
-                    json=payload,
-                    timeout=5,
-                )
-            elif event_type == "viewer_count":
-                response = requests.patch(
-                    f"{self.api_url}/streams/{payload.get('stream_id')}",
-                    json={"viewer_count": payload.get("viewer_count")},
-                    timeout=5,
-                )
-            elif event_type == "viewer_history":
-                response = requests.post(
-                    f"{self.api_url}/viewer-history",
-                    json=payload,
-                    timeout=5,
-                )
-            elif event_type == "stream_update":
-                # Para updates de stream (ended_at, title, etc)
-                response = requests.patch(
-                    f"{self.api_url}/streams/{payload.get('id')}",
-                    json={k: v for k, v in payload.items() if k != 'id'},
-                    timeout=5,
-                )
-            elif event_type == "streamer":
-                response = requests.post(
-                    f"{self.api_url}/streamers",
-                    json=payload,
-                    timeout=10,
-                )
-            elif event_type == "stream_create":
-                response = requests.post(
-                    f"{self.api_url}/streams",
-                    json=payload,
-                    timeout=10,
+    async def _drain_group(
+        self,
+        items: List[Dict],
+        global_semaphore: asyncio.Semaphore,
+        endpoint_semaphores: Dict[str, asyncio.Semaphore],
+        processed: List[str],
+        updated: List[Dict],
+        progress: Dict,
+    ) -> bool:
+        """Envía en orden los items de un mismo stream. Retorna False si alguno falló"""
+        index = 0
+        while index < len(items):
+            item = items[index]
+            if item.get("retry_count", 0) >= self.max_retries:
+                item["status"] = "failed"
+                item["error"] = "Max retries exceeded"
+                updated.append(item)
+                EVENTS_FAILED.inc(item["event_type"])
+                log.error("❌ Evento %s excedió máximo de reintentos", item["id"], extra={"kind": "queue.failed"})
+                self._record_failed_stream(item)
+                index += 1
+                continue
+            if self._orphaned(item):
+                item["status"] = "failed"
+                item["error"] = "Provisional stream was never created"
+                updated.append(item)
+                EVENTS_FAILED.inc(item["event_type"])
+                log.error("❌ Evento %s sin stream creado en la API", item["id"], extra={"kind": "queue.failed"})
+                index += 1
+                continue
+            
+            chunk = self._bulk_chunk(items, index)
+            index += len(chunk)
+            if len(chunk) > 1:
+                result, rejected = await self._send_limited(
+                    self._send_bulk(chunk), "events", global_semaphore, endpoint_semaphores
                 )
-            else:
-                print(f"⚠️ Tipo de evento desconocido: {event_type}")
-                return False
+                if result == UNAVAILABLE:
+                    progress["unavailable"] = True
+                    return False
+                if result == SENT:
+                    for position, sent in enumerate(chunk):
+                        if position in rejected:
+                            self._mark_rejected(sent, updated, progress)
+                        else:
+                            self._mark_sent(sent, processed, progress)
+                    if rejected:
+                        return False
+                    continue
+                # Lote rechazado entero (4xx o 5xx) o sin endpoint bulk: uno por uno para aislar el evento malo
             
-            return response.status_code in [200, 201]
+            for single in chunk:
+                route = self._route(single)
+                endpoint = route[1].strip("/").split("/")[0] if route else None
+                result = await self._send_limited(
+                    self._send_event(single), endpoint, global_semaphore, endpoint_semaphores
+                )
+                if result == SENT:
+                    self._mark_sent(single, processed, progress)
+                elif result == UNAVAILABLE:
+                    # No cuenta como reintento: el item (y el resto del stream) espera al backoff
+                    progress["unavailable"] = True
+                    return False
+                else:
+                    self._mark_rejected(single, updated, progress)
+                    # Mantener el orden: el resto del stream espera al siguiente ciclo
+                    return False
+        return True
+    
+    def _bulk_chunk(self, items: List[Dict], start: int) -> List[Dict]:
+        """`event` consecutivos desde `start` (hasta `bulk_size`) que van en un mismo lote"""
+        chunk = [items[start]]
+        if chunk[0]["event_type"] != "event" or not self._use_bulk():
+            return chunk
+        for item in items[start + 1:start + self.bulk_size]:
+            if item["event_type"] != "event" or item.get("retry_count", 0) >= self.max_retries:
+                break
+            chunk.append(item)
+        return chunk
+    
+    def _use_bulk(self) -> bool:
+        if not self.bulk_supported and time.monotonic() - self._bulk_disabled_at >= self.bulk_recheck:
+            self.bulk_supported = True
+        return self.bulk_supported
+    
+    async def _send_limited(
+        self,
+        send: Awaitable,
+        endpoint: Optional[str],
+        global_semaphore: asyncio.Semaphore,
+        endpoint_semaphores: Dict[str, asyncio.Semaphore],
+    ):
+        """Espera al límite de envíos por segundo y a los semáforos (global y del endpoint)"""
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        endpoint_semaphore = endpoint_semaphores.get(endpoint)
+        if endpoint_semaphore:
+            async with endpoint_semaphore, global_semaphore:
+                return await send
+        async with global_semaphore:
+            return await send
+    
+    def _mark_sent(self, item: Dict, processed: List[str], progress: Dict):
+        processed.append(item["id"])
+        progress["sent"] += 1
+        QUEUE_SENT.inc(item["event_type"])
+        tracer.queue_delivered(item)
+    
+    def _mark_rejected(self, item: Dict, updated: List[Dict], progress: Dict):
+        self._invalidate_streamer(item)
+        item["retry_count"] = item.get("retry_count", 0) + 1
+        item["last_retry"] = datetime.utcnow().isoformat()
+        updated.append(item)
+        progress["failed"] += 1
+        log.warning(
+            "⚠️ Evento %s falló, reintento %d/%d",
+            item["id"],
+            item["retry_count"],
+            self.max_retries,
+            extra={"kind": "queue.retry"},
+        )
+    
+    def _drain_stats(self, progress: Dict) -> Dict:
+        seconds = max(time.monotonic() - progress["started"], 1e-6)
+        return {
+            "sent": progress["sent"],
+            "failed": progress["failed"],
+            "seconds": seconds,
+            "rate": progress["sent"] / seconds,
+        }
+    
+    async def _report_progress(self, progress: Dict, total: int):
+        """Imprime el throughput del drenado (eventos/s) mientras está en curso"""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            stats = self._drain_stats(progress)
+            log.info(f"📊 Drenando cola: {stats['sent']}/{total} enviados ({stats['rate']:.1f} ev/s)")
+    
+    async def _send_event(self, item: Dict) -> str:
+        """Intenta enviar un evento a la API. Retorna SENT, UNAVAILABLE o REJECTED"""
+        route = self._route(item)
+        if route is None:
+            log.warning(f"⚠️ Tipo de evento desconocido: {item['event_type']}")
+            return REJECTED
         
-        except requests.exceptions.ConnectionError:
-            # API no disponible
-            return False
-        except requests.exceptions.Timeout:
-            # Timeout
-            return False
+        method, path, body = route
+        try:
+            status, data = await self.api_client.request(method, path, json=body)
+            result = classify_response(status, data)
+            if result == SENT:
+                self._record_resolved(item, data)
+            return result
+        except UNAVAILABLE_ERRORS:
+            # API no disponible o timeout
+            return UNAVAILABLE
         except Exception as e:
-            print(f"⚠️ Error enviando evento {item['id']}: {e}")
-            return False
+            log.warning("⚠️ Error enviando evento %s: %s", item["id"], e, extra={"kind": "queue.send_error"})
+            return REJECTED
+    
+    async def _send_bulk(self, items: List[Dict]) -> Tuple[str, List[int]]:
+        """
+        Envía `event` por POST /events/bulk. Retorna (SENT, posiciones que la API rechazó),
+        (UNAVAILABLE, []) o (REJECTED, []) si hay que reintentarlos uno por uno
+        """
+        body = {"events": [self._with_server_ids("event", item["payload"]) for item in items]}
+        try:
+            status, data = await self.api_client.request("POST", BULK_PATH, json=body)
+        except UNAVAILABLE_ERRORS:
+            return UNAVAILABLE, []
+        except Exception as e:
+            log.warning("⚠️ Error enviando lote de la cola: %s", e, extra={"kind": "queue.send_error"})
+            return REJECTED, []
+        if status == 429 or status in GATEWAY_ERRORS:
+            # La API rechaza los eventos malos por índice y responde 503 si la base no está
+            return UNAVAILABLE, []
+        if status >= 500:
+            # Otro 5xx hace fallar el lote entero: uno por uno solo se pierde el evento malo
+            return REJECTED, []
+        if status in (404, 405):
+            log.warning(f"⚠️ Endpoint {BULK_PATH} no disponible ({status}), drenando la cola evento por evento")
+            self.bulk_supported = False
+            self._bulk_disabled_at = time.monotonic()
+            return REJECTED, []
+        if status not in [200, 201]:
+            return REJECTED, []
+        rejected = data.get("rejected") if isinstance(data, dict) else None
+        return SENT, [position for position in rejected or [] if isinstance(position, int)]
     
     def get_queue_size(self) -> int:
         """Retorna el número de eventos pendientes en la cola"""
-        queue = self._load_queue()
-        return len([e for e in queue if e.get("status") == "pending"])
+        return self.store.count_pending()
     
-    def clear_sent_events(self):
-        """Limpia eventos que ya fueron enviados (mantiene solo pendientes y fallidos)"""
-        queue = self._load_queue()
-        queue = [e for e in queue if e.get("status") != "sent"]
-        self._save_queue(queue)
+    async def compact(self):
+        """Mantenimiento periódico del almacenamiento (lo ejecuta el planificador, fuera del drenado)"""
+        if self.processing:
+            return
+        await self.store.compact()
     
+    def close(self):
+        """Persiste los ACKs pendientes y cierra el almacenamiento (al detener el bot)"""
+        self.store.close()
+
+    def get_pending_by_priority(self) -> Dict[int, int]:
+        """Elementos pendientes por prioridad"""
+        return self.store.count_pending_by_priority()
+
     def get_stats(self) -> Dict:
         """Retorna estadísticas de la cola"""
-        queue = self._load_queue()
+        pending = self.store.count_pending()
+        failed = self.store.count_failed()
         return {
-            "total": len(queue),
-            "pending": len([e for e in queue if e.get("status") == "pending"]),
-            "sent": len([e for e in queue if e.get("status") == "sent"]),
-            "failed": len([e for e in queue if e.get("status") == "failed"]),
+            "total": pending + failed,
+            "pending": pending,
+            "failed": failed,
         }
-
@@ -0,0 +1,247 @@
+"""
+Extractores de atributos compilados por clase
+Los eventos de TikTokLive son mensajes protobuf: todas las instancias de una misma
+clase tienen los mismos atributos. En vez de recorrer cadenas de hasattr/getattr en
+cada evento, se resuelve una sola vez por clase concreta (evento, usuario, imagen,
+regalo) qué rutas existen y se guarda un accessor compilado con operator.attrgetter.
+Los sub-objetos se comprueban con `is not None`: el bool() de un mensaje protobuf
+recorre todos sus campos y era el costo dominante de la normalización
+"""
+from operator import attrgetter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from logs import get_logger
+
+log = get_logger("extractors")
+
+# Atributos de imagen que son listas de URLs (se usa el primer elemento si no está vacía)
+LIST_ATTRS = frozenset(("m_urls",))
+
+# Orden de búsqueda de cada valor (el primero presente gana, igual que las cadenas elif)
+USER_INFO_AVATAR = ("m_urls", "uri")
+USER_AVATAR_SOURCES = ("avatar_thumb", "avatar_large", "avatar_url", "profile_picture_url")
+USER_AVATAR_ATTRS = {
+    "avatar_thumb": ("m_urls", "uri"),
+    "avatar_large": ("m_urls",),
+    "avatar_url": ("url",),
+}
+GIFT_IMAGE_ATTRS = ("m_urls", "uri", "url")
+GIFT_IMAGE_FALLBACKS = ("image_url", "gift_picture_url", "picture_url", "icon_url")
+GIFT_INFO_IMAGE_ATTRS = ("m_urls", "uri")
+COIN_ATTRS = ("diamond_count", "coins", "diamonds", "amount")
+
+Extractor = Callable[[Any], Any]
+
+
+def _getter(obj, name: str) -> Optional[Callable[[Any], Any]]:
+    return attrgetter(name) if hasattr(obj, name) else None
+
+
+class ExtractorRegistry:
+    """Caché de accessors compilados por (tipo de extracción, clase concreta)"""
+
+    def __init__(self):
+        self._compiled: Dict[Tuple[str, type], Extractor] = {}
+        self.compilations = 0
+
+    def _get(self, kind: str, obj, compile_fn: Callable[..., Extractor], *args) -> Extractor:
+        key = (kind, type(obj)) if not args else (kind, type(obj)) + args
+        extractor = self._compiled.get(key)
+        if extractor is None:
+            extractor = compile_fn(obj, *args)
+            self._compiled[key] = extractor
+            self.compilations += 1
+        return extractor
+
+    # --- Imágenes ---
+
+    def image_url(self, image, names: Tuple[str, ...]) -> Optional[str]:
+        """URL de un objeto imagen buscando `names` en orden (o la propia cadena)"""
+        if image is None:
+            return None
+        return self._get("image", image, self._compile_image, names)(image)
+
+    @staticmethod
+    def _compile_image(image, names: Tuple[str, ...]) -> Extractor:
+        if isinstance(image, str):
+            return lambda value: value
+        steps = [(name in LIST_ATTRS, attrgetter(name)) for name in names if hasattr(image, name)]
+
+        def extract(obj):
+            for is_list, get in steps:
+                value = get(obj)
+                if not is_list:
+                    return value
+                if value:
+                    return value[0]
+            return None
+
+        return extract
+
+    # --- Usuarios ---
+
+    def user_info(self, event) -> Dict:
+        """Información completa del usuario desde cualquier evento"""
+        return self._get("event", event, self._compile_event)(event)
+
+    def _compile_event(self, event) -> Extractor:
+        get_user_info = _getter(event, "user_info")
+        get_user = _getter(event, "user")
+        get_identity = _getter(event, "user_identity")
+
+        def extract(obj):
+            # Estructura completa (user_info) o, si no, la simple (user)
+            if get_user_info is not None:
+                ui = get_user_info(obj)
+                if ui is not None:
+                    info = self._get("user_info", ui, self._compile_user_info)(ui)
+                    identity = get_identity(obj) if get_identity is not None else None
+                    if identity is not None and hasattr(identity, "is_follower_of_anchor"):
+                        info["is_following_streamer"] = identity.is_follower_of_anchor
+                    return info
+            if get_user is not None:
+                user = get_user(obj)
+                if user is not None:
+                    return self._get("user", user, self._compile_user)(user)
+            return {}
+
+        return extract
+
+    def _compile_user_info(self, ui) -> Extractor:
+        fields = [
+            (key, attrgetter(name))
+            for key, name in (("user_id", "id"), ("nickname", "nick_name"), ("username", "username"), ("sec_uid", "sec_uid"))
+            if hasattr(ui, name)
+        ]
+        get_avatar = _getter(ui, "avatar_thumb")
+        get_follow = _getter(ui, "follow_info")
+
+        def extract(obj):
+            info = {key: get(obj) for key, get in fields}
+            if get_avatar is not None:
+                avatar = get_avatar(obj)
+                if avatar is not None:
+                    url = self.image_url(avatar, USER_INFO_AVATAR)
+                    if url is not None:
+                        info["profile_image_url"] = url
+            if get_follow is not None:
+                follow = get_follow(obj)
+                if follow is not None:
+                    info.update(self._get("follow", follow, self._compile_follow)(follow))
+            return info
+
+        return extract
+
+    def _compile_user(self, user) -> Extractor:
+        # El último presente gana (username pisa a unique_id, is_follower a is_following)
+        username_attr = next((name for name in ("username", "unique_id") if hasattr(user, name)), None)
+        get_username = attrgetter(username_attr) if username_attr else None
+        get_nickname = _getter(user, "nickname")
+        get_nick_name = _getter(user, "nick_name")
+        avatar_sources = [(name, attrgetter(name)) for name in USER_AVATAR_SOURCES if hasattr(user, name)]
+        get_follow = _getter(user, "follow_info")
+        get_follower_count = _getter(user, "follower_count")
+        get_following_count = _getter(user, "following_count")
+        following_attr = next((name for name in ("is_follower", "is_following") if hasattr(user, name)), None)
+        get_following = attrgetter(following_attr) if following_attr else None
+
+        def extract(obj):
+            info = {}
+            if get_username is not None:
+                info["username"] = get_username(obj)
+            if get_nickname is not None or get_nick_name is not None:
+                info["nickname"] = (get_nickname(obj) if get_nickname else None) or (get_nick_name(obj) if get_nick_name else None)
+
+            for name, get in avatar_sources:
+                value = get(obj)
+                if name == "profile_picture_url":
+                    info["profile_image_url"] = value
+                    break
+                if value is not None:
+                    url = self.image_url(value, USER_AVATAR_ATTRS[name])
+                    if url is not None:
+                        info["profile_image_url"] = url
+                    break
+
+            if get_follow is not None:
+                follow = get_follow(obj)
+                if follow is not None:
+                    info.update(self._get("follow", follow, self._compile_follow)(follow))
+            if "follower_count" not in info and get_follower_count is not None:
+                info["follower_count"] = get_follower_count(obj)
+            if "following_count" not in info and get_following_count is not None:
+                info["following_count"] = get_following_count(obj)
+            if get_following is not None:
+                info["is_following_streamer"] = get_following(obj)
+            return info
+
+        return extract
+
+    @staticmethod
+    def _compile_follow(follow) -> Extractor:
+        fields = [(name, attrgetter(name)) for name in ("follower_count", "following_count") if hasattr(follow, name)]
+        return lambda obj: {key: get(obj) for key, get in fields}
+
+    # --- Regalos ---
+
+    def gift_image_url(self, gift) -> Optional[str]:
+        """URL de la imagen del regalo (image, propiedades directas o gift_info)"""
+        if gift is None:
+            return None
+        return self._get("gift_image", gift, self._compile_gift_image)(gift)
+
+    def _compile_gift_image(self, gift) -> Extractor:
+        get_image = _getter(gift, "image")
+        fallback = next((attrgetter(name) for name in GIFT_IMAGE_FALLBACKS if hasattr(gift, name)), None)
+        get_gift_info = _getter(gift, "gift_info")
+
+        def extract(obj):
+            url = None
+            if get_image is not None:
+                image = get_image(obj)
+                if image is not None:
+                    url = self.image_url(image, GIFT_IMAGE_ATTRS)
+            if not url and fallback is not None:
+                url = fallback(obj)
+            if not url and get_gift_info is not None:
+                gift_info = get_gift_info(obj)
+                image = getattr(gift_info, "image", None)
+                if image is not None:
+                    url = self.image_url(image, GIFT_INFO_IMAGE_ATTRS)
+                elif hasattr(gift_info, "image_url"):
+                    url = gift_info.image_url
+            return url
+
+        return extract
+
+    def gift_coins(self, gift) -> Optional[int]:
+        """TikTok coins por unidad del regalo (o None si no se encuentran)"""
+        if gift is None:
+            return None
+        return self._get("gift_coins", gift, self._compile_coins)(gift)
+
+    def _compile_coins(self, obj) -> Extractor:
+        getters = [attrgetter(name) for name in COIN_ATTRS if hasattr(obj, name)]
+        get_gift_info = _getter(obj, "gift_info")
+        if not getters and get_gift_info is None:
+            log.warning(f"⚠️ {type(obj).__name__} no tiene atributos de coins conocidos: {list(getattr(obj, '__dict__', {}))[:20]}")
+
+        def extract(gift):
+            for get in getters:
+                value = get(gift)
+                if value is not None:
+                    return int(value)
+            if get_gift_info is not None:
+                gift_info = get_gift_info(gift)
+                if gift_info is not None:
+                    return self._get("gift_coins", gift_info, self._compile_coins)(gift_info)
+            return None
+
+        return extract
+
+    def get_stats(self) -> Dict:
+        return {"compiled": len(self._compiled), "compilations": self.compilations}
+
+
+# Registro compartido por todos los clientes del proceso
+extractors = ExtractorRegistry()
@@ -0,0 +1,144 @@
+"""
+API de reemplazo local para probar el bot sin Next.js ni PostgreSQL
+Implementa en memoria los endpoints que usa el bot, incluido POST /events/bulk
+
+Uso:
+    python fake_api.py --port 3001
+    API_URL=http://localhost:3001/api python main.py
+
+Con --no-bulk responde 404 en /events/bulk para probar el envío evento por evento.
+"""
+import argparse
+import itertools
+from collections import Counter
+from datetime import datetime
+
+from aiohttp import web
+
+
+class FakeApi:
+    def __init__(self, bulk: bool = True, verbose: bool = True):
+        self.bulk = bulk
+        self.verbose = verbose
+        self.streamers = {}
+        self.streams = {}
+        self.events = []
+        self.viewer_history = []
+        self.requests = Counter()
+        self._ids = itertools.count(1)
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self._ids)}"
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/streamers", self.post_streamer)
+        app.router.add_get("/api/streams", self.get_streams)
+        app.router.add_post("/api/streams", self.post_stream)
+        app.router.add_get("/api/streams/{id}", self.get_stream)
+        app.router.add_patch("/api/streams/{id}", self.patch_stream)
+        app.router.add_post("/api/events", self.post_event)
+        app.router.add_post("/api/events/bulk", self.post_events_bulk)
+        app.router.add_post("/api/viewer-history", self.post_viewer_history)
+        app.router.add_get("/api/_stats", self.get_stats)
+        return app
+
+    async def post_streamer(self, request: web.Request) -> web.Response:
+        self.requests["POST /streamers"] += 1
+        body = await request.json()
+        streamer = self.streamers.setdefault(body["username"], {"id": self._new_id("streamer"), **body})
+        return web.json_response(streamer)
+
+    async def get_streams(self, request: web.Request) -> web.Response:
+        self.requests["GET /streams"] += 1
+        streamer_id = request.query.get("streamer_id")
+        streams = [s for s in self.streams.values() if not streamer_id or s["streamer_id"] == streamer_id]
+        return web.json_response(streams)
+
+    async def get_stream(self, request: web.Request) -> web.Response:
+        self.requests["GET /streams/{id}"] += 1
+        stream = self.streams.get(request.match_info["id"])
+        if not stream:
+            return web.json_response({"error": "Stream not found"}, status=404)
+        return web.json_response(stream)
+
+    async def post_stream(self, request: web.Request) -> web.Response:
+        self.requests["POST /streams"] += 1
+        body = await request.json()
+        stream = {
+            "id": self._new_id("stream"),
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "ended_at": None,
+            "part_number": 1,
+            **body,
+        }
+        self.streams[stream["id"]] = stream
+        self._log(f"📹 Stream creado: {stream['id']}")
+        return web.json_response(stream)
+
+    async def patch_stream(self, request: web.Request) -> web.Response:
+        self.requests["PATCH /streams"] += 1
+        stream = self.streams.get(request.match_info["id"])
+        if not stream:
+            return web.json_response({"error": "Stream not found"}, status=404)
+        stream.update(await request.json())
+        return web.json_response(stream)
+
+    def _store_event(self, event: dict) -> bool:
+        if not event.get("event_type") or not event.get("stream_id"):
+            return False
+        self.events.append(event)
+        return True
+
+    async def post_event(self, request: web.Request) -> web.Response:
+        self.requests["POST /events"] += 1
+        if not self._store_event(await request.json()):
+            return web.json_response({"error": "Missing required fields: event_type, stream_id"}, status=400)
+        return web.json_response({"success": True, "event_id": str(len(self.events))})
+
+    async def post_events_bulk(self, request: web.Request) -> web.Response:
+        if not self.bulk:
+            return web.json_response({"error": "Not found"}, status=404)
+        self.requests["POST /events/bulk"] += 1
+        body = await request.json()
+        events = body.get("events") if isinstance(body, dict) else None
+        if not events:
+            return web.json_response({"error": "Missing required field: events (non-empty array)"}, status=400)
+        rejected = [index for index, event in enumerate(events) if not self._store_event(event)]
+        self._log(f"📦 Lote recibido: {len(events)} eventos ({len(rejected)} rechazados)")
+        return web.json_response({
+            "success": True,
+            "inserted": len(events) - len(rejected),
+            "event_ids": [str(i) for i in range(len(events) - len(rejected))],
+            "rejected": rejected,
+        })
+
+    async def post_viewer_history(self, request: web.Request) -> web.Response:
+        self.requests["POST /viewer-history"] += 1
+        self.viewer_history.append(await request.json())
+        return web.json_response({"success": True})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "requests": dict(self.requests),
+            "events": len(self.events),
+            "events_by_type": dict(Counter(e["event_type"] for e in self.events)),
+            "viewer_history": len(self.viewer_history),
+            "streams": len(self.streams),
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API de reemplazo local para el bot")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--no-bulk", action="store_true", help="Responder 404 en /events/bulk")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    fake = FakeApi(bulk=not args.no_bulk, verbose=not args.quiet)
+    print(f"🧪 API de reemplazo en http://localhost:{args.port}/api (bulk: {'no' if args.no_bulk else 'sí'})")
+    web.run_app(fake.app(), port=args.port, print=None)
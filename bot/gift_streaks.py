@@ -0,0 +1,180 @@
+"""
+Agrupación de rachas (combos) de regalos
+TikTok envía un GiftEvent por cada paso de la racha con el repeat_count acumulado;
+aquí se guarda la racha abierta por (usuario, regalo) y se emite una sola donación
+al terminar (repeat_end) o al expirar, con el conteo final y sus tiktok_coins.
+Si una racha cerrada antes de tiempo (timeout o desconexión) sigue llegando, solo se
+emite lo que sumó desde el cierre
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from records import DonationRecord, EventRecord, EventType, UserRecord
+
+
+class GiftStreakBuffer:
+    def __init__(
+        self,
+        emit: Callable[[EventRecord], Awaitable[None]],
+        timeout: float = 15.0,
+        max_open: int = 2000,
+        closed_ttl: float = 120.0,
+    ):
+        self.emit = emit  # Recibe el EventRecord de la donación final
+        self.timeout = timeout  # Segundos sin noticias de la racha antes de cerrarla
+        self.max_open = max_open  # Rachas abiertas máximas en memoria
+        self.closed_ttl = closed_ttl  # Segundos que se recuerda el conteo de una racha cerrada
+        self._open: Dict[Tuple[str, str], Dict] = {}
+        # (usuario, regalo) -> (conteo acumulado ya emitido, instante del cierre)
+        self._closed: "OrderedDict[Tuple[str, str], Tuple[int, float]]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.events_in = 0
+        self.donations_out = 0
+        self.timeouts = 0
+
+    async def add(
+        self,
+        user: UserRecord,
+        gift: Dict,
+        repeat_count: Optional[int],
+        streaking: bool,
+    ):
+        """
+        Registra un GiftEvent. `gift` lleva gift_id, gift_type, gift_name,
+        gift_image_url y unit_coins (coins por unidad del regalo)
+        """
+        self.events_in += 1
+        count = repeat_count if repeat_count else 1
+        now = datetime.utcnow().isoformat() + "Z"
+        received_at = time.monotonic()
+        key = (user.username or "unknown", str(gift.get("gift_id")))
+        streak = self._open.get(key)
+
+        if streak is None:
+            # repeat_count es acumulado: si no bajó, continúa una racha ya emitida y solo cuenta la diferencia
+            emitted = self._pop_closed(key)
+            baseline = emitted if emitted and count >= emitted else 0
+            if not streaking:
+                # Regalo sin racha (o racha de un solo evento, o repeat_end tardío): se emite directamente
+                if count > baseline:
+                    await self._emit(user, gift, count - baseline, 1, now, now, received_at, timed_out=False, baseline=baseline)
+                return
+            if len(self._open) >= self.max_open:
+                # Cerrar la racha más antigua para acotar la memoria
+                await self._close(next(iter(self._open)))
+            streak = {
+                "user": user,
+                "gift": gift,
+                "count": 0,
+                "baseline": baseline,
+                "events": 0,
+                "first_at": now,
+                "received_at": received_at,
+                "timer": None,
+            }
+            self._open[key] = streak
+
+        streak["user"] = user
+        streak["count"] = max(streak["count"], count)
+        streak["events"] += 1
+        streak["last_at"] = now
+        if streak["timer"] is not None:
+            streak["timer"].cancel()
+
+        if streaking:
+            streak["timer"] = asyncio.get_running_loop().call_later(self.timeout, self._close_by_timer, key)
+        else:
+            await self._close(key)
+
+    def _close_by_timer(self, key: Tuple[str, str]):
+        self.timeouts += 1
+        task = asyncio.create_task(self._close(key, timed_out=True))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close(self, key: Tuple[str, str], timed_out: bool = False):
+        streak = self._open.pop(key, None)
+        if streak is None:
+            return
+        if streak["timer"] is not None:
+            streak["timer"].cancel()
+        self._remember_closed(key, streak["count"])
+        if streak["count"] <= streak["baseline"]:
+            return
+        await self._emit(
+            streak["user"],
+            streak["gift"],
+            streak["count"] - streak["baseline"],
+            streak["events"],
+            streak["first_at"],
+            streak["last_at"],
+            streak["received_at"],
+            timed_out=timed_out,
+            baseline=streak["baseline"],
+        )
+
+    def _remember_closed(self, key: Tuple[str, str], count: int):
+        self._closed.pop(key, None)
+        self._closed[key] = (count, time.monotonic())
+        if len(self._closed) > self.max_open:
+            self._closed.popitem(last=False)
+
+    def _pop_closed(self, key: Tuple[str, str]) -> int:
+        """Conteo ya emitido de la última racha cerrada de `key` (0 si no hay o expiró)"""
+        closed = self._closed.pop(key, None)
+        if closed is None or time.monotonic() - closed[1] > self.closed_ttl:
+            return 0
+        return closed[0]
+
+    async def _emit(
+        self,
+        user: UserRecord,
+        gift: Dict,
+        count: int,
+        events: int,
+        first_at: str,
+        last_at: str,
+        received_at: float,
+        timed_out: bool,
+        baseline: int = 0,
+    ):
+        self.donations_out += 1
+        unit_coins = gift.get("unit_coins")
+        donation = DonationRecord(
+            gift.get("gift_type", "unknown"),
+            gift.get("gift_name", "Unknown Gift"),
+            count,
+            tiktok_coins=unit_coins * count if unit_coins else None,
+            gift_image_url=gift.get("gift_image_url"),
+        )
+        metadata = {
+            "gift_id": gift.get("gift_id"),
+            "streak_events": events,
+            "first_at": first_at,
+            "last_at": last_at,
+            "streak_timeout": timed_out,
+        }
+        if baseline:
+            # Continuación de una racha ya emitida hasta `baseline`: `count` es solo lo nuevo
+            metadata["streak_previous_count"] = baseline
+        content = f"Regalo: {donation.gift_name} x{count}"
+        # received_at del primer GiftEvent de la racha
+        await self.emit(EventRecord(EventType.DONATION, user, content, metadata, donation, received_at=received_at))
+
+    async def flush(self):
+        """Cierra todas las rachas abiertas (al detener el bot o cambiar de stream)"""
+        for key in list(self._open):
+            await self._close(key, timed_out=True)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            "open_streaks": len(self._open),
+            "events_in": self.events_in,
+            "donations_out": self.donations_out,
+            "timeouts": self.timeouts,
+        }
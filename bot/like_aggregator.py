@@ -0,0 +1,125 @@
+"""
+Agregación de likes por ventana de tiempo
+Combina los LikeEvent de un mismo usuario dentro de una ventana en un solo evento
+con el like_count sumado, así el total de likes por stream se mantiene exacto
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from records import EventRecord, EventType, UserRecord
+
+
+class LikeAggregator:
+    def __init__(
+        self,
+        emit: Callable[[EventRecord], Awaitable[None]],
+        window: float = 5.0,
+        max_open: int = 5000,
+    ):
+        self.emit = emit  # Recibe el EventRecord del like agregado
+        self.window = window  # Segundos de la ventana; 0 desactiva la agregación
+        self.max_open = max_open  # Ventanas abiertas máximas (usuarios distintos) en memoria
+        self._open: Dict[str, Dict] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.likes_in = 0
+        self.events_in = 0
+        self.events_out = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def add(self, user: UserRecord, like_count: Optional[int], total: Optional[int] = None):
+        """Suma un LikeEvent a la ventana abierta del usuario (o abre una nueva)"""
+        count = like_count if like_count else 1
+        now = datetime.utcnow().isoformat() + "Z"
+        received_at = time.monotonic()
+        self.likes_in += count
+        self.events_in += 1
+
+        if not self.enabled:
+            await self._emit(user, count, 1, now, now, total, received_at)
+            return
+
+        key = user.username or "unknown"
+        bucket = self._open.get(key)
+        if bucket is None:
+            if len(self._open) >= self.max_open:
+                # Cerrar la ventana más antigua para acotar la memoria
+                await self._close(next(iter(self._open)))
+            bucket = {
+                "user": user,
+                "like_count": 0,
+                "like_events": 0,
+                "first_at": now,
+                "last_at": now,
+                "total": total,
+                "received_at": received_at,
+                "timer": asyncio.get_running_loop().call_later(self.window, self._close_by_timer, key),
+            }
+            self._open[key] = bucket
+
+        bucket["user"] = user
+        bucket["like_count"] += count
+        bucket["like_events"] += 1
+        bucket["last_at"] = now
+        if total is not None:
+            bucket["total"] = total
+
+    def _close_by_timer(self, key: str):
+        task = asyncio.create_task(self._close(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close(self, key: str):
+        bucket = self._open.pop(key, None)
+        if bucket is None:
+            return
+        bucket["timer"].cancel()
+        await self._emit(
+            bucket["user"],
+            bucket["like_count"],
+            bucket["like_events"],
+            bucket["first_at"],
+            bucket["last_at"],
+            bucket["total"],
+            bucket["received_at"],
+        )
+
+    async def _emit(
+        self,
+        user: UserRecord,
+        like_count: int,
+        like_events: int,
+        first_at: str,
+        last_at: str,
+        total: Optional[int],
+        received_at: float,
+    ):
+        self.events_out += 1
+        metadata = {
+            "like_count": like_count,
+            "like_events": like_events,
+            "first_at": first_at,
+            "last_at": last_at,
+            "total_likes": total,
+        }
+        # received_at del primer like de la ventana
+        await self.emit(EventRecord(EventType.LIKE, user, "Me gusta", metadata, received_at=received_at))
+
+    async def flush(self):
+        """Cierra todas las ventanas abiertas (al detener el bot o cambiar de stream)"""
+        for key in list(self._open):
+            await self._close(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            "open_windows": len(self._open),
+            "likes_in": self.likes_in,
+            "events_in": self.events_in,
+            "events_out": self.events_out,
+        }
@@ -0,0 +1,180 @@
+"""
+Logging no bloqueante del bot
+Los módulos escriben con get_logger("<módulo>") (logger "bot.<módulo>"); los registros pasan por
+un QueueHandler (solo encola, sin I/O en el event loop) y un QueueListener en otro
+hilo los formatea y escribe. Los mensajes por evento llevan extra={"kind": ...} y se
+limitan por tipo (LOG_RATE_PER_KIND por segundo); los suprimidos se informan en el
+siguiente mensaje que pasa. LOG_JSON=true escribe una línea JSON por registro
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+ROOT_LOGGER = "bot"
+
+# Atributos estándar de LogRecord (el resto son campos `extra` y van al JSON)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RateLimiter:
+    """
+    Token bucket por `kind`: como máximo `rate` registros por segundo de cada tipo
+    (ráfagas de hasta `rate`). rate <= 0 desactiva el límite
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._buckets: Dict[str, list] = {}  # kind -> [tokens, último instante, suprimidos]
+
+    def allow(self, kind: str) -> Tuple[bool, int]:
+        """(se registra, suprimidos desde el último registrado)"""
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        bucket = self._buckets.get(kind)
+        if bucket is None:
+            bucket = self._buckets[kind] = [self.rate, now, 0]
+        tokens = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False, 0
+        bucket[0] = tokens - 1
+        suppressed, bucket[2] = bucket[2], 0
+        return True, suppressed
+
+    def get_stats(self) -> Dict[str, int]:
+        return {kind: bucket[2] for kind, bucket in self._buckets.items() if bucket[2]}
+
+
+_limiter = RateLimiter(20)
+
+
+class BotLogger(logging.LoggerAdapter):
+    """
+    Adaptador sobre el logger estándar que aplica el límite por `kind` antes de crear
+    el LogRecord, así un mensaje descartado cuesta una consulta al diccionario y nada más
+    """
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, None)
+
+    def process(self, msg, kwargs):
+        # El `extra` de cada llamada se pasa tal cual (el adaptador no agrega campos)
+        return msg, kwargs
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        extra = kwargs.get("extra")
+        if extra is not None and "kind" in extra:
+            allowed, suppressed = _limiter.allow(extra["kind"])
+            if not allowed:
+                return
+            if suppressed:
+                kwargs["extra"] = dict(extra, suppressed=suppressed)
+        super().log(level, msg, *args, **kwargs)
+
+
+_loggers: Dict[str, BotLogger] = {}
+
+
+def get_logger(name: str) -> BotLogger:
+    """Logger hijo de "bot" (p. ej. get_logger("tiktok") -> "bot.tiktok")"""
+    logger = _loggers.get(name)
+    if logger is None:
+        # Adaptador y no setLoggerClass: la clase de los loggers de las librerías no cambia
+        logger = _loggers[name] = BotLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+    return logger
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Mismo proceso: se encola el registro tal cual y el mensaje se formatea en el
+        # hilo del listener, no en el event loop
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """Mensaje tal cual (los emojis ya indican el tipo), como los print anteriores"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" (+{suppressed} similares omitidos)"
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    json_output: Optional[bool] = None,
+    rate_per_kind: Optional[float] = None,
+    log_file: Optional[str] = None,
+) -> logging.handlers.QueueListener:
+    """
+    Configura el logger "bot" con QueueHandler + QueueListener (idempotente).
+    Sin argumentos usa LOG_LEVEL, LOG_JSON, LOG_RATE_PER_KIND y LOG_FILE del entorno
+    (se leen aquí y no al importar, después de load_dotenv)
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    if level is None:
+        level = os.getenv("LOG_LEVEL", "INFO").upper()
+    if json_output is None:
+        json_output = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+    if rate_per_kind is None:
+        rate_per_kind = float(os.getenv("LOG_RATE_PER_KIND", "20"))
+    if log_file is None:
+        log_file = os.getenv("LOG_FILE", "")
+
+    output = logging.FileHandler(log_file, encoding="utf-8") if log_file else logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if json_output else TextFormatter())
+
+    _limiter.rate = rate_per_kind
+    handler = _QueueHandler(queue.SimpleQueue())
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.addHandler(handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Escribe lo pendiente y detiene el hilo del listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,13 +1,22 @@
 """
 Main entry point para el bot de TikTok
 """
+import argparse
 import asyncio
 from tiktok_client import TikTokStreamClient
 import os
 from dotenv import load_dotenv
+from logs import get_logger, setup_logging, shutdown_logging
+from metrics import RECONNECTS, stop_loop_monitor, stop_metrics_server
+from profiler import configure_from_env, profiler
+from scheduler import scheduler
+import memtrace
+import tracing
 
 load_dotenv()
 
+log = get_logger("main")
+
 
 async def main():
     """Función principal con reconexión automática"""
@@ -15,89 +24,112 @@ async def main():
     api_url = os.getenv("API_URL", "http://localhost:3000/api")
     
     if not username:
-        print("❌ Debes configurar STREAMER_USERNAME en el archivo .env")
-        print("O proporcionar el username como argumento")
+        log.error("❌ Debes configurar STREAMER_USERNAME en el archivo .env")
+        log.info("O proporcionar el username como argumento")
         return
 
-    print(f"🚀 Iniciando bot para @{username}")
-    print(f"📡 API URL: {api_url}")
-    print(f"🔄 El bot intentará reconectarse automáticamente si hay errores")
+    log.info(f"🚀 Iniciando bot para @{username}")
+    log.info(f"📡 API URL: {api_url}")
+    log.info(f"🔄 El bot intentará reconectarse automáticamente si hay errores")
     
     reconnect_delay_short = 10  # Segundos entre intentos cuando hay error de conexión
     reconnect_delay_long = 15     # Segundos entre intentos cuando el streamer no está en vivo
     attempt = 0
     last_error_type = None
     
-    while True:  # Bucle de reconexión infinita
-        try:
-            attempt += 1
-            if attempt > 1:
-                if last_error_type == "not_live":
-                    delay = reconnect_delay_long
-                    print(f"\n⏸️ Streamer no está en vivo. Reintentando en {delay}s... (Intento {attempt})")
-                else:
-                    delay = reconnect_delay_short
-                    print(f"\n🔄 Reintentando conexión en {delay}s... (Intento {attempt})")
-                await asyncio.sleep(delay)
+    # Un solo cliente para toda la sesión: en cada reintento solo se reinicia la conexión con
+    # TikTok; la cola, las cachés de perfiles, el pool HTTP, el stream y las métricas se conservan
+    client = TikTokStreamClient(username, api_url)
+    
+    try:
+        while True:  # Bucle de reconexión infinita
+            try:
+                attempt += 1
+                if attempt > 1:
+                    RECONNECTS.inc(last_error_type or "error")
+                    if last_error_type == "not_live":
+                        delay = reconnect_delay_long
+                        log.info(f"⏸️ Streamer no está en vivo. Reintentando en {delay}s... (Intento {attempt})")
+                    else:
+                        delay = reconnect_delay_short
+                        log.info(f"🔄 Reintentando conexión en {delay}s... (Intento {attempt})")
+                    await asyncio.sleep(delay)
             
-            client = TikTokStreamClient(username, api_url)
-            last_error_type = None  # Resetear tipo de error
+                last_error_type = None  # Resetear tipo de error
             
-            try:
-                await client.start()
-                # Mantener el bot corriendo indefinidamente
-                await asyncio.Event().wait()
-            except KeyboardInterrupt:
-                print("\n🛑 Deteniendo bot...")
                 try:
-                    # Al detener manualmente, NO finalizar el stream
-                    # El stream permanece activo para continuar cuando se reactive
-                    await client.stop(end_stream=False)
-                except:
-                    pass
-                break
-            except Exception as e:
-                error_msg = str(e).lower()
-                # Detectar tipo de error
-                if any(keyword in error_msg for keyword in ['not live', 'not streaming', 'no live', 'offline', 'unavailable', '504', 'sign_not_200']):
-                    last_error_type = "not_live"
+                    await client.start()
+                    # Mantener el bot corriendo mientras dure la conexión con TikTok
+                    await client.wait_closed()
+                    log.info(f"🔌 La conexión con TikTok terminó")
+                    last_error_type = "error"
+                except Exception as e:
+                    error_msg = f"{type(e).__name__} {e}".lower()
+                    # Detectar tipo de error
+                    if any(keyword in error_msg for keyword in ['not live', 'not streaming', 'no live', 'offline', 'unavailable', '504', 'sign_not_200']):
+                        last_error_type = "not_live"
+                    else:
+                        last_error_type = "error"
+                        # Si el error es de conexión/red, NO finalizar el stream
+                        # El stream permanece activo para que pueda continuar cuando se reconecte
+                        log.info(f"💡 Error de conexión. Stream permanece activo para continuar cuando se reconecte.")
+                
+                # Cerrar solo la conexión (entrega lo capturado); el cliente se reutiliza
+                await client.disconnect()
+                
+                if last_error_type == "not_live":
                     # Si el error es "not live", el stream realmente terminó
                     # Finalizar el stream actual (confirmado)
                     try:
                         if client.stream_id:
-                            print(f"🛑 Streamer no está en vivo, finalizando stream {client.stream_id}")
-                            await client._end_stream(confirmed=True)
+                            log.info(f"🛑 Streamer no está en vivo, finalizando stream {client.stream_id}")
+                            await client._end_stream()
                     except Exception as end_error:
-                        print(f"⚠️ Error finalizando stream: {end_error}")
-                else:
-                    last_error_type = "error"
-                    # Si el error es de conexión/red, NO finalizar el stream
-                    # El stream permanece activo para que pueda continuar cuando se reconecte
-                    print(f"💡 Error de conexión. Stream permanece activo para continuar cuando se reconecte.")
-                
-                # Si el cliente se desconectó, intentar detenerlo limpiamente
-                try:
-                    # NO llamar a stop() porque eso finalizaría el stream
-                    # Solo desconectar el cliente sin finalizar el stream
-                    if hasattr(client.client, 'disconnect'):
-                        if asyncio.iscoroutinefunction(client.client.disconnect):
-                            await client.client.disconnect()
-                        else:
-                            client.client.disconnect()
-                except:
-                    pass
+                        log.warning(f"⚠️ Error finalizando stream: {end_error}")
                 # Continuar el bucle para reconectar
-                continue
                 
-        except KeyboardInterrupt:
-            print("\n🛑 Deteniendo bot...")
-            break
+            except Exception as e:
+                last_error_type = "error"
+                log.error(f"❌ Error inesperado: {e}")
+                await asyncio.sleep(reconnect_delay_short)
+    finally:
+        # Ctrl+C (cancelación) o salida: entregar lo pendiente sin finalizar el stream,
+        # que permanece activo para continuar cuando se reactive el bot
+        log.info("🛑 Deteniendo bot...")
+        try:
+            await client.stop(end_stream=False)
         except Exception as e:
-            last_error_type = "error"
-            print(f"❌ Error inesperado: {e}")
-            await asyncio.sleep(reconnect_delay_short)
+            log.warning(f"⚠️ Error deteniendo cliente: {e}")
+        # Diagnósticos: último volcado de perfiles (si --profile) y fin de tracemalloc (si --memtrace)
+        await profiler.stop()
+        await memtrace.memtracer.stop()
+        # Componentes del proceso: monitor del event loop y servidor de métricas
+        await stop_loop_monitor()
+        await stop_metrics_server()
+        # Tareas periódicas del proceso (drenado de la cola, muestreo, diagnósticos)
+        await scheduler.shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Bot de TikTok Live")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Perfila por muestreo los handlers y el procesador de la cola (también BOT_PROFILE=true)",
+    )
+    parser.add_argument(
+        "--memtrace",
+        action="store_true",
+        help="Snapshots periódicos de memoria con tracemalloc (también MEMTRACE=true)",
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+    configure_from_env(force=args.profile)
+    memtrace.configure_from_env(force=args.memtrace)
+    tracing.configure_from_env()
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_logging()
 
@@ -0,0 +1,200 @@
+"""
+Instrumentación de memoria con tracemalloc (modo --memtrace / MEMTRACE=true)
+Cada `interval` segundos se toma un snapshot, se compara con el anterior y con el
+inicial y se informan los sitios de asignación que más crecieron. Un volcado a
+demanda (SIGUSR1 o GET /debug/memory en el servidor de métricas) escribe además el
+snapshot completo en `output_dir` para analizarlo después:
+
+    import tracemalloc
+    snapshot = tracemalloc.Snapshot.load("memory/snapshot-....tracemalloc")
+    for stat in snapshot.statistics("traceback")[:5]: print("\\n".join(stat.traceback.format()))
+
+tracemalloc hace más lenta cada asignación: es un modo de diagnóstico, no para
+dejarlo siempre activo
+"""
+import asyncio
+import os
+import signal
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Set
+
+from aiohttp import web
+
+from logs import get_logger
+from metrics import add_route, metrics
+from scheduler import scheduler
+
+log = get_logger("memory")
+
+# Asignaciones del propio tracemalloc y del import system no interesan
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _size(size: int, sign: bool = False) -> str:
+    fmt = "+.1f" if sign else ".1f"
+    if abs(size) < 1024 * 1024:
+        return f"{size / 1024:{fmt}} KB"
+    return f"{size / 1024 / 1024:{fmt}} MB"
+
+
+class MemoryTracer:
+    def __init__(self):
+        self.enabled = False
+        self.interval = 600.0
+        self.top = 15
+        self.frames = 10
+        self.output_dir = Path("memory")
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = asyncio.Lock()  # Un snapshot a la vez (periódico o a demanda)
+        self._dumps: Set[asyncio.Task] = set()  # Volcados lanzados por SIGUSR1
+        self.snapshots = 0
+
+    def configure(self, interval: float = 600.0, top: int = 15, frames: int = 10, output_dir: str = "memory"):
+        """Activa tracemalloc para todo el proceso (lo antes posible, para trazar desde el inicio)"""
+        self.enabled = True
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self.output_dir = Path(output_dir)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        # Endpoint a demanda (se registra antes de que arranque el servidor de métricas)
+        add_route("/debug/memory", self._handle_dump)
+        log.info(f"🧠 tracemalloc activo ({frames} frames), snapshot cada {interval:.0f}s")
+
+    def start(self):
+        """Snapshot inicial, snapshots periódicos y SIGUSR1 (una sola vez por proceso)"""
+        if not self.enabled or scheduler.has_job("memory_snapshot"):
+            return
+        scheduler.every("memory_snapshot", self.interval, self._snapshot_job, delay=0)
+        if hasattr(signal, "SIGUSR1"):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.request_dump)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    async def stop(self):
+        """Quita los snapshots periódicos y SIGUSR1 y detiene tracemalloc (al detener el bot)"""
+        if not self.enabled:
+            return
+        scheduler.cancel("memory_snapshot")
+        if hasattr(signal, "SIGUSR1"):
+            try:
+                asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+            except (NotImplementedError, RuntimeError):
+                pass
+        # Esperar a los volcados pedidos o en curso antes de soltar las trazas
+        if self._dumps:
+            await asyncio.gather(*self._dumps, return_exceptions=True)
+        async with self._lock:
+            self.enabled = False
+            self._baseline = self._previous = None
+            tracemalloc.stop()
+
+    async def _take_snapshot(self) -> tracemalloc.Snapshot:
+        # take_snapshot/filter_traces copian todas las trazas: fuera del event loop
+        def take():
+            return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+        snapshot = await asyncio.to_thread(take)
+        self.snapshots += 1
+        return snapshot
+
+    async def _snapshot_job(self):
+        async with self._lock:
+            snapshot = await self._take_snapshot()
+            if self._baseline is None:
+                # Primera ejecución: snapshot de referencia
+                self._baseline = self._previous = snapshot
+                return
+            report = await asyncio.to_thread(self.report, snapshot)
+            self._previous = snapshot
+        log.info(report)
+
+    def report(self, snapshot: tracemalloc.Snapshot) -> str:
+        """Texto con la memoria trazada y los sitios que más crecieron (vs. anterior e inicial)"""
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"🧠 Memoria trazada: {_size(current)} (pico {_size(peak)})"]
+        for label, reference in (("última muestra", self._previous), ("inicio", self._baseline)):
+            if reference is None or reference is snapshot:
+                continue
+            stats = snapshot.compare_to(reference, "lineno")
+            growth = sum(stat.size_diff for stat in stats)
+            lines.append(f"📈 Desde {label}: {_size(growth, sign=True)}")
+            lines.extend(self._format_growth(stats))
+        if len(lines) == 1:
+            lines.extend(
+                f"   {_size(stat.size)} ({stat.count} bloques) {stat.traceback[0]}"
+                for stat in snapshot.statistics("lineno")[:self.top]
+            )
+        return "\n".join(lines)
+
+    def _format_growth(self, stats: List[tracemalloc.StatisticDiff]) -> List[str]:
+        growing = [stat for stat in stats if stat.size_diff > 0][:self.top]
+        return [
+            f"   {_size(stat.size_diff, sign=True)} ({stat.count_diff:+d} bloques, total {_size(stat.size)}) {stat.traceback[0]}"
+            for stat in growing
+        ]
+
+    async def dump(self, reason: str = "manual") -> str:
+        """Snapshot a demanda: informe (log) + snapshot completo en output_dir"""
+        if not self.enabled:
+            return "tracemalloc no está activo (usar --memtrace o MEMTRACE=true)"
+        async with self._lock:
+            snapshot = await self._take_snapshot()
+            report = await asyncio.to_thread(self.report, snapshot)
+            path = self.output_dir / f"snapshot-{datetime.now().strftime('%Y%m%d-%H%M%S')}.tracemalloc"
+
+            def write():
+                self.output_dir.mkdir(parents=True, exist_ok=True)
+                snapshot.dump(str(path))
+
+            await asyncio.to_thread(write)
+        log.info(f"💾 Snapshot de memoria ({reason}) guardado en {path}\n{report}")
+        return f"{report}\n\nSnapshot: {path}\n"
+
+    def request_dump(self):
+        """Handler de SIGUSR1"""
+        task = asyncio.create_task(self.dump(reason="SIGUSR1"))
+        self._dumps.add(task)
+        task.add_done_callback(self._dumps.discard)
+
+    async def _handle_dump(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        body = await self.dump(reason="HTTP")
+        return web.Response(text=body + f"({time.monotonic() - started:.1f}s)\n", content_type="text/plain", charset="utf-8")
+
+
+# Un solo tracer por proceso (sobrevive a las reconexiones del cliente)
+memtracer = MemoryTracer()
+
+
+def _traced_memory():
+    if not tracemalloc.is_tracing():
+        return []
+    current, peak = tracemalloc.get_traced_memory()
+    return [({"kind": "current"}, current), ({"kind": "peak"}, peak)]
+
+
+metrics.collector("bot_memory_traced_bytes", "Memoria trazada por tracemalloc (solo con --memtrace)", _traced_memory)
+
+
+def configure_from_env(force: bool = False):
+    """Activa el tracer con --memtrace (force) o MEMTRACE=true; MEMTRACE_* ajustan el muestreo"""
+    if not force and os.getenv("MEMTRACE", "false").lower() not in ("1", "true", "yes"):
+        return
+    memtracer.configure(
+        interval=float(os.getenv("MEMTRACE_INTERVAL", "600")),
+        top=int(os.getenv("MEMTRACE_TOP", "15")),
+        frames=int(os.getenv("MEMTRACE_FRAMES", "10")),
+        output_dir=os.getenv("MEMTRACE_DIR", "memory"),
+    )
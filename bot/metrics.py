@@ -0,0 +1,403 @@
+"""
+Métricas del bot en formato de texto de Prometheus
+Contadores, gauges e histogramas en memoria (sin dependencias externas) y un
+servidor HTTP local que los expone en /metrics. Los valores que ya existen en
+otros objetos (profundidad de la cola, del buffer, ...) se leen al hacer scrape
+con collectors registrados por nombre
+"""
+import asyncio
+import bisect
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from logs import get_logger
+
+log = get_logger("metrics")
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+# Buckets (segundos) para latencias de la API y lag del event loop
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+
+    def _key(self, values: Tuple) -> LabelValues:
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} espera labels {self.label_names}")
+        return tuple(str(value) for value in values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labels):
+        self._values[self._key(labels)] = value
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [conteos por bucket (no acumulados) + overflow, suma, total]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        # nombre -> (help, tipo, función que retorna [(labels, valor), ...])
+        self._collectors: Dict[str, Tuple[str, str, Callable[[], Iterable[Sample]]]] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def collector(self, name: str, help_text: str, fn: Callable[[], Iterable[Sample]], kind: str = "gauge"):
+        """Registra (o reemplaza) un valor calculado al hacer scrape"""
+        self._collectors[name] = (help_text, kind, fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for name, (help_text, kind, fn) in self._collectors.items():
+            try:
+                samples = list(fn())
+            except Exception as e:
+                log.warning(f"⚠️ Error calculando métrica {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Registro compartido por todo el proceso
+metrics = MetricsRegistry()
+
+EVENTS_RECEIVED = metrics.counter("tiktok_events_received_total", "Eventos recibidos de TikTok por tipo", ("type",))
+EVENTS_DELIVERED = metrics.counter("bot_events_delivered_total", "Eventos entregados a la API", ("path",))
+EVENTS_QUEUED = metrics.counter("bot_events_queued_total", "Elementos agregados a la cola persistente por tipo", ("event_type",))
+EVENTS_FAILED = metrics.counter("bot_events_failed_total", "Elementos descartados tras agotar reintentos", ("event_type",))
+QUEUE_SENT = metrics.counter("bot_queue_sent_total", "Elementos de la cola persistente enviados al drenar", ("event_type",))
+API_REQUESTS = metrics.counter("bot_api_requests_total", "Peticiones a la API por endpoint y resultado", ("endpoint", "method", "status"))
+API_LATENCY = metrics.histogram("bot_api_request_seconds", "Latencia de las peticiones a la API", ("endpoint", "method"))
+CONNECTS = metrics.counter("tiktok_connects_total", "Conexiones establecidas con el stream de TikTok")
+DISCONNECTS = metrics.counter("tiktok_disconnects_total", "Desconexiones del stream de TikTok")
+RECONNECTS = metrics.counter("tiktok_reconnect_attempts_total", "Intentos de reconexión del bucle principal", ("reason",))
+LOOP_LAG = metrics.gauge("bot_event_loop_lag_seconds", "Último retraso medido del event loop")
+LOOP_LAG_HISTOGRAM = metrics.histogram("bot_event_loop_lag_histogram_seconds", "Retraso del event loop", buckets=LAG_BUCKETS)
+SLOW_CALLBACKS = metrics.counter("bot_event_loop_slow_callbacks_total", "Bloqueos del event loop por handler", ("handler",))
+
+
+class LoopLagMonitor:
+    """
+    Mide el retraso de planificación del event loop y detecta callbacks lentos.
+    Un hilo vigilante programa cada `interval` segundos un callback en el loop
+    (call_soon_threadsafe) y mide cuánto tarda en ejecutarse. Si no corre en
+    `slow_threshold` segundos el loop está bloqueado: se toma la pila del hilo del
+    loop en ese momento (qué handler bloquea) y al desbloquearse se registra la
+    duración y un aviso (como máximo uno cada `warn_interval` segundos por handler).
+    Cuesta un callback por intervalo; la pila solo se captura cuando hay bloqueo
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.25,
+        slow_threshold: float = 0.1,
+        warn_interval: float = 30.0,
+        stack_depth: int = 12,
+    ):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.warn_interval = warn_interval
+        self.stack_depth = stack_depth
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._warned: Dict[str, list] = {}  # handler -> [último aviso, avisos suprimidos]
+        self.slow_callbacks = 0
+        self.max_lag = 0.0
+
+    def _run(self):
+        loop = self._loop
+        while not self._stopping.wait(self.interval):
+            answered = threading.Event()
+            started = time.monotonic()
+            try:
+                loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                return  # Loop cerrado
+            stack = None
+            if not answered.wait(self.slow_threshold):
+                # Bloqueado ahora mismo: la pila del hilo del loop dice quién lo bloquea
+                stack = self._capture_stack()
+                while not answered.wait(self.interval):
+                    if self._stopping.is_set() or loop.is_closed():
+                        return
+            lag = time.monotonic() - started
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if stack is not None:
+                self._report(lag, stack)
+
+    def _capture_stack(self) -> List[traceback.FrameSummary]:
+        """Pila del callback que está corriendo en el loop (desde que asyncio lo despachó)"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        stack = traceback.extract_stack(frame)
+        dispatch = [i for i, frame in enumerate(stack) if os.path.dirname(frame.filename) == ASYNCIO_DIR]
+        return stack[dispatch[-1] + 1:] if dispatch and dispatch[-1] + 1 < len(stack) else stack
+
+    @staticmethod
+    def _locate(stack: List[traceback.FrameSummary]) -> Tuple[str, str]:
+        """(handler, ubicación): primer frame del callback y último frame del código del bot"""
+        if not stack:
+            return "desconocido", "desconocido"
+        outer = stack[0]
+        own = [frame for frame in stack if os.path.dirname(os.path.abspath(frame.filename)) == BOT_DIR]
+        inner = own[-1] if own else stack[-1]
+        return (
+            f"{Path(outer.filename).stem}.{outer.name}",
+            f"{Path(inner.filename).name}:{inner.lineno} ({inner.name})",
+        )
+
+    def _report(self, lag: float, stack: List[traceback.FrameSummary]):
+        handler, location = self._locate(stack)
+        self.slow_callbacks += 1
+        SLOW_CALLBACKS.inc(handler)
+
+        now = time.monotonic()
+        state = self._warned.setdefault(handler, [float("-inf"), 0])
+        if now - state[0] < self.warn_interval:
+            state[1] += 1
+            return
+        suppressed, state[1] = state[1], 0
+        state[0] = now
+        log.warning(
+            "🐢 Event loop bloqueado %.0fms por %s en %s\n%s",
+            lag * 1000,
+            handler,
+            location,
+            "".join(traceback.format_list(stack[-self.stack_depth:])).rstrip(),
+            extra={"suppressed": suppressed, "handler": handler},
+        )
+
+    def start(self):
+        """Inicia el hilo vigilante sobre el event loop actual"""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            thread, self._thread = self._thread, None
+            await asyncio.to_thread(thread.join, self.interval * 2)
+
+    def get_stats(self) -> Dict:
+        return {"slow_callbacks": self.slow_callbacks, "max_lag": self.max_lag}
+
+
+# Rutas extra (diagnóstico) que se sirven junto a /metrics: path -> handler
+_routes: Dict[str, Callable] = {}
+
+
+def add_route(path: str, handler: Callable):
+    """Registra un GET adicional en el servidor de métricas (antes de iniciarlo)"""
+    _routes[path] = handler
+
+
+class MetricsServer:
+    """Servidor HTTP local: GET /metrics en formato de texto de Prometheus (y rutas de add_route)"""
+
+    def __init__(self, registry: MetricsRegistry = metrics, host: str = "127.0.0.1", port: int = 9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        body = self.registry.render()
+        return web.Response(text=body, content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        for path, handler in _routes.items():
+            app.router.add_get(path, handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info(f"📈 Métricas en http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+_server: Optional[MetricsServer] = None
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[MetricsServer]:
+    """Inicia el servidor de métricas del proceso (una sola vez); port 0 lo desactiva"""
+    global _server
+    if port <= 0:
+        return None
+    if _server is None:
+        server = MetricsServer(metrics, host, port)
+        try:
+            await server.start()
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo iniciar el servidor de métricas en el puerto {port}: {e}")
+            return None
+        _server = server
+    return _server
+
+
+async def stop_metrics_server():
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
+
+
+_monitor: Optional[LoopLagMonitor] = None
+
+
+def start_loop_monitor(interval: float = 0.25, slow_threshold: float = 0.1, warn_interval: float = 30.0) -> Optional[LoopLagMonitor]:
+    """Inicia el monitor del event loop del proceso (una sola vez); interval 0 lo desactiva"""
+    global _monitor
+    if interval <= 0:
+        return None
+    if _monitor is None:
+        _monitor = LoopLagMonitor(interval, slow_threshold, warn_interval)
+        _monitor.start()
+    return _monitor
+
+
+async def stop_loop_monitor():
+    global _monitor
+    if _monitor is not None:
+        await _monitor.stop()
+        _monitor = None
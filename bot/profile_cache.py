@@ -0,0 +1,76 @@
+"""
+Caché de perfiles de usuario enviados a la API
+Guarda por username un hash de los campos de perfil ya enviados; si no cambiaron,
+el evento lleva solo el username y la marca `profile_unchanged` y la API no
+vuelve a actualizar la fila del usuario
+"""
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from records import UserRecord
+
+# Bytes aproximados por entrada además del username (hash, timestamp, nodo del OrderedDict)
+ENTRY_OVERHEAD = 120
+
+
+class ProfileCache:
+    """LRU acotado por memoria y con TTL: username -> (hash del perfil, enviado_en)"""
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024, ttl: float = 600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # Segundos tras los cuales se reenvía el perfil completo
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry_size(username: str) -> int:
+        return sys.getsizeof(username) + ENTRY_OVERHEAD
+
+    def unchanged(self, user: UserRecord) -> bool:
+        """
+        True si el perfil ya se envió igual y no expiró (el evento puede llevar solo
+        el username); si no, lo registra como enviado y retorna False
+        """
+        username = user.username
+        if not username or username == "unknown":
+            return False
+
+        profile_hash = hash(user.profile())
+        now = time.monotonic()
+        cached = self._entries.get(username)
+        if cached is not None and cached[0] == profile_hash and now - cached[1] < self.ttl:
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        self._store(username, profile_hash, now)
+        return False
+
+    def _store(self, username: str, profile_hash: int, now: float):
+        if username in self._entries:
+            self._entries.move_to_end(username)
+        else:
+            self._bytes += self._entry_size(username)
+        self._entries[username] = (profile_hash, now)
+        while self._bytes > self.max_bytes and self._entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._bytes -= self._entry_size(evicted)
+
+    def invalidate(self, username: Optional[str]):
+        """Olvida un usuario (p. ej. si el evento con su perfil completo no se pudo enviar)"""
+        if username and username in self._entries:
+            del self._entries[username]
+            self._bytes -= self._entry_size(username)
+
+    def get_stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
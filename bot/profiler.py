@@ -0,0 +1,141 @@
+"""
+Profiler opcional de los handlers de eventos (modo --profile / BOT_PROFILE=true)
+Cada llamada a un handler on_* o al procesador de la cola se perfila con cProfile con
+probabilidad `sample_rate`; los perfiles se acumulan por handler y cada `interval`
+segundos se escriben en `output_dir` como <handler>.prof y all.prof (formato pstats,
+lo leen snakeviz, flameprof, gprof2dot, tuna, ...)
+
+Solo se perfila una llamada a la vez (cProfile es un hook por hilo). Mientras la
+llamada muestreada espera (await) el perfil también incluye el trabajo de otras
+tareas del loop; para los handlers, que casi no esperan, es despreciable
+"""
+import asyncio
+import cProfile
+import functools
+import os
+import pstats
+import random
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+from logs import get_logger
+from scheduler import scheduler
+
+log = get_logger("profiler")
+
+# Métodos de TikTokStreamClient que se perfilan
+HANDLERS = ("on_connect", "on_disconnect", "on_comment", "on_gift", "on_follow", "on_join", "on_share", "on_like")
+
+
+class HandlerProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.05
+        self.output_dir = Path("profiles")
+        self.interval = 300.0
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._sampled: Dict[str, int] = {}
+        self._calls: Dict[str, int] = {}
+        self._active: Optional[str] = None
+
+    def configure(self, sample_rate: float = 0.05, output_dir: str = "profiles", interval: float = 300.0):
+        """Activa el profiler para todo el proceso"""
+        self.enabled = True
+        self.sample_rate = sample_rate
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        log.info(
+            f"🔬 Profiler activo: {sample_rate:.0%} de las llamadas, "
+            f"perfiles en {self.output_dir}/ cada {interval:.0f}s"
+        )
+
+    def wrap(self, name: str, fn: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        """Envuelve una corrutina para perfilar una fracción de sus llamadas bajo `name`"""
+
+        @functools.wraps(fn)
+        async def profiled(*args, **kwargs):
+            self._calls[name] = self._calls.get(name, 0) + 1
+            if self._active is not None or random.random() >= self.sample_rate:
+                return await fn(*args, **kwargs)
+            profile = self._profiles.get(name)
+            if profile is None:
+                profile = self._profiles[name] = cProfile.Profile()
+            self._active = name
+            self._sampled[name] = self._sampled.get(name, 0) + 1
+            profile.enable()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._active = None
+
+        return profiled
+
+    def instrument(self, client):
+        """Reemplaza los handlers on_* y el procesador de la cola del cliente por versiones perfiladas"""
+        if not self.enabled:
+            return
+        for name in HANDLERS:
+            setattr(client, name, self.wrap(name, getattr(client, name)))
+        queue = client.event_queue
+        queue.process_queue = self.wrap("process_queue", queue.process_queue)
+
+    def start(self):
+        """Registra el volcado periódico en el planificador (una sola vez por proceso)"""
+        if self.enabled and not scheduler.has_job("profiler_dump"):
+            scheduler.every("profiler_dump", self.interval, self._dump_job)
+
+    async def _dump_job(self):
+        stats = self._snapshot()
+        # Escritura fuera del event loop
+        await asyncio.to_thread(self._write, stats)
+
+    def _snapshot(self) -> Dict[str, pstats.Stats]:
+        """pstats por handler (se omite el que está perfilando ahora: va en el siguiente volcado)"""
+        return {
+            name: pstats.Stats(profile)
+            for name, profile in self._profiles.items()
+            if name != self._active
+        }
+
+    def _write(self, stats: Dict[str, pstats.Stats]):
+        if not stats:
+            return
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        for name, handler_stats in stats.items():
+            handler_stats.dump_stats(str(self.output_dir / f"{name}.prof"))
+        combined = pstats.Stats()
+        combined.add(*stats.values())
+        combined.dump_stats(str(self.output_dir / "all.prof"))
+        summary = ", ".join(f"{name}={self._sampled.get(name, 0)}/{self._calls.get(name, 0)}" for name in stats)
+        log.info(f"🔬 Perfiles guardados en {self.output_dir}/ (muestreadas/llamadas: {summary})")
+
+    def dump(self):
+        """Volcado síncrono (al terminar el proceso)"""
+        if self.enabled:
+            try:
+                self._write(self._snapshot())
+            except Exception as e:
+                log.warning(f"⚠️ Error guardando perfiles: {e}")
+
+    async def stop(self):
+        scheduler.cancel("profiler_dump")
+        self.dump()
+
+    def get_stats(self) -> Dict:
+        return {"enabled": self.enabled, "sampled": dict(self._sampled), "calls": dict(self._calls)}
+
+
+# Un solo profiler por proceso
+profiler = HandlerProfiler()
+
+
+def configure_from_env(force: bool = False):
+    """Activa el profiler con --profile (force) o BOT_PROFILE=true; PROFILE_* ajustan el muestreo"""
+    if not force and os.getenv("BOT_PROFILE", "false").lower() not in ("1", "true", "yes"):
+        return
+    profiler.configure(
+        sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.05")),
+        output_dir=os.getenv("PROFILE_DIR", "profiles"),
+        interval=float(os.getenv("PROFILE_INTERVAL", "300")),
+    )
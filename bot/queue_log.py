@@ -0,0 +1,449 @@
+"""
+Almacenamiento de la cola de eventos en un log segmentado de solo-anexar
+Cada evento se escribe una sola vez al final del segmento activo; los ACKs
+se guardan en un archivo lateral pequeño (acks.json)
+"""
+import asyncio
+import heapq
+import json
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from logs import get_logger
+
+log = get_logger("queue")
+
+# Cabecera de cada registro: longitud del payload + CRC32 (big-endian)
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".seg"
+# Items copiados por vuelta del event loop al preparar una compactación
+COMPACT_CHUNK = 2000
+
+
+def _to_ranges(seqs) -> List[List[int]]:
+    """Compacta una colección de enteros en rangos [inicio, fin]"""
+    ranges: List[List[int]] = []
+    for seq in sorted(seqs):
+        if ranges and seq == ranges[-1][1] + 1:
+            ranges[-1][1] = seq
+        else:
+            ranges.append([seq, seq])
+    return ranges
+
+
+def _encode_record(item: Dict) -> bytes:
+    data = json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def _from_ranges(ranges) -> set:
+    """Expande rangos [inicio, fin] a un conjunto de enteros"""
+    seqs = set()
+    for start, end in ranges or []:
+        seqs.update(range(start, end + 1))
+    return seqs
+
+
+class SegmentedLogStore:
+    """
+    Cola persistente basada en segmentos de solo-anexar con rotación.
+
+    - Encolar es O(1): se anexa un registro con prefijo de longitud al segmento activo
+    - Los ACKs se guardan en `acks.json` como una marca de agua baja (segmento, offset)
+      más los números de secuencia confirmados por encima de ella
+    - Al arrancar solo se reproduce la cola sin confirmar (desde la marca de agua)
+    - Los segmentos que quedan completamente por debajo de la marca se eliminan
+    - Si los ACKs por encima de la marca (registros muertos que un evento sin confirmar
+      retiene) superan `compact_ratio` de los vivos, los registros vivos se reescriben en un
+      segmento nuevo. La escritura corre en un hilo; mientras tanto se sigue anexando en el
+      segmento siguiente
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_max_bytes: int = 4 * 1024 * 1024,
+        fsync: bool = False,
+        compact_threshold: int = 10000,
+        compact_ratio: float = 0.5,
+        compact_min_dead: int = 1000,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.acks_file = self.directory / "acks.json"
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.compact_threshold = compact_threshold  # Muertos a partir de los que se compacta siempre
+        self.compact_ratio = compact_ratio  # Muertos por registro vivo a partir de los que se compacta
+        self.compact_min_dead = compact_min_dead
+        self._compacting = False
+        self._touched: set = set()  # Seqs con estado actualizado durante una compactación
+
+        # prioridad -> {seq: item} en orden de llegada
+        self._pending: Dict[int, "OrderedDict[int, Dict]"] = {}
+        self._failed: Dict[int, Dict] = {}
+        # seq -> (segmento, offset) de todos los registros no confirmados, en orden de seq
+        self._locations: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()
+        self._ids: Dict[str, int] = {}
+        self._acked: set = set()
+        # Los mismos seqs en un heap: la marca de agua poda los menores sin recorrer todo el conjunto
+        self._acked_heap: List[int] = []
+        self._state: Dict[int, Dict] = {}
+        self._next_seq = 0
+        self._low_water: Tuple[int, int] = (0, 0)
+
+        self._active_segment = 0
+        self._active_file = None
+        self._active_size = 0
+
+        self._recover()
+
+    # ------------------------------------------------------------------
+    # Segmentos
+    # ------------------------------------------------------------------
+
+    def _segment_path(self, index: int) -> Path:
+        return self.directory / f"{index:08d}{SEGMENT_SUFFIX}"
+
+    def _segment_indexes(self) -> List[int]:
+        indexes = []
+        for path in self.directory.glob(f"*{SEGMENT_SUFFIX}"):
+            try:
+                indexes.append(int(path.stem))
+            except ValueError:
+                continue
+        return sorted(indexes)
+
+    def _open_segment(self, index: int):
+        if self._active_file:
+            self._active_file.close()
+        self._active_segment = index
+        self._active_file = open(self._segment_path(index), "ab")
+        self._active_size = self._active_file.tell()
+
+    def _read_segment(self, index: int, offset: int):
+        """Lee los registros de un segmento desde `offset`, truncando un registro final incompleto"""
+        path = self._segment_path(index)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                position = f.tell()
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return
+                data = b""
+                if len(header) == RECORD_HEADER.size:
+                    length, crc = RECORD_HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) == length and zlib.crc32(data) == crc:
+                        try:
+                            yield position, json.loads(data.decode("utf-8"))
+                            continue
+                        except ValueError:
+                            pass
+                # Registro incompleto o corrupto (caída a mitad de escritura)
+                log.warning(f"⚠️ Registro corrupto en {path.name} (offset {position}), descartando el resto del segmento")
+                break
+        with open(path, "r+b") as f:
+            f.truncate(position)
+
+    # ------------------------------------------------------------------
+    # Recuperación y ACKs
+    # ------------------------------------------------------------------
+
+    def _load_acks(self) -> Dict:
+        try:
+            if self.acks_file.exists():
+                with open(self.acks_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    return data if isinstance(data, dict) else {}
+        except Exception as e:
+            log.warning(f"⚠️ Error cargando ACKs de la cola: {e}")
+        return {}
+
+    def _save_acks(self):
+        """Escribe el archivo lateral de ACKs de forma atómica"""
+        data = {
+            "segment": self._low_water[0],
+            "offset": self._low_water[1],
+            "next_seq": self._next_seq,
+            "acked": _to_ranges(self._acked),
+            "state": {str(seq): state for seq, state in self._state.items()},
+        }
+        tmp_file = self.acks_file.with_suffix(".tmp")
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_file, self.acks_file)
+        except Exception as e:
+            log.warning(f"⚠️ Error guardando ACKs de la cola: {e}")
+
+    def _recover(self):
+        """Reproduce solo la cola sin confirmar a partir de la marca de agua baja"""
+        acks = self._load_acks()
+        low_segment = int(acks.get("segment", 0))
+        low_offset = int(acks.get("offset", 0))
+        self._next_seq = int(acks.get("next_seq", 0))
+        self._set_acked(_from_ranges(acks.get("acked")))
+        state = {int(seq): value for seq, value in (acks.get("state") or {}).items()}
+
+        indexes = self._segment_indexes()
+        for index in indexes:
+            if index < low_segment:
+                continue
+            offset = low_offset if index == low_segment else 0
+            for position, item in self._read_segment(index, offset):
+                seq = item.get("seq")
+                if seq is None:
+                    continue
+                self._next_seq = max(self._next_seq, seq + 1)
+                # Duplicados posibles si una compactación se interrumpió antes de guardar los ACKs
+                if seq in self._acked or seq in self._locations:
+                    continue
+                if seq in state:
+                    item.update(state[seq])
+                    self._state[seq] = state[seq]
+                self._index(item, (index, position))
+
+        if indexes:
+            last = indexes[-1]
+            if self._segment_path(last).stat().st_size >= self.segment_max_bytes:
+                last += 1
+            self._open_segment(last)
+        else:
+            self._open_segment(0)
+
+        self._advance_low_water()
+
+    def _index(self, item: Dict, location: Tuple[int, int]):
+        seq = item["seq"]
+        self._locations[seq] = location
+        self._ids[item["id"]] = seq
+        if item.get("status") == "failed":
+            self._failed[seq] = item
+        else:
+            self._pending.setdefault(item.get("priority", 0), OrderedDict())[seq] = item
+
+    def _item(self, seq: int) -> Optional[Dict]:
+        if seq in self._failed:
+            return self._failed[seq]
+        for items_by_seq in self._pending.values():
+            if seq in items_by_seq:
+                return items_by_seq[seq]
+        return None
+
+    def _set_acked(self, seqs: set):
+        self._acked = seqs
+        self._acked_heap = sorted(seqs)  # Una lista ordenada ya es un heap válido
+
+    def _advance_low_water(self, persist: bool = True):
+        """Mueve la marca de agua al primer registro sin confirmar y borra segmentos viejos"""
+        if self._locations:
+            first_seq = next(iter(self._locations))
+            self._low_water = self._locations[first_seq]
+            # Poda incremental: O(log n) por ACK que queda por debajo de la marca
+            while self._acked_heap and self._acked_heap[0] <= first_seq:
+                self._acked.discard(heapq.heappop(self._acked_heap))
+        else:
+            self._low_water = (self._active_segment, self._active_size)
+            self._set_acked(set())
+
+        if not persist:
+            return
+
+        self._save_acks()
+
+        for index in self._segment_indexes():
+            if index >= self._low_water[0] or index == self._active_segment:
+                break
+            try:
+                self._segment_path(index).unlink()
+            except OSError as e:
+                log.warning(f"⚠️ No se pudo eliminar el segmento {index}: {e}")
+
+    def needs_compaction(self) -> bool:
+        """Hay bastantes registros muertos (ACKs sobre la marca de agua) como para reescribir los vivos"""
+        dead = len(self._acked)
+        if dead > self.compact_threshold:
+            return True
+        return dead >= self.compact_min_dead and dead >= self.compact_ratio * len(self._locations)
+
+    async def _compact(self):
+        """
+        Reescribe los registros vivos en un segmento nuevo y descarta los anteriores. Los
+        anexos durante la compactación van al segmento siguiente; si el proceso cae a mitad,
+        el segmento compactado solo tiene duplicados que la recuperación ignora
+        """
+        log.info(f"🧹 Compactando cola: {len(self._locations)} registros vivos, {len(self._acked)} confirmados")
+        self._compacting = True
+        try:
+            target = self._active_segment + 1
+            self._open_segment(target + 1)
+            boundary = self._next_seq
+            # Copias por tandas cediendo el event loop (el hilo no debe ver items que cambian)
+            seqs = list(self._locations)
+            snapshot = []
+            for start in range(0, len(seqs), COMPACT_CHUNK):
+                for seq in seqs[start:start + COMPACT_CHUNK]:
+                    item = self._item(seq)
+                    if item is not None:
+                        snapshot.append(dict(item))
+                await asyncio.sleep(0)
+            offsets = await asyncio.to_thread(self._write_segment, target, snapshot)
+
+            for seq, offset in offsets.items():
+                if seq in self._locations:
+                    self._locations[seq] = (target, offset)
+            # Los ACKs de registros copiados (o anexados después) siguen vigentes en los segmentos nuevos
+            self._set_acked({seq for seq in self._acked if seq in offsets or seq >= boundary})
+            self._state = {seq: state for seq, state in self._state.items() if seq in self._touched}
+            self._advance_low_water()
+        finally:
+            self._compacting = False
+            self._touched = set()
+
+    def _write_segment(self, index: int, items: List[Dict]) -> Dict[int, int]:
+        """Escribe `items` en un segmento nuevo (en un hilo). Retorna seq -> offset"""
+        offsets = {}
+        position = 0
+        with open(self._segment_path(index), "wb") as f:
+            for item in items:
+                record = _encode_record(item)
+                offsets[item["seq"]] = position
+                f.write(record)
+                position += len(record)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        return offsets
+
+    def _write_record(self, item: Dict) -> Tuple[int, int]:
+        record = _encode_record(item)
+        position = self._active_size
+        self._active_file.write(record)
+        self._active_file.flush()
+        if self.fsync:
+            os.fsync(self._active_file.fileno())
+        self._active_size += len(record)
+        return self._active_segment, position
+
+    # ------------------------------------------------------------------
+    # API de almacenamiento usada por EventQueue
+    # ------------------------------------------------------------------
+
+    def append(self, item: Dict) -> Dict:
+        """Anexa un item al segmento activo (O(1))"""
+        if self._active_size >= self.segment_max_bytes:
+            self._open_segment(self._active_segment + 1)
+
+        seq = self._next_seq
+        self._next_seq += 1
+        item["seq"] = seq
+        item["id"] = item.get("id") or f"{item.get('created_at', '')}_{item.get('event_type')}_{seq}"
+
+        self._index(item, self._write_record(item))
+        return item
+
+    def pending(self, limit: Optional[int] = None) -> List[Dict]:
+        """Items pendientes por prioridad (mayor primero) y orden de llegada"""
+        items: List[Dict] = []
+        for priority in sorted(self._pending, reverse=True):
+            for item in self._pending[priority].values():
+                items.append(item)
+                if limit is not None and len(items) >= limit:
+                    return items
+        return items
+
+    def ack(self, ids: List[str], persist: bool = True):
+        """
+        Confirma items enviados: se eliminan de memoria y se registran en acks.json.
+        Con persist=False solo se actualiza la memoria (se guardará en el siguiente ACK)
+        """
+        if not ids:
+            return
+        for item_id in ids:
+            seq = self._ids.pop(item_id, None)
+            if seq is None:
+                continue
+            self._locations.pop(seq, None)
+            self._state.pop(seq, None)
+            self._failed.pop(seq, None)
+            for items in self._pending.values():
+                if items.pop(seq, None) is not None:
+                    break
+            self._acked.add(seq)
+            heapq.heappush(self._acked_heap, seq)
+        self._advance_low_water(persist)
+
+    def update(self, items: List[Dict]):
+        """Persiste reintentos y estado (pending/failed) de los items indicados"""
+        if not items:
+            return
+        for item in items:
+            seq = self._ids.get(item.get("id"))
+            if seq is None:
+                continue
+            if self._compacting:
+                self._touched.add(seq)
+            self._state[seq] = {
+                key: item[key]
+                for key in ("retry_count", "last_retry", "status", "error")
+                if key in item
+            }
+            if item.get("status") == "failed":
+                for items_by_seq in self._pending.values():
+                    if items_by_seq.pop(seq, None) is not None:
+                        break
+                self._failed[seq] = item
+        self._save_acks()
+
+    def pending_by_type(self, event_types: List[str]) -> List[Dict]:
+        """Items pendientes de los tipos indicados, en orden de llegada"""
+        items = [
+            item
+            for items_by_seq in self._pending.values()
+            for item in items_by_seq.values()
+            if item.get("event_type") in event_types
+        ]
+        return sorted(items, key=lambda item: item["seq"])
+
+    def supersede(self, old_id: str, item: Dict) -> Dict:
+        """
+        Anexa `item` y confirma el item `old_id` al que reemplaza.
+        El ACK no se escribe en disco al momento: si el proceso cae antes, ambos
+        items reaparecen y EventQueue los vuelve a combinar al arrancar
+        """
+        self.append(item)
+        self.ack([old_id], persist=False)
+        return item
+
+    async def compact(self):
+        """
+        Compacta si los registros muertos superan el umbral o la proporción de vivos (lo
+        llama el planificador); la reescritura no bloquea el event loop
+        """
+        if not self._compacting and self.needs_compaction():
+            await self._compact()
+
+    def count_pending(self) -> int:
+        return sum(len(items) for items in self._pending.values())
+
+    def count_failed(self) -> int:
+        return len(self._failed)
+
+    def count_pending_by_priority(self) -> Dict[int, int]:
+        return {priority: len(items) for priority, items in self._pending.items() if items}
+
+    def close(self):
+        """Guarda los ACKs aún no persistidos (p. ej. de coalescencias) y cierra el segmento activo"""
+        self._save_acks()
+        if self._active_file:
+            self._active_file.close()
+            self._active_file = None
@@ -0,0 +1,164 @@
+"""
+Almacenamiento de la cola de eventos en SQLite (outbox durable)
+Usa modo WAL y un índice (status, priority, seq) para que obtener los siguientes N
+pendientes, contar el backlog y confirmar envíos sean operaciones indexadas. Dentro de
+una prioridad el orden es el de inserción (seq), no created_at, que puede repetirse
+"""
+import json
+import sqlite3
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT NOT NULL UNIQUE,
+        event_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        retry_count INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        error TEXT,
+        last_retry TEXT,
+        received_at REAL
+    )
+    """,
+    # Índice compuesto para el siguiente lote pendiente en orden de prioridad y de llegada
+    """
+    CREATE INDEX IF NOT EXISTS idx_outbox_status_priority_seq
+    ON outbox(status, priority DESC, seq)
+    """,
+]
+
+COLUMNS = ("seq", "id", "event_type", "payload", "priority", "created_at",
+           "retry_count", "status", "error", "last_retry", "received_at")
+
+
+class SQLiteQueueStore:
+    """Outbox en SQLite con la misma interfaz que SegmentedLogStore"""
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=10.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        # Outbox creado antes de existir received_at (epoch de recepción, para trazas)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+        if "received_at" not in columns:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN received_at REAL")
+
+    def _row_to_item(self, row) -> Dict:
+        item = dict(zip(COLUMNS, row))
+        item["payload"] = json.loads(item["payload"])
+        return {k: v for k, v in item.items() if v is not None}
+
+    def append(self, item: Dict) -> Dict:
+        """Inserta un item pendiente (O(log n))"""
+        with self.conn:
+            self._insert(item)
+        return item
+
+    def _insert(self, item: Dict):
+        item["id"] = item.get("id") or f"{item.get('created_at', '')}_{item['event_type']}_{uuid.uuid4().hex[:12]}"
+        cursor = self.conn.execute(
+            """
+            INSERT INTO outbox (id, event_type, payload, priority, created_at, retry_count, status, error, last_retry, received_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                item["id"],
+                item["event_type"],
+                json.dumps(item.get("payload"), ensure_ascii=False),
+                item.get("priority", 0),
+                item.get("created_at", ""),
+                item.get("retry_count", 0),
+                item.get("status", "pending"),
+                item.get("error"),
+                item.get("last_retry"),
+                item.get("received_at"),
+            ),
+        )
+        item["seq"] = cursor.lastrowid
+
+    def pending(self, limit: Optional[int] = None) -> List[Dict]:
+        """Siguientes items pendientes por prioridad (mayor primero) y orden de llegada"""
+        query = f"""
+            SELECT {', '.join(COLUMNS)} FROM outbox
+            WHERE status = 'pending'
+            ORDER BY priority DESC, seq
+        """
+        params = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        return [self._row_to_item(row) for row in self.conn.execute(query, params)]
+
+    def pending_by_type(self, event_types: List[str]) -> List[Dict]:
+        """Items pendientes de los tipos indicados, en orden de llegada"""
+        placeholders = ", ".join("?" for _ in event_types)
+        query = f"""
+            SELECT {', '.join(COLUMNS)} FROM outbox
+            WHERE status = 'pending' AND event_type IN ({placeholders})
+            ORDER BY seq
+        """
+        return [self._row_to_item(row) for row in self.conn.execute(query, tuple(event_types))]
+
+    def supersede(self, old_id: str, item: Dict) -> Dict:
+        """Inserta `item` y elimina el item `old_id` al que reemplaza, en una transacción"""
+        with self.conn:
+            self._insert(item)
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (old_id,))
+        return item
+
+    def ack(self, ids: List[str]):
+        """Confirma items enviados eliminándolos por su clave única"""
+        if not ids:
+            return
+        with self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(item_id,) for item_id in ids])
+
+    def update(self, items: List[Dict]):
+        """Persiste reintentos y estado (pending/failed) de los items indicados"""
+        if not items:
+            return
+        with self.conn:
+            self.conn.executemany(
+                """
+                UPDATE outbox SET retry_count = ?, last_retry = ?, status = ?, error = ?
+                WHERE id = ?
+                """,
+                [
+                    (
+                        item.get("retry_count", 0),
+                        item.get("last_retry"),
+                        item.get("status", "pending"),
+                        item.get("error"),
+                        item["id"],
+                    )
+                    for item in items
+                ],
+            )
+
+    async def compact(self):
+        """Vuelca el WAL a la base y lo trunca para que no crezca entre checkpoints automáticos"""
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def count_pending(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def count_failed(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+
+    def count_pending_by_priority(self) -> Dict[int, int]:
+        rows = self.conn.execute(
+            "SELECT priority, COUNT(*) FROM outbox WHERE status = 'pending' GROUP BY priority"
+        ).fetchall()
+        return {priority: count for priority, count in rows}
+
+    def close(self):
+        self.conn.close()
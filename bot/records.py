@@ -0,0 +1,163 @@
+"""
+Modelo interno compacto de eventos
+Cada evento capturado es un EventRecord con __slots__ (sin __dict__ por instancia),
+username internado, tipo numérico y timestamps monotónicos de recepción (handler) y de
+normalización (creación del record), usados por tracing.py. El dict que
+espera la API (body de POST /events) se construye solo al enviar, con to_wire()
+"""
+import sys
+import time
+from enum import IntEnum
+from typing import Dict, Optional
+
+
+class EventType(IntEnum):
+    COMMENT = 1
+    DONATION = 2
+    FOLLOW = 3
+    JOIN = 4
+    SHARE = 5
+    LIKE = 6
+
+    @property
+    def wire_name(self) -> str:
+        return WIRE_NAMES[self]
+
+
+WIRE_NAMES = {event_type: event_type.name.lower() for event_type in EventType}
+
+
+class UserRecord:
+    """Usuario normalizado; los campos son los de user_data en la API"""
+
+    __slots__ = (
+        "username",
+        "display_name",
+        "profile_image_url",
+        "follower_count",
+        "following_count",
+        "is_following_streamer",
+    )
+
+    def __init__(
+        self,
+        username: str,
+        display_name: Optional[str] = None,
+        profile_image_url: Optional[str] = None,
+        follower_count: Optional[int] = None,
+        following_count: Optional[int] = None,
+        is_following_streamer: Optional[bool] = None,
+    ):
+        # Los mismos usuarios se repiten en muchos eventos: una sola copia del string
+        self.username = sys.intern(username)
+        self.display_name = display_name
+        self.profile_image_url = profile_image_url
+        self.follower_count = follower_count
+        self.following_count = following_count
+        self.is_following_streamer = is_following_streamer
+
+    @property
+    def label(self) -> str:
+        """Nombre para mostrar en logs"""
+        return self.display_name or self.username
+
+    def profile(self) -> tuple:
+        """Campos de perfil (sin username), para detectar cambios"""
+        return (
+            self.display_name,
+            self.profile_image_url,
+            self.follower_count,
+            self.following_count,
+            self.is_following_streamer,
+        )
+
+    def to_wire(self) -> Dict:
+        return {
+            "username": self.username,
+            "display_name": self.display_name,
+            "profile_image_url": self.profile_image_url,
+            "follower_count": self.follower_count,
+            "following_count": self.following_count,
+            "is_following_streamer": self.is_following_streamer,
+        }
+
+
+class DonationRecord:
+    __slots__ = ("gift_type", "gift_name", "gift_count", "tiktok_coins", "gift_image_url")
+
+    def __init__(
+        self,
+        gift_type,
+        gift_name: str,
+        gift_count: int,
+        tiktok_coins: Optional[int] = None,
+        gift_image_url: Optional[str] = None,
+    ):
+        self.gift_type = gift_type
+        self.gift_name = gift_name
+        self.gift_count = gift_count
+        self.tiktok_coins = tiktok_coins
+        self.gift_image_url = gift_image_url
+
+    def to_wire(self) -> Dict:
+        return {
+            "gift_type": self.gift_type,
+            "gift_name": self.gift_name,
+            "gift_count": self.gift_count,
+            "gift_value": None,  # TikTok no siempre proporciona el valor en USD
+            "tiktok_coins": self.tiktok_coins,
+            "gift_image_url": self.gift_image_url,
+            "message": None,
+        }
+
+
+class EventRecord:
+    """Evento capturado; stream_id y profile_unchanged se completan al entregarlo"""
+
+    __slots__ = (
+        "type",
+        "user",
+        "content",
+        "metadata",
+        "donation",
+        "received_at",
+        "normalized_at",
+        "stream_id",
+        "profile_unchanged",
+    )
+
+    def __init__(
+        self,
+        event_type: EventType,
+        user: UserRecord,
+        content: Optional[str] = None,
+        metadata: Optional[Dict] = None,
+        donation: Optional[DonationRecord] = None,
+        received_at: Optional[float] = None,
+    ):
+        self.type = event_type
+        self.user = user
+        self.content = content
+        self.metadata = metadata
+        self.donation = donation
+        self.normalized_at = time.monotonic()
+        # received_at: instante en que el evento llegó al handler (o el primero de la agregación)
+        self.received_at = self.normalized_at if received_at is None else received_at
+        self.stream_id: Optional[str] = None
+        self.profile_unchanged = False
+
+    def to_wire(self) -> Dict:
+        """Body de POST /events (y elemento de POST /events/bulk)"""
+        if self.profile_unchanged:
+            user_data = {"username": self.user.username, "profile_unchanged": True}
+        else:
+            user_data = self.user.to_wire()
+        event_data = {"content": self.content, "metadata": self.metadata or {}}
+        if self.donation is not None:
+            event_data["donation"] = self.donation.to_wire()
+        return {
+            "event_type": self.type.wire_name,
+            "stream_id": self.stream_id,
+            "user_data": user_data,
+            "event_data": event_data,
+        }
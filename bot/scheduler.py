@@ -0,0 +1,143 @@
+"""
+Planificador de tareas periódicas del proceso
+Una sola tarea de asyncio ejecuta todo el trabajo periódico (drenado de la cola,
+muestreo de viewers, compactación, volcados de diagnóstico). Los trabajos se
+registran por nombre: registrar otra vez un nombre reemplaza al anterior (no se
+duplican bucles), una ejecución nunca se solapa con la anterior del mismo trabajo
+y shutdown() cancela todo
+"""
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Optional
+
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("scheduler")
+
+JOB_RUNS = metrics.counter("bot_scheduler_job_runs_total", "Ejecuciones de tareas periódicas por resultado", ("job", "status"))
+JOB_SECONDS = metrics.histogram("bot_scheduler_job_seconds", "Duración de las tareas periódicas", ("job",))
+
+
+class Job:
+    __slots__ = ("name", "interval", "fn", "next_run", "task", "runs", "failures", "skipped", "last_duration")
+
+    def __init__(self, name: str, interval: float, fn: Callable[[], Any]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn  # Función o corrutina sin argumentos
+        self.next_run = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # Turnos omitidos porque la ejecución anterior seguía en curso
+        self.last_duration: Optional[float] = None
+
+
+class Scheduler:
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def every(self, name: str, interval: float, fn: Callable[[], Any], delay: Optional[float] = None) -> Job:
+        """
+        Registra (o reemplaza) `fn` para ejecutarse cada `interval` segundos; la primera
+        ejecución es tras `delay` segundos (default: `interval`)
+        """
+        job = self._jobs.get(name)
+        if job is None:
+            job = self._jobs[name] = Job(name, interval, fn)
+        else:
+            # Reemplazo: la ejecución en curso del trabajo anterior termina normalmente
+            job.interval = interval
+            job.fn = fn
+        job.next_run = time.monotonic() + (interval if delay is None else delay)
+        if self._runner is None or self._runner.done():
+            # Se crea en el event loop en curso (uno nuevo por asyncio.run)
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return job
+
+    def cancel(self, name: str):
+        """Quita el trabajo y cancela su ejecución en curso (si hay)"""
+        job = self._jobs.pop(name, None)
+        if job is not None and job.task is not None:
+            job.task.cancel()
+
+    def has_job(self, name: str) -> bool:
+        return name in self._jobs
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            next_due = None
+            for job in list(self._jobs.values()):
+                if job.next_run <= now:
+                    job.next_run = now + job.interval
+                    if job.task is None or job.task.done():
+                        job.task = asyncio.create_task(self._execute(job))
+                    else:
+                        job.skipped += 1
+                if next_due is None or job.next_run < next_due:
+                    next_due = job.next_run
+
+            self._wakeup.clear()
+            timeout = None if next_due is None else max(0.0, next_due - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Job):
+        started = time.monotonic()
+        status = "ok"
+        try:
+            result = job.fn()
+            if inspect.isawaitable(result):
+                await result
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            status = "error"
+            job.failures += 1
+            log.warning("⚠️ Error en tarea periódica %s: %s", job.name, e, extra={"kind": f"scheduler.{job.name}"})
+        finally:
+            job.runs += 1
+            job.last_duration = time.monotonic() - started
+            JOB_RUNS.inc(job.name, status)
+            JOB_SECONDS.observe(job.last_duration, job.name)
+
+    async def shutdown(self):
+        """Cancela el planificador y todas las ejecuciones en curso"""
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        self._jobs.clear()
+        if self._runner is not None:
+            tasks.append(self._runner)
+            self._runner = None
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        return {
+            name: {
+                "interval": job.interval,
+                "runs": job.runs,
+                "failures": job.failures,
+                "skipped": job.skipped,
+                "running": job.task is not None and not job.task.done(),
+                "last_duration": job.last_duration,
+            }
+            for name, job in self._jobs.items()
+        }
+
+
+# Un solo planificador por proceso
+scheduler = Scheduler()
+
+metrics.collector("bot_scheduler_jobs", "Tareas periódicas registradas", lambda: [({}, len(scheduler.get_stats()))])
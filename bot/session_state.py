@@ -0,0 +1,83 @@
+"""
+Estado de sesión persistido entre reconexiones y reinicios
+Guarda por streamer el streamer_id, el día de directo, el stream en curso y su
+stream principal/número de parte. Al reconectar el cliente lo usa en lugar de
+registrar otra vez el streamer (POST /streamers) y descargar todos sus streams
+(GET /streams): si el stream se vio activo hace poco se reanuda sin llamadas a la
+API, si no se valida con un solo GET /streams/{id}
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+from logs import get_logger
+
+log = get_logger("session")
+
+
+class SessionState:
+    """
+    Formato del archivo (una entrada por username):
+
+        {"<username>": {"streamer_id": ..., "stream_day": "YYYY-MM-DD", "stream_id": ...,
+                        "principal_id": ..., "part_number": 2, "ended": false, "last_seen": <epoch>}}
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._data: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError) as e:
+            log.warning(f"⚠️ Estado de sesión ilegible ({self.path}), se ignora: {e}")
+            return {}
+
+    def _save(self):
+        # Escritura atómica: un corte a mitad de escritura no deja el archivo a medias
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo guardar el estado de sesión: {e}")
+
+    def get(self, username: str) -> Dict:
+        return dict(self._data.get(username, {}))
+
+    def update(self, username: str, **fields):
+        """Combina `fields` con el estado del streamer y lo persiste (last_seen = ahora)"""
+        entry = self._data.setdefault(username, {})
+        entry.update(fields)
+        entry["last_seen"] = time.time()
+        self._save()
+
+    def remember_stream(self, username: str, stream_day: str, stream_id: str, principal_id: str, part_number: int):
+        self.update(
+            username,
+            stream_day=stream_day,
+            stream_id=stream_id,
+            principal_id=principal_id,
+            part_number=part_number,
+            ended=False,
+        )
+
+    def forget_stream(self, username: str, streamer: bool = False):
+        """
+        El stream guardado ya no es válido (no existe en la API): se resolverá de nuevo.
+        Con streamer=True también se olvida el streamer_id (BD reiniciada o restaurada)
+        """
+        entry = self._data.get(username)
+        if entry:
+            keys = ("stream_day", "stream_id", "principal_id", "part_number", "ended")
+            for key in keys + (("streamer_id",) if streamer else ()):
+                entry.pop(key, None)
+            self._save()
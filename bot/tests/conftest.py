@@ -0,0 +1,10 @@
+"""
+Configuración de pytest: los módulos del bot se importan como en producción (desde bot/)
+
+Uso (desde bot/):
+    python -m pytest -q tests
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
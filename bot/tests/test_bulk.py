@@ -0,0 +1,93 @@
+"""Ida y vuelta de POST /events/bulk contra fake_api.py (batcher y drenado de la cola)"""
+import asyncio
+
+from aiohttp import web
+
+from api_client import ApiClient
+from batcher import EventBatcher
+from event_queue import EventQueue
+from fake_api import FakeApi
+
+
+async def start_api(fake: FakeApi):
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}/api"
+
+
+def comment(n: int, stream_id="s1") -> dict:
+    return {"event_type": "comment", "stream_id": stream_id, "event_data": {"content": str(n)}}
+
+
+def test_batcher_routes_rejected_events_to_failure():
+    async def scenario():
+        fake = FakeApi(verbose=False)
+        runner, url = await start_api(fake)
+        failed = []
+        batcher = EventBatcher(ApiClient(url), failed.extend, max_batch=10)
+        try:
+            for n in range(5):
+                # El evento 2 no tiene stream_id: la API lo rechaza por índice
+                await batcher.add(comment(n, stream_id=None if n == 2 else "s1"))
+            await batcher.close()
+        finally:
+            await batcher.api.close()
+            await runner.cleanup()
+        return fake, batcher, failed
+
+    fake, batcher, failed = asyncio.run(scenario())
+    assert fake.requests["POST /events/bulk"] == 1
+    assert [event["event_data"]["content"] for event in fake.events] == ["0", "1", "3", "4"]
+    assert [event["event_data"]["content"] for event in failed] == ["2"]
+    assert batcher.sent == 4
+
+
+def test_batcher_falls_back_to_single_sends_in_order():
+    async def scenario():
+        fake = FakeApi(bulk=False, verbose=False)
+        runner, url = await start_api(fake)
+        failed = []
+        batcher = EventBatcher(ApiClient(url), failed.extend, max_batch=10)
+        try:
+            for n in range(6):
+                await batcher.add(comment(n, stream_id=f"s{n % 2}"))
+            await batcher.close()
+        finally:
+            await batcher.api.close()
+            await runner.cleanup()
+        return fake, failed
+
+    fake, failed = asyncio.run(scenario())
+    assert fake.requests["POST /events"] == 6
+    assert not failed
+    for stream_id in ("s0", "s1"):
+        contents = [event["event_data"]["content"] for event in fake.events if event["stream_id"] == stream_id]
+        assert contents == sorted(contents, key=int)
+
+
+def test_queue_drain_uses_bulk_and_retries_rejected(tmp_path):
+    async def scenario():
+        fake = FakeApi(verbose=False)
+        runner, url = await start_api(fake)
+        queue = EventQueue(queue_file=str(tmp_path / "queue.json"), api_client=ApiClient(url), drain_rate=0)
+        try:
+            for n in range(300):
+                queue.add_event("event", comment(n, stream_id=None if n == 7 else "s1"))
+            await queue.process_queue()
+            first = (len(fake.events), fake.requests["POST /events/bulk"], queue.get_queue_size())
+            # El rechazado se reintenta hasta max_retries y luego queda como fallido
+            for _ in range(queue.max_retries):
+                await queue.process_queue()
+            return fake, queue, first
+        finally:
+            await queue.api_client.close()
+            queue.close()
+            await runner.cleanup()
+
+    fake, queue, first = asyncio.run(scenario())
+    assert first == (299, 2, 1)
+    assert [event["event_data"]["content"] for event in fake.events] == [str(n) for n in range(300) if n != 7]
+    assert queue.get_queue_size() == 0
+    assert queue.store.count_failed() == 1
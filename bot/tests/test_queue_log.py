@@ -0,0 +1,171 @@
+"""Log segmentado (queue_log.py): recuperación, ACKs, compactación y coalescencia tras reiniciar"""
+import asyncio
+import json
+
+from event_queue import EventQueue
+from queue_log import RECORD_HEADER, SegmentedLogStore
+
+
+def new_item(n: int, event_type: str = "event", priority: int = 0) -> dict:
+    return {"event_type": event_type, "payload": {"n": n}, "priority": priority, "status": "pending"}
+
+
+def payloads(store: SegmentedLogStore) -> list:
+    return [item["payload"]["n"] for item in store.pending()]
+
+
+def segment(store: SegmentedLogStore, index: int = 0):
+    return store.directory / f"{index:08d}.seg"
+
+
+def test_pending_survives_restart_in_order(tmp_path):
+    store = SegmentedLogStore(tmp_path)
+    for n in range(5):
+        store.append(new_item(n))
+    store.append(new_item(99, priority=2))
+    store.close()
+
+    store = SegmentedLogStore(tmp_path)
+    assert payloads(store) == [99, 0, 1, 2, 3, 4]
+    # Los seqs siguen después de los recuperados
+    assert store.append(new_item(5))["seq"] == 6
+    store.close()
+
+
+def test_truncated_record_is_discarded(tmp_path):
+    store = SegmentedLogStore(tmp_path)
+    for n in range(3):
+        store.append(new_item(n))
+    store.close()
+    path = segment(store)
+    size = path.stat().st_size
+    # Caída a mitad de escritura: el último registro queda incompleto
+    with open(path, "r+b") as f:
+        f.truncate(size - 5)
+
+    store = SegmentedLogStore(tmp_path)
+    assert payloads(store) == [0, 1]
+    # El segmento se trunca al último registro válido y se puede seguir anexando
+    store.append(new_item(3))
+    store.close()
+    assert payloads(SegmentedLogStore(tmp_path)) == [0, 1, 3]
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    store = SegmentedLogStore(tmp_path)
+    for n in range(3):
+        store.append(new_item(n))
+    store.close()
+    path = segment(store)
+    data = bytearray(path.read_bytes())
+    length, _ = RECORD_HEADER.unpack_from(data, 0)
+    # Un byte cambiado en el segundo registro: el CRC no coincide
+    data[2 * RECORD_HEADER.size + length + 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    store = SegmentedLogStore(tmp_path)
+    assert payloads(store) == [0]
+    store.close()
+
+
+def test_ack_moves_low_water_mark(tmp_path):
+    store = SegmentedLogStore(tmp_path)
+    items = [store.append(new_item(n)) for n in range(4)]
+    store.ack([items[0]["id"], items[2]["id"]])
+
+    acks = json.loads(store.acks_file.read_text())
+    # La marca avanza hasta el primer sin confirmar; el ACK de arriba queda como rango
+    assert (acks["segment"], acks["offset"]) == store._locations[items[1]["seq"]]
+    assert acks["acked"] == [[items[2]["seq"], items[2]["seq"]]]
+    store.close()
+
+    store = SegmentedLogStore(tmp_path)
+    assert payloads(store) == [1, 3]
+    store.ack([item["id"] for item in store.pending()])
+    assert json.loads(store.acks_file.read_text())["acked"] == []
+    store.close()
+    assert payloads(SegmentedLogStore(tmp_path)) == []
+
+
+def test_retry_state_survives_restart(tmp_path):
+    store = SegmentedLogStore(tmp_path)
+    items = [store.append(new_item(n)) for n in range(2)]
+    items[0].update({"retry_count": 3, "status": "failed", "error": "HTTP 400"})
+    items[1]["retry_count"] = 1
+    store.update(items)
+    store.close()
+
+    store = SegmentedLogStore(tmp_path)
+    assert store.count_failed() == 1
+    assert [(item["payload"]["n"], item["retry_count"]) for item in store.pending()] == [(1, 1)]
+    store.close()
+
+
+def test_full_segments_are_deleted(tmp_path):
+    store = SegmentedLogStore(tmp_path, segment_max_bytes=200)
+    items = [store.append(new_item(n)) for n in range(20)]
+    assert len(store._segment_indexes()) > 2
+    store.ack([item["id"] for item in items[:-1]])
+    assert store._segment_indexes() == [store._active_segment]
+    store.close()
+    assert payloads(SegmentedLogStore(tmp_path, segment_max_bytes=200)) == [19]
+
+
+def test_compaction_keeps_live_records(tmp_path):
+    store = SegmentedLogStore(tmp_path, compact_min_dead=10, compact_ratio=0.5)
+    hold = store.append(new_item(-1))
+    dead = [store.append(new_item(n)) for n in range(30)]
+    live = [store.append(new_item(n)) for n in range(30, 40)]
+    # El primer item sin confirmar retiene la marca: los ACKs quedan como registros muertos
+    store.ack([item["id"] for item in dead])
+    assert store.needs_compaction()
+    live[0]["retry_count"] = 2
+    store.update([live[0]])
+
+    asyncio.run(store.compact())
+    assert not store.needs_compaction()
+    assert len(store._acked) == 0
+    store.append(new_item(40))
+    store.close()
+
+    store = SegmentedLogStore(tmp_path)
+    assert payloads(store) == [-1] + list(range(30, 41))
+    assert store.pending()[1]["retry_count"] == 2
+    store.ack([hold["id"]])
+    assert payloads(store)[0] == 30
+    store.close()
+
+
+def test_compaction_waits_for_threshold(tmp_path):
+    store = SegmentedLogStore(tmp_path, compact_min_dead=10, compact_ratio=0.5)
+    store.append(new_item(-1))
+    dead = [store.append(new_item(n)) for n in range(5)]
+    store.ack([item["id"] for item in dead])
+    segments = store._segment_indexes()
+
+    asyncio.run(store.compact())
+    assert store._segment_indexes() == segments
+    store.close()
+
+
+def test_supersede_across_restart(tmp_path):
+    queue_file = tmp_path / "queue.json"
+    queue = EventQueue(queue_file=str(queue_file), backend="log")
+    queue.add_event("event", {"stream_id": "s1", "n": 0})
+    for viewers in (10, 20, 30):
+        queue.add_event("viewer_count", {"stream_id": "s1", "viewer_count": viewers}, priority=1)
+    # Sin close(): los ACKs de los reemplazos no llegaron a disco (caída)
+    queue.store._active_file.close()
+
+    queue = EventQueue(queue_file=str(queue_file), backend="log")
+    counts = [item for item in queue.store.pending() if item["event_type"] == "viewer_count"]
+    assert [item["payload"]["viewer_count"] for item in counts] == [30]
+    assert queue.get_queue_size() == 2
+
+    # El reemplazo sigue combinando con el pendiente recuperado
+    queue.add_event("viewer_count", {"stream_id": "s1", "viewer_count": 40}, priority=1)
+    queue.close()
+    queue = EventQueue(queue_file=str(queue_file), backend="log")
+    counts = [item for item in queue.store.pending() if item["event_type"] == "viewer_count"]
+    assert [item["payload"]["viewer_count"] for item in counts] == [40]
+    queue.close()
@@ -0,0 +1,124 @@
+"""Outbox SQLite (queue_sqlite.py): orden, ACKs, estado, reinicios e importación de la cola JSON antigua"""
+import json
+import sqlite3
+
+from event_queue import EventQueue
+from queue_sqlite import SQLiteQueueStore
+
+
+def new_item(n: int, priority: int = 0, created_at: str = "2024-01-01T00:00:00") -> dict:
+    return {"event_type": "event", "payload": {"n": n}, "priority": priority, "created_at": created_at}
+
+
+def payloads(store: SQLiteQueueStore) -> list:
+    return [item["payload"]["n"] for item in store.pending()]
+
+
+def test_pending_by_priority_then_insertion_order(tmp_path):
+    store = SQLiteQueueStore(tmp_path / "queue.db")
+    # Mismo created_at para todos: el orden dentro de una prioridad lo da seq
+    for n in (3, 1, 2):
+        store.append(new_item(n))
+    store.append(new_item(9, priority=2))
+    store.append(new_item(5, priority=1))
+
+    assert payloads(store) == [9, 5, 3, 1, 2]
+    assert [item["payload"]["n"] for item in store.pending(limit=2)] == [9, 5]
+    assert store.count_pending_by_priority() == {0: 3, 1: 1, 2: 1}
+    store.close()
+
+
+def test_pending_query_uses_index(tmp_path):
+    store = SQLiteQueueStore(tmp_path / "queue.db")
+    plan = store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT seq FROM outbox WHERE status = 'pending' ORDER BY priority DESC, seq LIMIT 10"
+    ).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "idx_outbox_status_priority_seq" in details
+    assert "TEMP B-TREE" not in details
+    store.close()
+
+
+def test_ack_update_and_restart(tmp_path):
+    path = tmp_path / "queue.db"
+    store = SQLiteQueueStore(path)
+    items = [store.append(new_item(n)) for n in range(4)]
+    store.ack([items[0]["id"]])
+    items[1].update({"retry_count": 3, "status": "failed", "error": "HTTP 400"})
+    items[2]["retry_count"] = 1
+    store.update([items[1], items[2]])
+    store.close()
+
+    store = SQLiteQueueStore(path)
+    assert store.count_pending() == 2
+    assert store.count_failed() == 1
+    assert [(item["payload"]["n"], item.get("retry_count")) for item in store.pending()] == [(2, 1), (3, 0)]
+    store.close()
+
+
+def test_supersede_replaces_pending_item(tmp_path):
+    store = SQLiteQueueStore(tmp_path / "queue.db")
+    old = store.append({"event_type": "viewer_count", "payload": {"viewer_count": 10}, "created_at": ""})
+    store.supersede(old["id"], {"event_type": "viewer_count", "payload": {"viewer_count": 20}, "created_at": ""})
+
+    assert [item["payload"]["viewer_count"] for item in store.pending_by_type(["viewer_count"])] == [20]
+    store.close()
+
+
+def test_outbox_without_received_at_is_upgraded(tmp_path):
+    path = tmp_path / "queue.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        """
+        CREATE TABLE outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            retry_count INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            last_retry TEXT
+        )
+        """
+    )
+    conn.execute(
+        "INSERT INTO outbox (id, event_type, payload, created_at) VALUES ('a', 'event', '{\"n\": 1}', '')"
+    )
+    conn.commit()
+    conn.close()
+
+    store = SQLiteQueueStore(path)
+    assert payloads(store) == [1]
+    store.append({**new_item(2), "received_at": 1700000000.0})
+    assert store.pending()[1]["received_at"] == 1700000000.0
+    store.close()
+
+
+def test_legacy_json_queue_is_imported(tmp_path):
+    queue_file = tmp_path / "queue.json"
+    legacy = [
+        {"id": "1", "event_type": "event", "payload": {"n": 1}, "priority": 0,
+         "created_at": "2024-01-01T00:00:00", "retry_count": 1, "status": "pending"},
+        {"id": "2", "event_type": "event", "payload": {"n": 2}, "priority": 0,
+         "created_at": "2024-01-01T00:00:01", "retry_count": 0, "status": "sent"},
+        {"id": "3", "event_type": "stream_update", "payload": {"id": "s1", "ended_at": "x"}, "priority": 2,
+         "created_at": "2024-01-01T00:00:02", "retry_count": 3, "status": "failed", "error": "HTTP 400"},
+    ]
+    queue_file.write_text(json.dumps(legacy))
+
+    queue = EventQueue(queue_file=str(queue_file), backend="sqlite")
+    # Los enviados no se importan; pendientes y fallidos sí, con su estado
+    assert [item["payload"]["n"] for item in queue.store.pending()] == [1]
+    assert queue.store.pending()[0]["retry_count"] == 1
+    assert queue.store.count_failed() == 1
+    assert not queue_file.exists()
+    assert (tmp_path / "queue.json.migrated").exists()
+    queue.close()
+
+    # Al siguiente arranque no se vuelve a importar
+    queue = EventQueue(queue_file=str(queue_file), backend="sqlite")
+    assert queue.get_stats()["pending"] == 1
+    queue.close()
@@ -4,7 +4,9 @@ Captura eventos de streams de TikTok y los envía a la API
 """
 import asyncio
 import os
-import requests
+import time
+from collections import deque
+from typing import Dict, Optional
 from TikTokLive import TikTokLiveClient
 from TikTokLive.events import (
     CommentEvent,
@@ -17,12 +19,53 @@ from TikTokLive.events import (
     LikeEvent,
 )
 from dotenv import load_dotenv
-from event_queue import EventQueue
+from event_queue import REJECTED, EventQueue, classify_response, is_provisional, new_provisional_id
+from api_client import ApiClient, UNAVAILABLE_ERRORS
+from delivery import DeliveryPipeline
+from batcher import EventBatcher
+from like_aggregator import LikeAggregator
+from gift_streaks import GiftStreakBuffer
+from viewer_sampler import ViewerSampler
+from profile_cache import ProfileCache
+from extractors import extractors
+from records import EventRecord, EventType, UserRecord
+from logs import get_logger, setup_logging, shutdown_logging
+from metrics import CONNECTS, DISCONNECTS, EVENTS_RECEIVED, metrics, start_loop_monitor, start_metrics_server
+from tracing import configure_from_env as configure_tracing, tracer
+from profiler import profiler
+from memtrace import memtracer
+from scheduler import scheduler
+from session_state import SessionState
 
 load_dotenv()
 
+log = get_logger("tiktok")
+
 API_URL = os.getenv("API_URL", "http://localhost:3000/api")
 STREAMER_USERNAME = os.getenv("STREAMER_USERNAME", "")
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "10000"))
+BATCH_MAX_EVENTS = int(os.getenv("BATCH_MAX_EVENTS", "200"))
+BATCH_MAX_AGE_MS = int(os.getenv("BATCH_MAX_AGE_MS", "250"))
+LIKE_WINDOW_SECONDS = float(os.getenv("LIKE_WINDOW_SECONDS", "5"))
+GIFT_STREAK_TIMEOUT = float(os.getenv("GIFT_STREAK_TIMEOUT", "15"))
+VIEWER_HISTORY_INTERVAL = float(os.getenv("VIEWER_HISTORY_INTERVAL", "10"))
+VIEWER_PATCH_INTERVAL = float(os.getenv("VIEWER_PATCH_INTERVAL", "10"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "600"))
+PROFILE_CACHE_MAX_MB = float(os.getenv("PROFILE_CACHE_MAX_MB", "8"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "250"))
+LOOP_SLOW_CALLBACK_MS = float(os.getenv("LOOP_SLOW_CALLBACK_MS", "100"))
+LOOP_WARN_INTERVAL = float(os.getenv("LOOP_WARN_INTERVAL", "30"))
+QUEUE_DRAIN_INTERVAL = float(os.getenv("QUEUE_DRAIN_INTERVAL", "10"))
+QUEUE_COMPACT_INTERVAL = float(os.getenv("QUEUE_COMPACT_INTERVAL", "60"))
+SESSION_STATE_FILE = os.getenv("SESSION_STATE_FILE", "bot_session_state.json")
+SESSION_TRUST_SECONDS = float(os.getenv("SESSION_TRUST_SECONDS", "300"))
+UNRESOLVED_BUFFER_SIZE = int(os.getenv("UNRESOLVED_BUFFER_SIZE", "5000"))
+RESOLVE_RETRY_SECONDS = float(os.getenv("RESOLVE_RETRY_SECONDS", "5"))
+
+# Trabajos del planificador que pertenecen al cliente (se cancelan en stop())
+CLIENT_JOBS = ("queue_drain", "queue_compaction", "viewer_sampling", "session_heartbeat")
 
 
 class TikTokStreamClient:
@@ -31,10 +74,99 @@ class TikTokStreamClient:
         self.api_url = api_url
         self.client = TikTokLiveClient(unique_id=username)
         self.stream_id = None
-        self.streamer_id = None
-        self.event_queue = EventQueue(queue_file="bot_event_queue.json", api_url=api_url)
-        self._queue_processor_task = None
+        # streamer_id y stream en curso persistidos entre reconexiones y reinicios
+        self.session = SessionState(SESSION_STATE_FILE)
+        self.streamer_id = self.session.get(username).get("streamer_id")
+        # Conexión con TikTok en curso (tarea del websocket); el resto del cliente vive entre reconexiones
+        self._connection: Optional[asyncio.Task] = None
+        self._started = False
+        self.connected = False
+        # ConnectEvent recibido y stream resuelto (connect() lo espera para el desglose de arranque)
+        self._ready = asyncio.Event()
+        self._connect_started = time.monotonic()
+        self._startup: Dict[str, float] = {}
+        # Resolución de streamer/stream única en vuelo: los que llegan mientras tanto esperan la misma
+        self._resolving: Optional[asyncio.Task] = None
+        self._last_resolve = float("-inf")
+        # Eventos recibidos antes de tener stream_id (se envían al resolverlo)
+        self._unresolved: deque = deque(maxlen=UNRESOLVED_BUFFER_SIZE)
+        # Día de directo del stream provisional (API caída) para guardarlo en la sesión al crearse
+        self._provisional_day: Optional[str] = None
+        # Cliente HTTP asíncrono compartido (pool keep-alive) para no bloquear el event loop
+        self.api = ApiClient(api_url)
+        self.event_queue = EventQueue(
+            queue_file="bot_event_queue.json",
+            api_url=api_url,
+            api_client=self.api,
+            on_resolved=self._on_queue_resolved,
+        )
+        # Buffer en memoria + workers: los handlers no esperan a la API
+        self.delivery = DeliveryPipeline(workers=DELIVERY_WORKERS, max_depth=DELIVERY_QUEUE_SIZE)
+        # Perfiles ya enviados: si no cambiaron, el evento solo lleva el username
+        self.profiles = ProfileCache(max_bytes=int(PROFILE_CACHE_MAX_MB * 1024 * 1024), ttl=PROFILE_CACHE_TTL)
+        # Lotes por tamaño o antigüedad hacia POST /events/bulk
+        self.batcher = EventBatcher(
+            self.api,
+            on_failure=self._queue_failed_events,
+            max_batch=BATCH_MAX_EVENTS,
+            max_age=BATCH_MAX_AGE_MS / 1000,
+        )
+        # Likes agregados por (usuario, ventana) para no enviar un evento por cada LikeEvent
+        self.likes = LikeAggregator(self._send_event, window=LIKE_WINDOW_SECONDS)
+        # Rachas de regalos agrupadas: una donación por racha con el conteo final
+        self.gifts = GiftStreakBuffer(self._send_event, timeout=GIFT_STREAK_TIMEOUT)
+        # Viewer count muestreado: historial con cadencia fija y PATCH como máximo una vez por intervalo
+        self.viewers = ViewerSampler(
+            on_history=lambda count: self.delivery.submit(self._save_viewer_history, count),
+            on_patch=lambda count: self.delivery.submit(self._update_viewer_count, count),
+            history_interval=VIEWER_HISTORY_INTERVAL,
+            patch_interval=VIEWER_PATCH_INTERVAL,
+        )
         self._setup_handlers()
+        self._register_metrics()
+        # Modo --profile: handlers on_* y procesador de la cola perfilados por muestreo
+        profiler.instrument(self)
+
+    def _register_metrics(self):
+        """Valores que se leen de los componentes al hacer scrape de /metrics"""
+        metrics.collector(
+            "bot_queue_pending",
+            "Elementos pendientes en la cola persistente por prioridad",
+            lambda: [({"priority": str(p)}, n) for p, n in sorted(self.event_queue.get_pending_by_priority().items())],
+        )
+        metrics.collector(
+            "bot_queue_failed",
+            "Elementos de la cola persistente que agotaron sus reintentos",
+            lambda: [({}, self.event_queue.get_stats()["failed"])],
+        )
+        metrics.collector(
+            "bot_delivery_buffer_depth",
+            "Eventos en el buffer en memoria entre handlers y workers",
+            lambda: [({}, self.delivery.depth)],
+        )
+        metrics.collector(
+            "bot_batch_buffered",
+            "Eventos en el lote actual pendiente de envío",
+            lambda: [({}, self.batcher.get_stats()["buffered"])],
+        )
+        metrics.collector(
+            "bot_unresolved_events",
+            "Eventos retenidos a la espera de resolver el stream",
+            lambda: [({}, len(self._unresolved))],
+        )
+        metrics.collector(
+            "bot_open_aggregations",
+            "Ventanas de likes y rachas de regalos abiertas",
+            lambda: [
+                ({"kind": "likes"}, self.likes.get_stats()["open_windows"]),
+                ({"kind": "gift_streaks"}, self.gifts.get_stats()["open_streaks"]),
+            ],
+        )
+        metrics.collector(
+            "bot_profile_cache_entries",
+            "Perfiles de usuario en la caché de perfiles enviados",
+            lambda: [({}, self.profiles.get_stats()["entries"])],
+        )
 
     def _get_stream_day(self, dt) -> str:
         """
@@ -70,338 +202,165 @@ class TikTokStreamClient:
 
     def _setup_handlers(self):
         """Configura los handlers de eventos usando decoradores"""
-        print(f"🔧 Configurando handlers de eventos...")
+        log.info(f"🔧 Configurando handlers de eventos...")
         
         # Usar decoradores como en el bot antiguo
         @self.client.on(ConnectEvent)
         async def on_connect_handler(event: ConnectEvent):
-            print(f"🔔 [DEBUG] ConnectEvent recibido!")
+            log.debug("🔔 ConnectEvent recibido")
             await self.on_connect(event)
         
         @self.client.on(DisconnectEvent)
         async def on_disconnect_handler(event: DisconnectEvent):
-            print(f"🔔 [DEBUG] DisconnectEvent recibido!")
+            log.debug("🔔 DisconnectEvent recibido")
             await self.on_disconnect(event)
         
         @self.client.on(CommentEvent)
         async def on_comment_handler(event: CommentEvent):
+            EVENTS_RECEIVED.inc("comment")
             await self.on_comment(event)
         
         @self.client.on(GiftEvent)
         async def on_gift_handler(event: GiftEvent):
+            EVENTS_RECEIVED.inc("gift")
             await self.on_gift(event)
         
         @self.client.on(FollowEvent)
         async def on_follow_handler(event: FollowEvent):
+            EVENTS_RECEIVED.inc("follow")
             await self.on_follow(event)
         
         @self.client.on(JoinEvent)
         async def on_join_handler(event: JoinEvent):
+            EVENTS_RECEIVED.inc("join")
             await self.on_join(event)
         
         @self.client.on(ShareEvent)
         async def on_share_handler(event: ShareEvent):
+            EVENTS_RECEIVED.inc("share")
             await self.on_share(event)
         
         @self.client.on(LikeEvent)
         async def on_like_handler(event: LikeEvent):
+            EVENTS_RECEIVED.inc("like")
             await self.on_like(event)
         
-        print(f"✅ Handlers configurados (ConnectEvent, DisconnectEvent, CommentEvent, GiftEvent, FollowEvent, JoinEvent, ShareEvent, LikeEvent)")
+        log.info(f"✅ Handlers configurados (ConnectEvent, DisconnectEvent, CommentEvent, GiftEvent, FollowEvent, JoinEvent, ShareEvent, LikeEvent)")
         # Viewers se capturan desde JoinEvent
 
     async def on_connect(self, event: ConnectEvent):
         """Se ejecuta cuando se conecta al stream"""
-        print(f"✅ [EVENTO] Conectado al stream de @{self.username}")
-        
-        # Registrar streamer si no existe
-        await self._register_streamer()
+        log.info(f"✅ [EVENTO] Conectado al stream de @{self.username}")
+        CONNECTS.inc()
+        self.connected = True
+        self._startup["ConnectEvent"] = time.monotonic() - self._connect_started
         
-        # Crear nuevo stream
-        await self._create_stream()
+        # Registrar streamer (si no hay streamer_id guardado) y crear o retomar el stream;
+        # si los eventos ya dispararon la resolución, se espera esa misma
+        resolve_started = time.monotonic()
+        await self._ensure_stream()
+        self._startup["stream"] = time.monotonic() - resolve_started
+        self._ready.set()
 
     async def on_disconnect(self, event: DisconnectEvent):
         """Se ejecuta cuando se desconecta del stream"""
-        print(f"❌ Desconectado del stream de @{self.username}")
+        log.error(f"❌ Desconectado del stream de @{self.username}")
+        DISCONNECTS.inc()
+        self.connected = False
+        
+        if self.stream_id and not is_provisional(self.stream_id):
+            # Visto activo ahora: una reconexión pronta lo reanuda sin consultar la API
+            self.session.update(self.username)
         
         # NO finalizar el stream automáticamente
         # El stream permanece activo hasta que se confirme que realmente terminó
         # (por ejemplo, cuando se detecta "not live" al intentar reconectar)
-        print(f"💡 Stream {self.stream_id} permanece activo. Se finalizará cuando se confirme que terminó.")
+        log.info(f"💡 Stream {self.stream_id} permanece activo. Se finalizará cuando se confirme que terminó.")
 
     def _extract_user_info(self, event):
         """Extrae información completa del usuario desde cualquier evento"""
-        user_info = {}
         try:
-            # Intentar obtener de user_info (estructura completa)
-            if hasattr(event, 'user_info') and event.user_info:
-                ui = event.user_info
-                
-                # Información básica
-                if hasattr(ui, 'id'):
-                    user_info['user_id'] = ui.id
-                if hasattr(ui, 'nick_name'):
-                    user_info['nickname'] = ui.nick_name
-                if hasattr(ui, 'username'):
-                    user_info['username'] = ui.username
-                if hasattr(ui, 'sec_uid'):
-                    user_info['sec_uid'] = ui.sec_uid
-                
-                # Avatar (foto de perfil)
-                if hasattr(ui, 'avatar_thumb') and ui.avatar_thumb:
-                    if hasattr(ui.avatar_thumb, 'm_urls') and ui.avatar_thumb.m_urls:
-                        user_info['profile_image_url'] = ui.avatar_thumb.m_urls[0]
-                    elif hasattr(ui.avatar_thumb, 'uri'):
-                        user_info['profile_image_url'] = ui.avatar_thumb.uri
-                
-                # Información de seguimiento
-                if hasattr(ui, 'follow_info') and ui.follow_info:
-                    if hasattr(ui.follow_info, 'follower_count'):
-                        user_info['follower_count'] = ui.follow_info.follower_count
-                    if hasattr(ui.follow_info, 'following_count'):
-                        user_info['following_count'] = ui.follow_info.following_count
-                
-                # Identidad del usuario (si sigue al streamer)
-                if hasattr(event, 'user_identity') and event.user_identity:
-                    ui_identity = event.user_identity
-                    if hasattr(ui_identity, 'is_follower_of_anchor'):
-                        user_info['is_following_streamer'] = ui_identity.is_follower_of_anchor
-            
-            # Fallback: intentar obtener de user (estructura simple)
-            elif hasattr(event, 'user') and event.user:
-                user = event.user
-                
-                # Información básica
-                if hasattr(user, 'unique_id'):
-                    user_info['username'] = user.unique_id
-                if hasattr(user, 'nickname') or hasattr(user, 'nick_name'):
-                    user_info['nickname'] = getattr(user, 'nickname', None) or getattr(user, 'nick_name', None)
-                if hasattr(user, 'username'):
-                    user_info['username'] = user.username
-                
-                # Avatar (foto de perfil) - intentar múltiples formas
-                if hasattr(user, 'avatar_thumb') and user.avatar_thumb:
-                    if hasattr(user.avatar_thumb, 'm_urls') and user.avatar_thumb.m_urls:
-                        user_info['profile_image_url'] = user.avatar_thumb.m_urls[0]
-                    elif hasattr(user.avatar_thumb, 'uri'):
-                        user_info['profile_image_url'] = user.avatar_thumb.uri
-                elif hasattr(user, 'avatar_large') and user.avatar_large:
-                    if hasattr(user.avatar_large, 'm_urls') and user.avatar_large.m_urls:
-                        user_info['profile_image_url'] = user.avatar_large.m_urls[0]
-                elif hasattr(user, 'avatar_url') and user.avatar_url:
-                    if hasattr(user.avatar_url, 'url'):
-                        user_info['profile_image_url'] = user.avatar_url.url
-                    elif isinstance(user.avatar_url, str):
-                        user_info['profile_image_url'] = user.avatar_url
-                elif hasattr(user, 'profile_picture_url'):
-                    user_info['profile_image_url'] = user.profile_picture_url
-                
-                # Información de seguimiento
-                if hasattr(user, 'follow_info') and user.follow_info:
-                    if hasattr(user.follow_info, 'follower_count'):
-                        user_info['follower_count'] = user.follow_info.follower_count
-                    if hasattr(user.follow_info, 'following_count'):
-                        user_info['following_count'] = user.follow_info.following_count
-                
-                # Intentar obtener directamente del user
-                if 'follower_count' not in user_info and hasattr(user, 'follower_count'):
-                    user_info['follower_count'] = user.follower_count
-                if 'following_count' not in user_info and hasattr(user, 'following_count'):
-                    user_info['following_count'] = user.following_count
-                
-                # Relación con el streamer
-                if hasattr(user, 'is_following'):
-                    user_info['is_following_streamer'] = user.is_following
-                if hasattr(user, 'is_follower'):
-                    user_info['is_following_streamer'] = user.is_follower
-                    
+            # Accessor compilado una vez por clase de evento/usuario
+            return extractors.user_info(event)
         except Exception as e:
-            print(f"⚠️ Error extrayendo info del usuario: {e}")
-        
-        return user_info
+            log.warning(f"⚠️ Error extrayendo info del usuario: {e}")
+            return {}
+
+    def _build_user(self, event, is_following_default=None) -> UserRecord:
+        """Normaliza el usuario del evento (campos de user_data en la API)"""
+        extracted_info = self._extract_user_info(event)
+        user = getattr(event, "user", None)
+        return UserRecord(
+            username=extracted_info.get('username') or getattr(user, 'unique_id', None) or getattr(user, 'nickname', None) or "unknown",
+            display_name=extracted_info.get('nickname') or getattr(user, 'nickname', None),
+            profile_image_url=extracted_info.get('profile_image_url'),
+            follower_count=extracted_info.get('follower_count'),
+            following_count=extracted_info.get('following_count'),
+            is_following_streamer=extracted_info.get('is_following_streamer', is_following_default),
+        )
 
     async def on_comment(self, event: CommentEvent):
         """Maneja comentarios del chat"""
+        received_at = time.monotonic()
         try:
-            # Extraer información completa del usuario
-            extracted_info = self._extract_user_info(event)
-            
-            user_data = {
-                "username": extracted_info.get('username') or getattr(event.user, 'unique_id', None) or getattr(event.user, 'nickname', None) or "unknown",
-                "display_name": extracted_info.get('nickname') or getattr(event.user, 'nickname', None),
-                "profile_image_url": extracted_info.get('profile_image_url'),
-                "follower_count": extracted_info.get('follower_count'),
-                "following_count": extracted_info.get('following_count'),
-                "is_following_streamer": extracted_info.get('is_following_streamer'),
-            }
-
-            event_data = {
-                "content": event.comment,
-                "metadata": {
-                    # comment_id no está disponible en CommentEvent de TikTokLive 6.x
-                },
-            }
+            user = self._build_user(event)
+            # comment_id no está disponible en CommentEvent de TikTokLive 6.x
+            record = EventRecord(EventType.COMMENT, user, event.comment, received_at=received_at)
 
-            print(f"💬 [COMENTARIO] {user_data['display_name'] or user_data['username']}: {event.comment[:50]}")
-            await self._send_event("comment", user_data, event_data)
+            log.info("💬 [COMENTARIO] %s: %.50s", user.label, event.comment, extra={"kind": "event.comment"})
+            await self._send_event(record)
         except Exception as e:
-            print(f"❌ Error procesando comentario: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error procesando comentario: {e}")
 
     async def on_gift(self, event: GiftEvent):
         """Maneja regalos/donaciones"""
         try:
-            # Extraer información completa del usuario
-            extracted_info = self._extract_user_info(event)
-            
-            user_data = {
-                "username": extracted_info.get('username') or getattr(event.user, 'unique_id', None) or getattr(event.user, 'nickname', None) or "unknown",
-                "display_name": extracted_info.get('nickname') or getattr(event.user, 'nickname', None),
-                "profile_image_url": extracted_info.get('profile_image_url'),
-                "follower_count": extracted_info.get('follower_count'),
-                "following_count": extracted_info.get('following_count'),
-                "is_following_streamer": extracted_info.get('is_following_streamer'),
-            }
+            user = self._build_user(event)
 
-            # Extraer imagen del regalo (mejorado para capturar más casos)
+            # Imagen y coins por unidad con accessors compilados por clase de regalo
+            # (el total de coins se calcula al cerrar la racha con el conteo final)
             gift_image_url = None
-            try:
-                gift = event.gift
-                
-                # Intentar múltiples ubicaciones donde TikTok puede almacenar la imagen
-                if hasattr(gift, 'image') and gift.image:
-                    if hasattr(gift.image, 'm_urls') and gift.image.m_urls:
-                        gift_image_url = gift.image.m_urls[0]
-                    elif hasattr(gift.image, 'uri'):
-                        gift_image_url = gift.image.uri
-                    elif hasattr(gift.image, 'url'):
-                        gift_image_url = gift.image.url
-                    elif isinstance(gift.image, str):
-                        gift_image_url = gift.image
-                
-                # Intentar otras propiedades directas
-                if not gift_image_url:
-                    if hasattr(gift, 'image_url'):
-                        gift_image_url = gift.image_url
-                    elif hasattr(gift, 'gift_picture_url'):
-                        gift_image_url = gift.gift_picture_url
-                    elif hasattr(gift, 'picture_url'):
-                        gift_image_url = gift.picture_url
-                    elif hasattr(gift, 'icon_url'):
-                        gift_image_url = gift.icon_url
-                
-                # Intentar desde gift_info si existe
-                if not gift_image_url and hasattr(gift, 'gift_info'):
-                    gift_info = gift.gift_info
-                    if hasattr(gift_info, 'image') and gift_info.image:
-                        if hasattr(gift_info.image, 'm_urls') and gift_info.image.m_urls:
-                            gift_image_url = gift_info.image.m_urls[0]
-                        elif hasattr(gift_info.image, 'uri'):
-                            gift_image_url = gift_info.image.uri
-                    elif hasattr(gift_info, 'image_url'):
-                        gift_image_url = gift_info.image_url
-                
-                if gift_image_url:
-                    print(f"🖼️ [DEBUG] Imagen del regalo capturada: {gift_image_url}")
-                else:
-                    print(f"⚠️ [DEBUG] No se pudo encontrar imagen para el regalo: {getattr(gift, 'name', 'Unknown')}")
-                    
-            except Exception as e:
-                print(f"⚠️ Error extrayendo imagen del regalo: {e}")
-                import traceback
-                traceback.print_exc()
-
-            # Intentar extraer TikTok coins/diamonds del regalo
             tiktok_coins = None
             try:
-                gift = event.gift
-                # Intentar múltiples ubicaciones donde TikTok puede almacenar los coins
-                if hasattr(gift, 'diamond_count') and gift.diamond_count is not None:
-                    tiktok_coins = int(gift.diamond_count) * getattr(gift, "count", 1)
-                elif hasattr(gift, 'coins') and gift.coins is not None:
-                    tiktok_coins = int(gift.coins) * getattr(gift, "count", 1)
-                elif hasattr(gift, 'diamonds') and gift.diamonds is not None:
-                    tiktok_coins = int(gift.diamonds) * getattr(gift, "count", 1)
-                elif hasattr(gift, 'amount') and gift.amount is not None:
-                    tiktok_coins = int(gift.amount) * getattr(gift, "count", 1)
-                elif hasattr(gift, 'gift_info'):
-                    gift_info = gift.gift_info
-                    if hasattr(gift_info, 'diamond_count') and gift_info.diamond_count is not None:
-                        tiktok_coins = int(gift_info.diamond_count) * getattr(gift, "count", 1)
-                    elif hasattr(gift_info, 'coins') and gift_info.coins is not None:
-                        tiktok_coins = int(gift_info.coins) * getattr(gift, "count", 1)
-                    elif hasattr(gift_info, 'diamonds') and gift_info.diamonds is not None:
-                        tiktok_coins = int(gift_info.diamonds) * getattr(gift, "count", 1)
-                    elif hasattr(gift_info, 'amount') and gift_info.amount is not None:
-                        tiktok_coins = int(gift_info.amount) * getattr(gift, "count", 1)
-                
-                if tiktok_coins:
-                    print(f"💰 [DEBUG] TikTok Coins capturados: {tiktok_coins}")
-                else:
-                    print(f"⚠️ [DEBUG] No se pudo encontrar TikTok Coins para el regalo: {getattr(gift, 'name', 'Unknown')}")
-                    # Debug: mostrar atributos disponibles del gift
-                    if hasattr(gift, '__dict__'):
-                        print(f"🔍 [DEBUG] Atributos disponibles en gift: {list(gift.__dict__.keys())}")
+                gift_image_url = extractors.gift_image_url(event.gift)
+                tiktok_coins = extractors.gift_coins(event.gift)
             except Exception as e:
-                print(f"⚠️ Error extrayendo TikTok Coins: {e}")
-                import traceback
-                traceback.print_exc()
+                log.warning(f"⚠️ Error extrayendo imagen/coins del regalo: {e}")
 
-            donation_data = {
+            gift_info = {
+                "gift_id": str(getattr(event.gift, "id", None)) if hasattr(event.gift, "id") else None,
                 "gift_type": getattr(event.gift, "gift_type", "unknown"),
                 "gift_name": getattr(event.gift, "name", "Unknown Gift"),
-                "gift_count": getattr(event.gift, "count", 1),
-                "gift_value": None,  # TikTok no siempre proporciona el valor en USD
-                "tiktok_coins": tiktok_coins,  # Coins de TikTok
                 "gift_image_url": gift_image_url,  # URL de la imagen del regalo
-                "message": None,
-            }
-
-            event_data = {
-                "content": f"Regalo: {donation_data['gift_name']} x{donation_data['gift_count']}",
-                "metadata": {
-                    "gift_id": str(getattr(event.gift, "id", None)) if hasattr(event.gift, "id") else None,
-                },
-                "donation": donation_data,
+                "unit_coins": tiktok_coins,  # Coins de TikTok por unidad
             }
+            repeat_count = getattr(event, "repeat_count", None) or 1
+            streaking = bool(getattr(event, "streaking", False))
 
-            print(f"🎁 [REGALO] {user_data['display_name'] or user_data['username']}: {donation_data['gift_name']} x{donation_data['gift_count']}")
-            await self._send_event("donation", user_data, event_data)
+            if streaking:
+                log.debug("🎁 [RACHA] %s: %s x%d...", user.label, gift_info["gift_name"], repeat_count, extra={"kind": "event.gift_streak"})
+            else:
+                log.info("🎁 [REGALO] %s: %s x%d", user.label, gift_info["gift_name"], repeat_count, extra={"kind": "event.gift"})
+            # Una sola donación por racha: se emite al terminar o expirar
+            await self.gifts.add(user, gift_info, repeat_count, streaking)
         except Exception as e:
-            print(f"❌ Error procesando regalo: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error procesando regalo: {e}")
 
     async def on_follow(self, event: FollowEvent):
         """Maneja nuevos seguidores"""
+        received_at = time.monotonic()
         try:
-            # Extraer información completa del usuario
-            extracted_info = self._extract_user_info(event)
-            
-            user_data = {
-                "username": extracted_info.get('username') or getattr(event.user, 'unique_id', None) or getattr(event.user, 'nickname', None) or "unknown",
-                "display_name": extracted_info.get('nickname') or getattr(event.user, 'nickname', None),
-                "profile_image_url": extracted_info.get('profile_image_url'),
-                "follower_count": extracted_info.get('follower_count'),
-                "following_count": extracted_info.get('following_count'),
-                "is_following_streamer": extracted_info.get('is_following_streamer', True),  # Default True para follows
-            }
-
-            event_data = {
-                "content": f"{user_data['display_name'] or user_data['username']} comenzó a seguir",
-                "metadata": {},
-            }
+            user = self._build_user(event, is_following_default=True)  # Default True para follows
+            record = EventRecord(EventType.FOLLOW, user, f"{user.label} comenzó a seguir", received_at=received_at)
 
-            print(f"👥 [FOLLOW] {user_data['display_name'] or user_data['username']} comenzó a seguir")
-            await self._send_event("follow", user_data, event_data)
+            log.info("👥 [FOLLOW] %s comenzó a seguir", user.label, extra={"kind": "event.follow"})
+            await self._send_event(record)
         except Exception as e:
-            print(f"❌ Error procesando follow: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error procesando follow: {e}")
 
     async def on_join(self, event: JoinEvent):
         """Captura viewers y información del usuario que se une"""
+        received_at = time.monotonic()
         try:
             viewer_count = None
             
@@ -409,64 +368,54 @@ class TikTokStreamClient:
             if hasattr(event, 'count') and event.count is not None:
                 viewer_count = event.count
                 
-                # Solo actualizar si hay un stream activo
+                # Solo con un stream activo (es un muestreo: el siguiente JoinEvent trae el valor actual)
                 if self.stream_id:
-                    # Actualizar viewer_count en el stream
-                    await self._update_viewer_count(viewer_count)
+                    # Solo se registra en memoria: el sampler guarda el historial cada
+                    # VIEWER_HISTORY_INTERVAL segundos (o antes si cambia >10%) y
+                    # actualiza el stream como máximo una vez por VIEWER_PATCH_INTERVAL
+                    await self.viewers.record(viewer_count)
                     
-                    # Guardar en historial (solo si cambió significativamente para no saturar la BD)
-                    # Guardamos cada cambio o al menos cada 10 segundos
-                    await self._save_viewer_history(viewer_count)
-                    
-                    print(f"👥 [VIEWERS] {viewer_count} espectadores")
+                    log.debug("👥 [VIEWERS] %d espectadores", viewer_count, extra={"kind": "event.viewers"})
             
-            # Capturar información del usuario que se une
-            if self.stream_id:
-                # Extraer información completa del usuario
-                extracted_info = self._extract_user_info(event)
-                
-                user_data = {
-                    "username": extracted_info.get('username') or getattr(event.user, 'unique_id', None) or getattr(event.user, 'nickname', None) or "unknown",
-                    "display_name": extracted_info.get('nickname') or getattr(event.user, 'nickname', None),
-                    "profile_image_url": extracted_info.get('profile_image_url'),
-                    "follower_count": extracted_info.get('follower_count'),
-                    "following_count": extracted_info.get('following_count'),
-                    "is_following_streamer": extracted_info.get('is_following_streamer'),
-                }
-
-                event_data = {
-                    "content": f"{user_data['display_name'] or user_data['username']} se unió al stream",
-                    "metadata": {
-                        "viewer_count": viewer_count,
-                    },
-                }
+            # Capturar información del usuario que se une; sin stream todavía, el join
+            # espera su resolución en el mismo buffer que los demás eventos
+            user = self._build_user(event)
+            record = EventRecord(
+                EventType.JOIN,
+                user,
+                f"{user.label} se unió al stream",
+                {"viewer_count": viewer_count},
+                received_at=received_at,
+            )
 
-                print(f"👋 [JOIN] {user_data['display_name'] or user_data['username']} se unió")
-                await self._send_event("join", user_data, event_data)
+            log.info("👋 [JOIN] %s se unió", user.label, extra={"kind": "event.join"})
+            await self._send_event(record)
         except Exception as e:
-            print(f"⚠️ Error procesando join: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"⚠️ Error procesando join: {e}")
 
     async def _update_viewer_count(self, viewer_count: int):
         """Actualiza el viewer_count en el stream"""
+        if is_provisional(self.stream_id):
+            # Stream aún no creado en la API: va a la cola detrás de su stream_create
+            self.event_queue.add_event("viewer_count", {"stream_id": self.stream_id, "viewer_count": viewer_count}, priority=2)
+            return
         try:
-            response = requests.patch(
-                f"{self.api_url}/streams/{self.stream_id}",
+            status, _ = await self.api.request(
+                "PATCH",
+                f"/streams/{self.stream_id}",
                 json={"viewer_count": viewer_count},
-                timeout=5
             )
-            if response.status_code == 200:
+            if status == 200:
                 return
             else:
-                print(f"⚠️ Error actualizando viewer_count: {response.status_code}")
+                log.warning(f"⚠️ Error actualizando viewer_count: {status}")
                 # Agregar a cola para reintentar
                 self.event_queue.add_event(
                     "viewer_count",
                     {"stream_id": self.stream_id, "viewer_count": viewer_count},
                     priority=2  # Alta prioridad para viewers
                 )
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        except UNAVAILABLE_ERRORS:
             # API no disponible, agregar a cola
             self.event_queue.add_event(
                 "viewer_count",
@@ -483,26 +432,29 @@ class TikTokStreamClient:
 
     async def _save_viewer_history(self, viewer_count: int):
         """Guarda el viewer_count en el historial"""
+        if is_provisional(self.stream_id):
+            self.event_queue.add_event("viewer_history", {"stream_id": self.stream_id, "viewer_count": viewer_count}, priority=1)
+            return
         try:
-            response = requests.post(
-                f"{self.api_url}/viewer-history",
+            status, _ = await self.api.request(
+                "POST",
+                "/viewer-history",
                 json={
                     "stream_id": self.stream_id,
                     "viewer_count": viewer_count
                 },
-                timeout=5
             )
-            if response.status_code == 200:
+            if status == 200:
                 return
             else:
-                print(f"⚠️ Error guardando historial de viewers: {response.status_code}")
+                log.warning(f"⚠️ Error guardando historial de viewers: {status}")
                 # Agregar a cola para reintentar
                 self.event_queue.add_event(
                     "viewer_history",
                     {"stream_id": self.stream_id, "viewer_count": viewer_count},
                     priority=1
                 )
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        except UNAVAILABLE_ERRORS:
             # API no disponible, agregar a cola
             self.event_queue.add_event(
                 "viewer_history",
@@ -519,18 +471,9 @@ class TikTokStreamClient:
 
     async def on_share(self, event: ShareEvent):
         """Maneja compartidos del stream"""
+        received_at = time.monotonic()
         try:
-            # Extraer información completa del usuario
-            extracted_info = self._extract_user_info(event)
-            
-            user_data = {
-                "username": extracted_info.get('username') or getattr(event.user, 'unique_id', None) or getattr(event.user, 'nickname', None) or "unknown",
-                "display_name": extracted_info.get('nickname') or getattr(event.user, 'nickname', None),
-                "profile_image_url": extracted_info.get('profile_image_url'),
-                "follower_count": extracted_info.get('follower_count'),
-                "following_count": extracted_info.get('following_count'),
-                "is_following_streamer": extracted_info.get('is_following_streamer'),
-            }
+            user = self._build_user(event)
 
             # Obtener tipo de compartido
             share_type = None
@@ -543,60 +486,43 @@ class TikTokStreamClient:
                     share_type = event.share_type
                     share_text = f"Compartido ({share_type})"
             except Exception as e:
-                print(f"⚠️ Error obteniendo tipo de share: {e}")
+                log.warning(f"⚠️ Error obteniendo tipo de share: {e}")
 
-            event_data = {
-                "content": share_text,
-                "metadata": {
-                    "share_type": str(share_type) if share_type else None,
-                },
-            }
+            record = EventRecord(
+                EventType.SHARE,
+                user,
+                share_text,
+                {"share_type": str(share_type) if share_type else None},
+                received_at=received_at,
+            )
 
-            print(f"📤 [SHARE] {user_data['display_name'] or user_data['username']}: {share_text}")
-            await self._send_event("share", user_data, event_data)
+            log.info("📤 [SHARE] %s: %s", user.label, share_text, extra={"kind": "event.share"})
+            await self._send_event(record)
         except Exception as e:
-            print(f"❌ Error procesando share: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error procesando share: {e}")
 
     async def on_like(self, event: LikeEvent):
         """Maneja likes/me gustas del stream"""
         try:
-            # Extraer información completa del usuario
-            extracted_info = self._extract_user_info(event)
-            
-            user_data = {
-                "username": extracted_info.get('username') or getattr(event.user, 'unique_id', None) or getattr(event.user, 'nickname', None) or "unknown",
-                "display_name": extracted_info.get('nickname') or getattr(event.user, 'nickname', None),
-                "profile_image_url": extracted_info.get('profile_image_url'),
-                "follower_count": extracted_info.get('follower_count'),
-                "following_count": extracted_info.get('following_count'),
-                "is_following_streamer": extracted_info.get('is_following_streamer'),
-            }
+            user = self._build_user(event)
 
             # Intentar obtener el contador de likes si está disponible
             likes_count = None
+            total_likes = None
             try:
                 if hasattr(event, 'like_count'):
                     likes_count = event.like_count
                 elif hasattr(event, 'count'):
                     likes_count = event.count
+                total_likes = getattr(event, 'total', None)
             except Exception as e:
-                print(f"⚠️ Error extrayendo contador de likes: {e}")
+                log.warning(f"⚠️ Error extrayendo contador de likes: {e}")
 
-            event_data = {
-                "content": "Me gusta",
-                "metadata": {
-                    "like_count": likes_count,
-                },
-            }
-
-            print(f"❤️ [LIKE] {user_data['display_name'] or user_data['username']}" + (f" ({likes_count} likes)" if likes_count else ""))
-            await self._send_event("like", user_data, event_data)
+            log.debug("❤️ [LIKE] %s (%s likes)", user.label, likes_count or 1, extra={"kind": "event.like"})
+            # Se envía un solo evento por usuario y ventana con el like_count sumado
+            await self.likes.add(user, likes_count, total_likes)
         except Exception as e:
-            print(f"❌ Error procesando like: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error procesando like: {e}")
 
     # Nota: viewer_update no está disponible en TikTokLive 6.x
     # Si necesitas actualizar viewer count, puedes hacerlo periódicamente
@@ -605,7 +531,7 @@ class TikTokStreamClient:
     async def _register_streamer(self):
         """Registra o actualiza el streamer en la base de datos"""
         try:
-            print(f"📝 Registrando streamer @{self.username}...")
+            log.info(f"📝 Registrando streamer @{self.username}...")
             # Asegurarse de que no haya valores None/undefined
             payload = {
                 "username": self.username or "",
@@ -614,29 +540,23 @@ class TikTokStreamClient:
             # Remover None values
             payload = {k: v for k, v in payload.items() if v is not None}
             
-            response = requests.post(
-                f"{self.api_url}/streamers",
-                json=payload,
-                timeout=10,
-            )
-            if response.status_code == 200:
-                data = response.json()
+            status, data = await self.api.request("POST", "/streamers", json=payload)
+            if status == 200:
                 self.streamer_id = data.get("id")
-                print(f"✅ Streamer registrado: {self.streamer_id}")
+                self.session.update(self.username, streamer_id=self.streamer_id)
+                log.info(f"✅ Streamer registrado: {self.streamer_id}")
                 return
             else:
-                print(f"⚠️ Error registrando streamer ({response.status_code}): {response.text}")
+                log.warning(f"⚠️ Error registrando streamer ({status}): {data}")
                 # Agregar a cola para reintentar
                 self.event_queue.add_event("streamer", payload, priority=2)
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-            print(f"⚠️ API no disponible, agregando registro de streamer a la cola")
+        except UNAVAILABLE_ERRORS:
+            log.warning(f"⚠️ API no disponible, agregando registro de streamer a la cola")
             self.event_queue.add_event("streamer", payload, priority=2)
             # Intentar obtener streamer_id de la cola si ya existe
             # Por ahora, continuar sin streamer_id
         except Exception as e:
-            print(f"❌ Error registrando streamer: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error registrando streamer: {e}")
             # Agregar a cola como último recurso
             try:
                 payload = {
@@ -654,28 +574,29 @@ class TikTokStreamClient:
                 await self._register_streamer()
 
             if not self.streamer_id:
-                print(f"❌ No se pudo obtener streamer_id, no se puede crear el stream")
+                # El registro quedó en la cola: el stream_create irá detrás y tomará su id
+                log.warning(f"⚠️ Sin streamer_id, se captura con un stream provisional")
+                self._start_provisional_stream({"streamer_username": self.username}, self._current_stream_day())
                 return
 
-            print(f"📹 Buscando stream del mismo día de directo para streamer_id: {self.streamer_id}...")
+            log.info(f"📹 Buscando stream del mismo día de directo para streamer_id: {self.streamer_id}...")
             
             # Obtener el día de directo actual
             from datetime import datetime, timedelta, timezone
             chile_offset = timezone(timedelta(hours=-3))
-            now_chile = datetime.now(chile_offset)
-            current_stream_day = self._get_stream_day(now_chile)
+            current_stream_day = self._current_stream_day()
             
-            print(f"📅 Día de directo actual: {current_stream_day}")
+            log.info(f"📅 Día de directo actual: {current_stream_day}")
+            
+            # Estado local: reanudar sin descargar todos los streams del streamer
+            if await self._resume_session(current_stream_day):
+                return
             
             try:
                 # Buscar streams del mismo streamer
-                response = requests.get(
-                    f"{self.api_url}/streams?streamer_id={self.streamer_id}",
-                    timeout=10,
-                )
+                status, streams = await self.api.request("GET", f"/streams?streamer_id={self.streamer_id}")
                 
-                if response.status_code == 200:
-                    streams = response.json()
+                if status == 200:
                     
                     # Buscar streams del mismo día de directo
                     same_day_streams = []
@@ -699,7 +620,7 @@ class TikTokStreamClient:
                             if stream_day == current_stream_day:
                                 same_day_streams.append(stream)
                         except Exception as e:
-                            print(f"⚠️ Error procesando stream {stream.get('id')}: {e}")
+                            log.warning(f"⚠️ Error procesando stream {stream.get('id')}: {e}")
                             continue
                     
                     if same_day_streams:
@@ -717,33 +638,39 @@ class TikTokStreamClient:
                             
                             # Si tiene parent_stream_id, usar el parent como stream principal
                             if parent_stream_id:
-                                print(f"🔄 Stream activo es una parte, usando stream principal: {parent_stream_id}")
+                                log.info(f"🔄 Stream activo es una parte, usando stream principal: {parent_stream_id}")
                                 stream_id = parent_stream_id
                             
                             # Si el stream tiene ended_at (no debería, pero por si acaso), reabrirlo
                             if active_stream.get("ended_at"):
-                                print(f"🔄 Reabriendo stream activo: {stream_id}")
+                                log.info(f"🔄 Reabriendo stream activo: {stream_id}")
                                 try:
-                                    patch_response = requests.patch(
-                                        f"{self.api_url}/streams/{stream_id}",
+                                    patch_status, _ = await self.api.request(
+                                        "PATCH",
+                                        f"/streams/{stream_id}",
                                         json={"ended_at": None},
-                                        timeout=10,
                                     )
-                                    if patch_response.status_code == 200:
+                                    if patch_status == 200:
                                         self.stream_id = stream_id
-                                        print(f"✅ Stream reabierto: {self.stream_id}")
+                                        self.session.remember_stream(
+                                            self.username, current_stream_day, stream_id, stream_id, active_stream.get("part_number") or 1
+                                        )
+                                        log.info(f"✅ Stream reabierto: {self.stream_id}")
                                         return
                                 except Exception as e:
-                                    print(f"⚠️ Error reabriendo stream: {e}")
+                                    log.warning(f"⚠️ Error reabriendo stream: {e}")
                             else:
                                 # Stream ya está activo, usar ese
                                 self.stream_id = stream_id
-                                print(f"✅ Continuando con stream activo del mismo día: {self.stream_id}")
+                                self.session.remember_stream(
+                                    self.username, current_stream_day, stream_id, stream_id, active_stream.get("part_number") or 1
+                                )
+                                log.info(f"✅ Continuando con stream activo del mismo día: {self.stream_id}")
                                 return
                         else:
                             # No hay stream activo, pero hay streams terminados del mismo día
                             # Crear una nueva parte
-                            print(f"📝 Hay streams terminados del mismo día de directo, creando nueva parte...")
+                            log.info(f"📝 Hay streams terminados del mismo día de directo, creando nueva parte...")
                             
                             # Encontrar el stream principal (el más antiguo sin parent_stream_id)
                             principal_stream = None
@@ -782,59 +709,156 @@ class TikTokStreamClient:
                                 }
                                 
                                 try:
-                                    response = requests.post(
-                                        f"{self.api_url}/streams",
-                                        json=payload,
-                                        timeout=10,
-                                    )
-                                    if response.status_code == 200:
-                                        data = response.json()
+                                    status, data = await self.api.request("POST", "/streams", json=payload)
+                                    if status == 200:
                                         self.stream_id = data.get("id")
-                                        print(f"✅ Nueva parte creada: {self.stream_id} (parte {max_part_number + 1} del stream {principal_id})")
+                                        self.session.remember_stream(
+                                            self.username, current_stream_day, self.stream_id, principal_id, max_part_number + 1
+                                        )
+                                        log.info(f"✅ Nueva parte creada: {self.stream_id} (parte {max_part_number + 1} del stream {principal_id})")
                                         return
                                 except Exception as e:
-                                    print(f"⚠️ Error creando nueva parte: {e}")
+                                    log.warning(f"⚠️ Error creando nueva parte: {e}")
                 
-            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                print(f"⚠️ API no disponible para buscar streams, creando nuevo stream")
+            except UNAVAILABLE_ERRORS:
+                log.warning(f"⚠️ API no disponible para buscar streams, creando nuevo stream")
             except Exception as e:
-                print(f"⚠️ Error buscando streams: {e}")
-                import traceback
-                traceback.print_exc()
+                log.exception(f"⚠️ Error buscando streams: {e}")
 
             # Si no se encontró stream reciente o hubo error, crear uno nuevo
-            print(f"📹 Creando nuevo stream para streamer_id: {self.streamer_id}...")
-            payload = {
-                "streamer_id": self.streamer_id,
-            }
+            log.info(f"📹 Creando nuevo stream para streamer_id: {self.streamer_id}...")
+            for attempt in range(2):
+                payload = {
+                    "streamer_id": self.streamer_id,
+                }
+                
+                try:
+                    status, data = await self.api.request("POST", "/streams", json=payload)
+                    if status == 200:
+                        self.stream_id = data.get("id")
+                        self.session.remember_stream(self.username, current_stream_day, self.stream_id, self.stream_id, 1)
+                        log.info(f"✅ Stream creado: {self.stream_id}")
+                        return
+                    log.warning(f"⚠️ Error creando stream ({status}): {data}")
+                    # Rechazo con el streamer_id guardado (4xx, o 500 por la FK si la BD se reinició):
+                    # registrar el streamer otra vez y reintentar una vez
+                    if (
+                        classify_response(status, data) == REJECTED
+                        and attempt == 0
+                        and await self._reregister_streamer(f"POST /streams respondió {status}")
+                    ):
+                        continue
+                except UNAVAILABLE_ERRORS:
+                    log.warning(f"⚠️ API no disponible, agregando creación de stream a la cola")
+                except Exception as e:
+                    log.error(f"❌ Error creando stream: {e}")
+                break
             
-            try:
-                response = requests.post(
-                    f"{self.api_url}/streams",
-                    json=payload,
-                    timeout=10,
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    self.stream_id = data.get("id")
-                    print(f"✅ Stream creado: {self.stream_id}")
-                    return
-                else:
-                    print(f"⚠️ Error creando stream ({response.status_code}): {response.text}")
-                    # Agregar a cola para reintentar
-                    self.event_queue.add_event("stream_create", payload, priority=2)
-            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                print(f"⚠️ API no disponible, agregando creación de stream a la cola")
-                self.event_queue.add_event("stream_create", payload, priority=2)
-                # Nota: stream_id será None hasta que se procese la cola
-            except Exception as e:
-                print(f"❌ Error creando stream: {e}")
-                # Agregar a cola para reintentar
-                self.event_queue.add_event("stream_create", payload, priority=2)
+            # Agregar a cola para reintentar (sin streamer_id, la cola registra antes el streamer;
+            # con streamer_username la cola puede registrarlo de nuevo si la API rechaza el id)
+            payload = {"streamer_id": self.streamer_id} if self.streamer_id else {}
+            self._start_provisional_stream({**payload, "streamer_username": self.username}, current_stream_day)
         except Exception as e:
-            print(f"❌ Error en _create_stream: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error en _create_stream: {e}")
+
+    async def _reregister_streamer(self, reason: str) -> bool:
+        """
+        El streamer_id guardado ya no es válido (BD reiniciada o restaurada): se olvida junto
+        con el stream guardado y se registra el streamer de nuevo. Retorna si hay streamer_id
+        """
+        log.warning(f"⚠️ streamer_id {self.streamer_id} no válido ({reason}), registrando el streamer de nuevo")
+        self.streamer_id = None
+        self.session.forget_stream(self.username, streamer=True)
+        await self._register_streamer()
+        return bool(self.streamer_id)
+
+    def _current_stream_day(self) -> str:
+        from datetime import datetime, timezone
+        return self._get_stream_day(datetime.now(timezone.utc))
+
+    def _start_provisional_stream(self, payload: dict, stream_day: str):
+        """
+        Sigue capturando con un id de stream local mientras la API no responde: el
+        stream_create se encola con ese id y los eventos se encolan contra él; al drenar
+        la cola se crea el stream y los eventos se envían con el id del servidor
+        """
+        provisional_id = new_provisional_id()
+        self.event_queue.add_event("stream_create", {**payload, "provisional_id": provisional_id}, priority=2)
+        self.stream_id = provisional_id
+        self._provisional_day = stream_day
+        log.info(f"🕓 Stream provisional {provisional_id}: los eventos se encolan hasta que la API lo cree")
+
+    def _on_queue_resolved(self, kind: str, key: str, server_id: str):
+        """La cola creó un streamer o un stream provisional: pasar a usar su id del servidor"""
+        if kind == "streamer" and key == self.username:
+            # También si la cola registró de nuevo un streamer_id rechazado
+            self.streamer_id = server_id
+            self.session.update(self.username, streamer_id=server_id)
+        elif kind == "stream" and key == self.stream_id:
+            self.stream_id = server_id
+            self.session.remember_stream(
+                self.username, self._provisional_day or self._current_stream_day(), server_id, server_id, 1
+            )
+            log.info(f"✅ Stream provisional {key} reemplazado por {server_id}")
+
+    async def _resume_session(self, current_stream_day: str) -> bool:
+        """
+        Retoma el stream guardado en el estado de sesión si es del día de directo actual.
+        Visto activo hace menos de SESSION_TRUST_SECONDS: sin llamadas a la API; si no, se
+        valida con GET /streams/{id}. Si ya terminó se crea la siguiente parte directamente
+        """
+        saved = self.session.get(self.username)
+        stream_id = saved.get("stream_id")
+        if not stream_id or saved.get("streamer_id") != self.streamer_id or saved.get("stream_day") != current_stream_day:
+            return False
+
+        ended = bool(saved.get("ended"))
+        if not ended:
+            if time.time() - saved.get("last_seen", 0) <= SESSION_TRUST_SECONDS:
+                self.stream_id = stream_id
+                log.info(f"⚡ Reanudando stream {stream_id} (estado local, sin consultar la API)")
+                return True
+            try:
+                status, stream = await self.api.request("GET", f"/streams/{stream_id}")
+            except UNAVAILABLE_ERRORS:
+                # Sin API no se puede validar: se sigue con el guardado y los eventos van a la cola
+                self.stream_id = stream_id
+                log.info(f"⚡ API no disponible, reanudando stream guardado {stream_id}")
+                return True
+            if status >= 500:
+                self.stream_id = stream_id
+                log.info(f"⚡ API con error ({status}), reanudando stream guardado {stream_id}")
+                return True
+            if status != 200:
+                # El stream guardado no existe: probablemente tampoco el streamer (BD reiniciada)
+                log.info(f"💡 Stream guardado {stream_id} no válido ({status}), buscando en la API")
+                await self._reregister_streamer(f"GET /streams/{stream_id} respondió {status}")
+                return False
+            if not stream.get("ended_at"):
+                self.stream_id = stream_id
+                self.session.update(self.username)
+                log.info(f"✅ Continuando con stream guardado del mismo día: {stream_id}")
+                return True
+
+        # Terminó: nueva parte del stream principal guardado
+        principal_id = saved.get("principal_id") or stream_id
+        part_number = (saved.get("part_number") or 1) + 1
+        try:
+            status, data = await self.api.request(
+                "POST",
+                "/streams",
+                json={"streamer_id": self.streamer_id, "parent_stream_id": principal_id, "part_number": part_number},
+            )
+        except UNAVAILABLE_ERRORS:
+            return False
+        if status != 200:
+            if classify_response(status, data) == REJECTED:
+                await self._reregister_streamer(f"POST /streams (parte) respondió {status}")
+            return False
+        self.stream_id = data.get("id")
+        self.session.remember_stream(self.username, current_stream_day, self.stream_id, principal_id, part_number)
+        log.info(f"✅ Nueva parte creada: {self.stream_id} (parte {part_number} del stream {principal_id})")
+        return True
 
     async def _end_stream(self):
         """Finaliza el stream actual"""
@@ -846,168 +870,300 @@ class TikTokStreamClient:
                     "id": self.stream_id,
                     "ended_at": datetime.utcnow().isoformat() + "Z",
                 }
+                if is_provisional(self.stream_id):
+                    # Se finaliza al drenar la cola, después de crearse (la sesión no lo conoce aún)
+                    self.event_queue.add_event("stream_update", payload, priority=2)
+                    return
+                # Terminado (ahora o al drenar la cola): la próxima conexión del día crea una parte
+                self.session.update(self.username, ended=True)
                 
                 try:
-                    response = requests.patch(
-                        f"{self.api_url}/streams/{self.stream_id}",
+                    status, _ = await self.api.request(
+                        "PATCH",
+                        f"/streams/{self.stream_id}",
                         json={"ended_at": payload["ended_at"]},
-                        timeout=10,
                     )
-                    if response.status_code == 200:
-                        print(f"✅ Stream finalizado: {self.stream_id}")
+                    if status == 200:
+                        log.info(f"✅ Stream finalizado: {self.stream_id}")
                         return
                     else:
-                        print(f"⚠️ Error finalizando stream ({response.status_code})")
+                        log.warning(f"⚠️ Error finalizando stream ({status})")
                         # Agregar a cola para reintentar
                         self.event_queue.add_event("stream_update", payload, priority=2)
-                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                    print(f"⚠️ API no disponible, agregando finalización de stream a la cola")
+                except UNAVAILABLE_ERRORS:
+                    log.warning(f"⚠️ API no disponible, agregando finalización de stream a la cola")
                     self.event_queue.add_event("stream_update", payload, priority=2)
                 except Exception as e:
-                    print(f"⚠️ Error finalizando stream: {e}")
+                    log.warning(f"⚠️ Error finalizando stream: {e}")
                     # Agregar a cola para reintentar
                     self.event_queue.add_event("stream_update", payload, priority=2)
         except Exception as e:
-            print(f"Error en _end_stream: {e}")
+            log.info(f"Error en _end_stream: {e}")
+        finally:
+            # El cliente sigue vivo entre reconexiones: la próxima conexión resuelve un stream nuevo
+            self.stream_id = None
 
-    async def _send_event(
-        self, event_type: str, user_data: dict, event_data: dict
-    ):
-        """Envía un evento a la API o lo agrega a la cola si falla"""
+    def _session_heartbeat(self):
+        """Marca el stream como visto activo (reanudación sin API tras una caída del proceso)"""
+        if self.stream_id and not is_provisional(self.stream_id):
+            self.session.update(self.username)
+
+    async def _send_event(self, record: EventRecord):
+        """Deja el evento en el buffer de entrega; un worker lo enviará a la API"""
+        await self.delivery.submit(self._deliver_event, record)
+
+    async def _ensure_stream(self) -> Optional[str]:
+        """stream_id resuelto; las llamadas concurrentes esperan la misma resolución (single-flight)"""
+        if self.stream_id:
+            return self.stream_id
+        if self._resolving is None:
+            self._resolving = asyncio.create_task(self._resolve_stream())
+        # shield: si se cancela quien espera, la resolución sigue para los demás
+        return await asyncio.shield(self._resolving)
+
+    async def _resolve_stream(self) -> Optional[str]:
         try:
-            if not self.stream_id:
-                print(f"⚠️ No hay stream_id, creando stream...")
-                await self._create_stream()
-                if not self.stream_id:
-                    print(f"❌ No se pudo crear el stream, no se puede enviar el evento")
-                    return
+            await self._create_stream()
+        finally:
+            self._resolving = None
+            self._last_resolve = time.monotonic()
+        if self.stream_id:
+            await self._flush_unresolved()
+        elif self._unresolved:
+            log.warning(
+                f"⚠️ Stream sin resolver, {len(self._unresolved)} eventos retenidos "
+                f"(reintento en {RESOLVE_RETRY_SECONDS:.0f}s)",
+                extra={"kind": "stream.unresolved"},
+            )
+        return self.stream_id
 
-            payload = {
-                "event_type": event_type,
-                "stream_id": self.stream_id,
-                "user_data": user_data,
-                "event_data": event_data,
-            }
+    async def _flush_unresolved(self):
+        """Envía, en orden de llegada, los eventos retenidos mientras se resolvía el stream"""
+        if not self._unresolved:
+            return
+        pending = list(self._unresolved)
+        self._unresolved.clear()
+        log.info(f"📤 Enviando {len(pending)} eventos retenidos al stream {self.stream_id}")
+        for record in pending:
+            await self._dispatch(record)
 
-            # Intentar enviar directamente primero
-            try:
-                response = requests.post(
-                    f"{self.api_url}/events",
-                    json=payload,
-                    timeout=5,
-                )
+    async def _dispatch(self, record: EventRecord):
+        record.stream_id = self.stream_id
+        if is_provisional(self.stream_id):
+            # Stream aún no creado en la API: a la cola (con el perfil completo), detrás de su stream_create
+            record.profile_unchanged = False
+            self.event_queue.add_event("event", record.to_wire(), priority=1, received_at=record.received_at)
+            return
+        record.profile_unchanged = self.profiles.unchanged(record.user)
+        # Agregar al lote actual (se serializa al enviar); si el envío falla, el batcher los pasa a la cola
+        await self.batcher.add(record)
 
-                if response.status_code == 200:
-                    print(f"✅ Evento {event_type} enviado correctamente")
-                    return
-                else:
-                    print(f"⚠️ Error enviando evento ({response.status_code}): {response.text}")
-                    # Agregar a cola para reintentar
-                    self.event_queue.add_event("event", payload, priority=1)
-            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                # API no disponible, agregar a cola
-                print(f"⚠️ API no disponible, agregando evento a la cola: {event_type}")
-                self.event_queue.add_event("event", payload, priority=1)
-            except Exception as e:
-                print(f"❌ Error enviando evento: {e}")
-                # Agregar a cola para reintentar
-                self.event_queue.add_event("event", payload, priority=1)
+    async def _deliver_event(self, record: EventRecord):
+        """Envía un evento a la API o lo agrega a la cola si falla"""
+        try:
+            if not self.stream_id:
+                # Sin stream todavía: el evento espera en memoria y se lanza (como mucho) una
+                # resolución; un fallo reciente no se reintenta en cada evento
+                if len(self._unresolved) == self._unresolved.maxlen:
+                    log.warning(
+                        f"⚠️ Buffer de eventos sin stream lleno ({self._unresolved.maxlen}), se descarta el más antiguo",
+                        extra={"kind": "stream.unresolved_full"},
+                    )
+                self._unresolved.append(record)
+                if self._resolving is None and time.monotonic() - self._last_resolve >= RESOLVE_RETRY_SECONDS:
+                    self._resolving = asyncio.create_task(self._resolve_stream())
+                return
+
+            await self._dispatch(record)
         except Exception as e:
-            print(f"❌ Error en _send_event: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Error en _send_event: {e}")
             # Intentar agregar a cola como último recurso
             try:
-                payload = {
-                    "event_type": event_type,
-                    "stream_id": self.stream_id,
-                    "user_data": user_data,
-                    "event_data": event_data,
-                }
-                self.event_queue.add_event("event", payload, priority=0)
+                record.stream_id = self.stream_id
+                record.profile_unchanged = False
+                self.event_queue.add_event("event", record.to_wire(), priority=0, received_at=record.received_at)
             except:
                 pass
 
+    def _queue_failed_events(self, events: list):
+        """Agrega a la cola persistente los eventos de un lote que no se pudo enviar"""
+        log.warning(f"⚠️ API no disponible, agregando {len(events)} eventos a la cola")
+        for event in events:
+            if isinstance(event, dict):
+                payload, received_at = event, None
+            else:
+                # Se conserva el instante de recepción para medir la latencia hasta el ACK
+                payload, received_at = event.to_wire(), event.received_at
+            user_data = payload.get("user_data") or {}
+            if not user_data.get("profile_unchanged"):
+                # El perfil completo no llegó: reenviarlo con el próximo evento del usuario
+                self.profiles.invalidate(user_data.get("username"))
+            self.event_queue.add_event("event", payload, priority=1, received_at=received_at)
+
     async def start(self):
-        """Inicia la conexión al stream"""
+        """Inicia el pipeline (solo la primera vez) y conecta al stream"""
+        started = time.monotonic()
+        self._startup = {}
+        if not self._started:
+            await self._start_pipeline()
+            self._started = True
+        await self.connect()
+        self._log_startup(started)
+
+    async def _start_pipeline(self):
+        """
+        Métricas, workers de entrega y trabajos periódicos. Sobreviven a las reconexiones:
+        solo la conexión con TikTok se reinicia (connect/disconnect)
+        """
+        started = time.monotonic()
+        # Servidor de métricas del proceso
+        await start_metrics_server(METRICS_PORT)
+        self._startup["métricas"] = time.monotonic() - started
+        started = time.monotonic()
+        # Lag del event loop y handlers que lo bloquean (también sin servidor de métricas)
+        start_loop_monitor(LOOP_LAG_INTERVAL_MS / 1000, LOOP_SLOW_CALLBACK_MS / 1000, LOOP_WARN_INTERVAL)
+        profiler.start()
+        memtracer.start()
+
+        # Iniciar workers de entrega
+        self.delivery.start()
+        
+        # Trabajo periódico en el planificador del proceso. La cola pendiente no retrasa la
+        # conexión: el primer drenado arranca ya, en segundo plano y con límite de envíos/s
+        queue_size = self.event_queue.get_queue_size()
+        scheduler.every("queue_drain", QUEUE_DRAIN_INTERVAL, self.event_queue.process_queue, delay=0 if queue_size else None)
+        scheduler.every("queue_compaction", QUEUE_COMPACT_INTERVAL, self.event_queue.compact)
+        scheduler.every("viewer_sampling", self.viewers.tick_interval, self.viewers.tick)
+        scheduler.every("session_heartbeat", 60, self._session_heartbeat)
+        log.info(f"🔄 Procesador de cola iniciado (cada {QUEUE_DRAIN_INTERVAL:.0f}s)")
+        if queue_size > 0:
+            limiter = self.event_queue.rate_limiter
+            rate = f"máx. {limiter.rate:.0f} ev/s" if limiter else "sin límite"
+            log.info(f"📦 {queue_size} eventos pendientes en la cola: se drenan en segundo plano ({rate})")
+        self._startup["pipeline"] = time.monotonic() - started
+
+    async def connect(self):
+        """Abre la conexión con TikTok (la misma instancia de TikTokLiveClient en cada reconexión)"""
         try:
-            # Iniciar procesador de cola si no está corriendo
-            if self._queue_processor_task is None:
-                async def process_queue_loop():
-                    while True:
-                        try:
-                            await self.event_queue.process_queue()
-                            await asyncio.sleep(10)  # Procesar cola cada 10 segundos
-                        except Exception as e:
-                            print(f"⚠️ Error en procesador de cola: {e}")
-                            await asyncio.sleep(10)
-                
-                self._queue_processor_task = asyncio.create_task(process_queue_loop())
-                print(f"🔄 Procesador de cola iniciado")
-            
-            # Procesar cola pendiente al iniciar
-            queue_size = self.event_queue.get_queue_size()
-            if queue_size > 0:
-                print(f"📦 Procesando {queue_size} eventos pendientes en la cola...")
-                await self.event_queue.process_queue()
-            
-            print(f"🔄 Intentando conectar al stream de @{self.username}...")
-            await self.client.start()
-            print(f"✅ Cliente iniciado, esperando eventos...")
-            print(f"💡 Si el streamer está en vivo, deberías ver '✅ [EVENTO] Conectado al stream' en breve...")
-            # Dar tiempo para que se dispare el evento ConnectEvent
-            await asyncio.sleep(5)
+            log.info(f"🔄 Intentando conectar al stream de @{self.username}...")
+            started = time.monotonic()
+            self._connection = await self.client.start()
+            self._connect_started = time.monotonic()
+            self._startup["conexión TikTok"] = self._connect_started - started
+            log.info(f"✅ Cliente iniciado, esperando eventos...")
+            log.info(f"💡 Si el streamer está en vivo, deberías ver '✅ [EVENTO] Conectado al stream' en breve...")
+            # Dar tiempo para que se dispare el evento ConnectEvent (y se resuelva el stream)
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
             
             # Verificar si se recibió el ConnectEvent
-            if not self.stream_id:
-                print(f"⚠️ No se recibió ConnectEvent después de 5 segundos.")
-                print(f"💡 Posibles razones:")
-                print(f"   - El streamer @{self.username} no está en vivo actualmente")
-                print(f"   - Hay un problema de conexión con TikTok")
-                print(f"   - El username puede ser incorrecto")
-                print(f"💡 El bot seguirá esperando. Si el streamer inicia un directo, se conectará automáticamente.")
+            if not self.connected:
+                log.warning(f"⚠️ No se recibió ConnectEvent después de 5 segundos.")
+                log.info(f"💡 Posibles razones:")
+                log.info(f"   - El streamer @{self.username} no está en vivo actualmente")
+                log.info(f"   - Hay un problema de conexión con TikTok")
+                log.info(f"   - El username puede ser incorrecto")
+                log.info(f"💡 El bot seguirá esperando. Si el streamer inicia un directo, se conectará automáticamente.")
         except Exception as e:
-            error_msg = str(e).lower()
-            print(f"❌ Error iniciando cliente: {e}")
+            error_msg = f"{type(e).__name__} {e}".lower()
+            log.error(f"❌ Error iniciando cliente: {type(e).__name__} {e}")
             
             # Detectar si el streamer no está en vivo
             if any(keyword in error_msg for keyword in ['not live', 'not streaming', 'no live', 'offline', 'unavailable', '504', 'sign_not_200']):
-                print(f"💡 El streamer @{self.username} no está en vivo actualmente")
-                print(f"💡 Espera a que comience a transmitir y vuelve a intentar")
+                log.info(f"💡 El streamer @{self.username} no está en vivo actualmente")
+                log.info(f"💡 Espera a que comience a transmitir y vuelve a intentar")
             else:
-                print(f"💡 Asegúrate de que el stream esté en vivo y el username sea correcto")
+                log.info(f"💡 Asegúrate de que el stream esté en vivo y el username sea correcto")
             raise
 
-    async def stop(self):
-        """Detiene la conexión"""
+    def _log_startup(self, started: float):
+        """Desglose del tiempo hasta estar capturando (arranque o reconexión)"""
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self._startup.items())
+        label = "Arranque" if "pipeline" in self._startup else "Reconexión"
+        backlog = self.event_queue.get_queue_size()
+        log.info(
+            f"⏱️ {label} en {(time.monotonic() - started) * 1000:.0f}ms: {phases}"
+            + (f" (cola pendiente: {backlog} eventos)" if backlog else "")
+        )
+
+    async def wait_closed(self):
+        """Espera a que termine la conexión con TikTok (propaga el error que la cerró)"""
+        if self._connection is not None:
+            await self._connection
+
+    async def disconnect(self):
+        """
+        Cierra solo la conexión con TikTok. Se entrega lo capturado hasta ahora; el
+        stream, las cachés, el pool HTTP y los trabajos periódicos siguen para la reconexión
+        """
         try:
-            if self.stream_id:
+            await self.client.disconnect()
+        except Exception as e:
+            log.info(f"Error desconectando cliente: {e}")
+        self._connection = None
+        self.connected = False
+        self._ready.clear()
+        await self.likes.flush()
+        await self.gifts.flush()
+        await self.viewers.stop()
+        self.viewers.reset()
+        await self.delivery.drain()
+        await self.batcher.flush()
+
+    def _log_latency(self):
+        """Resumen p50/p95/p99 por etapa (recepción -> ACK) de la sesión"""
+        for stage, values in tracer.get_stats().items():
+            log.info(
+                f"⏱️ Latencia {stage}: p50={values['p50'] * 1000:.1f}ms "
+                f"p95={values['p95'] * 1000:.1f}ms p99={values['p99'] * 1000:.1f}ms ({values['samples']} muestras)"
+            )
+
+    async def stop(self, end_stream: bool = True):
+        """Detiene la conexión y el pipeline; con end_stream=False el stream queda abierto para continuarlo"""
+        # Entregar primero los likes agregados, las rachas de regalos abiertas, el último viewer count, el buffer y el lote actual
+        await self.likes.flush()
+        await self.gifts.flush()
+        for job in CLIENT_JOBS:
+            scheduler.cancel(job)
+        await self.viewers.stop()
+        await self.delivery.stop()
+        if self._unresolved:
+            # Último intento de resolver el stream para no perder los eventos retenidos
+            await self._ensure_stream()
+            if self._unresolved:
+                log.warning(f"⚠️ {len(self._unresolved)} eventos sin stream se descartan al detener")
+                self._unresolved.clear()
+        await self.batcher.close()
+        self._log_latency()
+        
+        try:
+            if end_stream and self.stream_id:
                 await self._end_stream()
         except Exception as e:
-            print(f"Error finalizando stream: {e}")
+            log.info(f"Error finalizando stream: {e}")
         
-        # Intentar detener el cliente si tiene el método
+        # Desconectar de TikTok y cerrar su sesión HTTP (close() del cliente usa run_until_complete)
         try:
-            if hasattr(self.client, 'stop'):
-                if asyncio.iscoroutinefunction(self.client.stop):
-                    await self.client.stop()
-                else:
-                    self.client.stop()
-            elif hasattr(self.client, 'disconnect'):
-                if asyncio.iscoroutinefunction(self.client.disconnect):
-                    await self.client.disconnect()
-                else:
-                    self.client.disconnect()
+            await self.client.disconnect()
+            await self.client.web.close()
         except Exception as e:
-            print(f"Error deteniendo cliente: {e}")
+            log.info(f"Error deteniendo cliente: {e}")
+        
+        # Cerrar el pool de conexiones HTTP y la cola (guarda los ACKs pendientes)
+        await self.api.close()
+        self.event_queue.close()
 
 
 async def main():
     """Función principal"""
+    setup_logging()
+    configure_tracing()
     username = STREAMER_USERNAME or input("Ingresa el username del streamer: ").strip()
     
     if not username:
-        print("❌ Debes proporcionar un username")
+        log.error("❌ Debes proporcionar un username")
         return
 
     client = TikTokStreamClient(username)
@@ -1017,11 +1173,13 @@ async def main():
         # Mantener el bot corriendo
         await asyncio.Event().wait()
     except KeyboardInterrupt:
-        print("\n🛑 Deteniendo bot...")
+        log.info("🛑 Deteniendo bot...")
         await client.stop()
     except Exception as e:
-        print(f"❌ Error: {e}")
+        log.error(f"❌ Error: {e}")
         await client.stop()
+    finally:
+        shutdown_logging()
 
 
 if __name__ == "__main__":
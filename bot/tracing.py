@@ -0,0 +1,137 @@
+"""
+Trazas de latencia de extremo a extremo (recepción en TikTok -> ACK de la API)
+Cada EventRecord lleva el instante monotónico en que llegó al handler; al confirmarse
+el envío se registran las etapas:
+
+    normalize    handler -> EventRecord listo (extracción de usuario, etc.)
+    aggregate    primer like/regalo de la ventana o racha -> evento agregado
+    buffer_wait  EventRecord listo -> inicio del envío (buffer de entrega + lote)
+    send         duración de la petición a la API
+    ack          recepción -> ACK de la API (latencia total)
+    queue_ack    recepción -> ACK para eventos que pasaron por la cola persistente
+
+Se exponen p50/p95/p99 por etapa (muestras recientes) y, con TRACE_EVENTS=true,
+una línea de traza por evento en el logger "bot.trace"
+"""
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+
+from logs import get_logger
+from metrics import LATENCY_BUCKETS, metrics
+from records import EventRecord, EventType
+
+log = get_logger("trace")
+
+STAGES = ("normalize", "aggregate", "buffer_wait", "send", "ack", "queue_ack")
+QUANTILES = (0.5, 0.95, 0.99)
+# Eventos que pasan por una ventana de agregación antes de existir como EventRecord
+AGGREGATED_TYPES = frozenset((EventType.LIKE, EventType.DONATION))
+
+STAGE_SECONDS = metrics.histogram(
+    "bot_event_stage_seconds",
+    "Latencia por etapa del pipeline de eventos",
+    ("stage",),
+    buckets=(0.0005, 0.001, 0.0025) + LATENCY_BUCKETS + (30, 60, 300),
+)
+
+
+class LatencyTracer:
+    def __init__(self, samples: int = 4096, trace_log: bool = False):
+        self.trace_log = trace_log  # Una línea por evento entregado (logger "bot.trace")
+        self._samples: Dict[str, Deque[float]] = {stage: deque(maxlen=samples) for stage in STAGES}
+
+    def observe(self, stage: str, seconds: float):
+        seconds = max(0.0, seconds)
+        self._samples[stage].append(seconds)
+        STAGE_SECONDS.observe(seconds, stage)
+
+    def delivered(self, records: Iterable[EventRecord], send_started: float, acked: float):
+        """Registra las etapas de los EventRecord de un envío confirmado por la API"""
+        send = acked - send_started
+        for record in records:
+            first_stage = "aggregate" if record.type in AGGREGATED_TYPES else "normalize"
+            normalize = record.normalized_at - record.received_at
+            buffer_wait = send_started - record.normalized_at
+            total = acked - record.received_at
+            self.observe(first_stage, normalize)
+            self.observe("buffer_wait", buffer_wait)
+            self.observe("send", send)
+            self.observe("ack", total)
+            if self.trace_log:
+                log.info(
+                    "🧭 %s @%s %s=%.1fms buffer=%.1fms send=%.1fms ack=%.1fms",
+                    record.type.wire_name,
+                    record.user.username,
+                    first_stage,
+                    normalize * 1000,
+                    buffer_wait * 1000,
+                    send * 1000,
+                    total * 1000,
+                    extra={"trace": {
+                        "type": record.type.wire_name,
+                        first_stage: normalize,
+                        "buffer_wait": buffer_wait,
+                        "send": send,
+                        "ack": total,
+                    }},
+                )
+
+    def queue_delivered(self, item: Dict, acked_wall: Optional[float] = None):
+        """Registra la latencia total de un elemento de la cola persistente (reloj de pared)"""
+        received_wall = item.get("received_at")
+        if received_wall is None:
+            return
+        total = (acked_wall or time.time()) - received_wall
+        self.observe("queue_ack", total)
+        if self.trace_log:
+            log.info(
+                "🧭 cola %s reintentos=%d ack=%.1fs",
+                item.get("id"),
+                item.get("retry_count", 0),
+                total,
+                extra={"trace": {"id": item.get("id"), "retries": item.get("retry_count", 0), "queue_ack": total}},
+            )
+
+    def percentiles(self, stage: str) -> Dict[float, float]:
+        values = sorted(self._samples[stage])
+        if not values:
+            return {}
+        last = len(values) - 1
+        return {q: values[min(last, int(round(q * last)))] for q in QUANTILES}
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 (segundos) de cada etapa con muestras"""
+        stats = {}
+        for stage in STAGES:
+            values = self.percentiles(stage)
+            if values:
+                stats[stage] = {f"p{int(q * 100)}": value for q, value in values.items()}
+                stats[stage]["samples"] = len(self._samples[stage])
+        return stats
+
+
+def wall_clock(monotonic_at: float) -> float:
+    """Convierte un instante monotónico de este proceso a epoch (para persistirlo)"""
+    return time.time() - (time.monotonic() - monotonic_at)
+
+
+# Un solo tracer por proceso; TRACE_EVENTS se aplica en configure_from_env (después de load_dotenv)
+tracer = LatencyTracer()
+
+
+def configure_from_env():
+    """Activa la línea de traza por evento con TRACE_EVENTS=true"""
+    tracer.trace_log = os.getenv("TRACE_EVENTS", "false").lower() in ("1", "true", "yes")
+
+
+metrics.collector(
+    "bot_event_latency_seconds",
+    "Percentiles recientes de latencia por etapa (p50/p95/p99)",
+    lambda: [
+        ({"stage": stage, "quantile": str(q)}, value)
+        for stage in STAGES
+        for q, value in tracer.percentiles(stage).items()
+    ],
+)
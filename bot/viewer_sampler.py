@@ -0,0 +1,98 @@
+"""
+Muestreo del número de viewers
+Los JoinEvent solo actualizan el valor en memoria; el historial se guarda con una
+cadencia fija (o antes si el valor cambia más que un umbral) y el stream se
+actualiza (PATCH) como máximo una vez por intervalo. tick() lo ejecuta el
+planificador del proceso cada `tick_interval` segundos
+"""
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class ViewerSampler:
+    def __init__(
+        self,
+        on_history: Callable[[int], Awaitable[None]],
+        on_patch: Callable[[int], Awaitable[None]],
+        history_interval: float = 10,
+        patch_interval: float = 10,
+        change_threshold: float = 0.1,
+        min_change: int = 5,
+        min_gap: float = 2,
+    ):
+        self.on_history = on_history  # Guarda un punto en viewer_history
+        self.on_patch = on_patch  # Actualiza viewer_count del stream
+        self.history_interval = history_interval  # Segundos entre puntos del historial
+        self.patch_interval = patch_interval  # Segundos mínimos entre PATCH del stream
+        self.change_threshold = change_threshold  # Cambio relativo que adelanta un punto (0.1 = 10%)
+        self.min_change = min_change  # Cambio absoluto mínimo para considerar el umbral
+        self.min_gap = min_gap  # Segundos mínimos entre puntos adelantados por cambio
+
+        self.value: Optional[int] = None
+        self._last_history_value: Optional[int] = None
+        self._last_history_at = 0.0
+        self._last_patch_value: Optional[int] = None
+        self._last_patch_at = 0.0
+        self.samples = 0
+        self.history_points = 0
+        self.patches = 0
+
+    def _changed_significantly(self, value: int) -> bool:
+        previous = self._last_history_value
+        if previous is None:
+            return True
+        delta = abs(value - previous)
+        return delta >= self.min_change and delta >= previous * self.change_threshold
+
+    async def record(self, value: int):
+        """Registra el viewer count de un JoinEvent (sin I/O salvo cambios bruscos)"""
+        self.value = value
+        self.samples += 1
+        now = time.monotonic()
+        if self._changed_significantly(value) and now - self._last_history_at >= self.min_gap:
+            await self._emit_history(now)
+
+    async def _emit_history(self, now: float):
+        self._last_history_value = self.value
+        self._last_history_at = now
+        self.history_points += 1
+        await self.on_history(self.value)
+
+    async def _emit_patch(self, now: float):
+        self._last_patch_value = self.value
+        self._last_patch_at = now
+        self.patches += 1
+        await self.on_patch(self.value)
+
+    async def tick(self):
+        """Emite el punto periódico del historial y el PATCH pendiente si corresponde"""
+        if self.value is None:
+            return
+        now = time.monotonic()
+        if now - self._last_history_at >= self.history_interval:
+            await self._emit_history(now)
+        if self.value != self._last_patch_value and now - self._last_patch_at >= self.patch_interval:
+            await self._emit_patch(now)
+
+    @property
+    def tick_interval(self) -> float:
+        """Cada cuánto debe llamarse tick()"""
+        return min(self.history_interval, self.patch_interval, 1)
+
+    async def stop(self):
+        """Envía el último valor si aún no se envió (el planificador ya no llama a tick())"""
+        if self.value is not None and self.value != self._last_patch_value:
+            await self._emit_patch(time.monotonic())
+
+    def reset(self):
+        """Olvida el último valor (al desconectar: no se sigue muestreando un directo que no se ve)"""
+        self.value = None
+        self._last_patch_value = None
+
+    def get_stats(self) -> Dict:
+        return {
+            "value": self.value,
+            "samples": self.samples,
+            "history_points": self.history_points,
+            "patches": self.patches,
+        }